@@ -3,17 +3,35 @@ from rich.logging import RichHandler
 from rich.console import Console
 
 from .booking import Ntuple
+from .booking import ArrowNtuple
 from .booking import Dataset
 from .booking import Cut
 from .booking import Weight
 from .booking import Selection
 from .booking import Histogram
+from .booking import BootstrapHistogram
+from .booking import Cutflow
 from .booking import dataset_from_artusoutput
 from .booking import dataset_from_files
+from .booking import dataset_from_arrow_files
 from .booking import Unit
 from .booking import UnitManager
 from .optimization import GraphManager
 from .run import RunManager
+from .run import IOProfile
+from .run import StagingCache
+from .run import SkimCache
+from .run import EntryListCache
+from .run import ZoneMapCache
+from .run import Results
+from .run import ShardedOutput
+from .run import MemoryBudget
+from .run import RunProfile
+from .run import Progress
+from .run import PartialSnapshots
+from .run import LocalExecutor
+from .run import HTCondorExecutor
+from .run import DaskExecutor
 from .variations import ReplaceCut
 from .inspect import get_dataframe
 from .post_process import Customizer
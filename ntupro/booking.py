@@ -1,16 +1,16 @@
 from .utils import Dataset
 from .utils import Selection
 from .utils import Ntuple
+from .utils import ArrowNtuple
 from .utils import Cut
 from .utils import Weight
 from .utils import Action
 from .utils import Count
+from .utils import Cutflow
 from .utils import Histogram
+from .utils import BootstrapHistogram
 from .utils import Variation
-
-from ROOT import gROOT
-gROOT.SetBatch(True)
-from ROOT import TFile
+from .utils import load_root
 
 import os
 import re
@@ -54,7 +54,7 @@ def dataset_from_artusoutput(
         dataset (Dataset): Dataset object containing TTrees
     """
     def get_full_tree_name(folder, path_to_root_file, tree_name):
-        root_file = TFile(path_to_root_file)
+        root_file = load_root().TFile(path_to_root_file)
         if root_file.IsZombie():
             raise FileNotFoundError('File {} does not exist, abort'.format(path_to_root_file))
         if folder not in root_file.GetListOfKeys():
@@ -123,7 +123,7 @@ def dataset_from_files(dataset_name, tree_name, file_names, be_picky = True):
     def return_existent_tuple(file_name, tree_name):
         # Use TFile.Open() instead of TFile() in order to deal with
         # files accessed from remote
-        root_file = TFile.Open(file_name)
+        root_file = load_root().TFile.Open(file_name)
         if not root_file or root_file.IsZombie():
             raise FileNotFoundError('File {} does not exist, abort'.format(file_name))
         try:
@@ -149,6 +149,30 @@ def dataset_from_files(dataset_name, tree_name, file_names, be_picky = True):
     return Dataset(dataset_name, ntuples)
 
 
+def dataset_from_arrow_files(dataset_name, file_names, file_format = None):
+    """Create a Dataset object from a list containing the names
+    of Parquet or Arrow IPC files (e.g. [file1.parquet, file2.parquet, (...)]):
+    E.g.:
+        my_dataset = dataset_from_arrow_files('my_dataset', ['f1.parquet', 'f2.parquet'])
+
+    Args:
+        dataset_name (str): Name of the dataset
+        file_names (list): List containing the names of the files
+        file_format (str): Either 'parquet' or 'arrow'; if not given, it
+            is inferred from the extension of each file
+
+    Returns:
+        dataset (Dataset): Dataset object containing ArrowNtuple objects
+    """
+    if not isinstance(file_names, list):
+        raise TypeError('A list containing file names is required')
+    for file_name in file_names:
+        if not os.path.exists(file_name):
+            raise FileNotFoundError('File {} does not exist, abort'.format(file_name))
+    ntuples = [ArrowNtuple(file_name, file_format = file_format) for file_name in file_names]
+    return Dataset(dataset_name, ntuples)
+
+
 class Unit:
     """
     Building element of a minimal analysis flow, consisting
@@ -160,7 +184,7 @@ class Unit:
             analysis on
         selections (list): List of Selection-type objects
         actions (Action): Actions to perform on the processed
-            dataset, can be 'Histogram' or 'Count'
+            dataset, can be 'Histogram', 'Count' or 'Cutflow'
         variation (Variation): Variations applied, meaning
             that this selection is the result of a variation
             applied on other selections
@@ -170,7 +194,7 @@ class Unit:
             analysis on
         selections (list): List of Selection-type objects
         actions (Action): Actions to perform on the processed
-            dataset, can be 'Histogram' or 'Count'
+            dataset, can be 'Histogram', 'Count' or 'Cutflow'
         variation (Variation): Variations applied, meaning
             that this selection is the result of a variation
             applied on other selections
@@ -222,16 +246,26 @@ class Unit:
                 raise TypeError('not a Variation object.')
             self.variation = variation
             name = action.name.replace('Nominal', self.variation.name)
-        if isinstance(action, Histogram):
+        if isinstance(action, BootstrapHistogram):
+            if action.edges:
+                setting = action.edges
+            else:
+                setting = (action.nbins, action.low, action.up)
+            return BootstrapHistogram(name, action.variable, setting,
+                    action.nreplicas, action.seed, action.event_variable,
+                    action.split_replicas, action.expression, action.prerequisites)
+        elif isinstance(action, Histogram):
             if action.edges:
                 return Histogram(name, action.variable, action.edges,
-                        action.expression, action.prerequisites)
+                        action.expression, action.prerequisites, action.storage)
             else:
                 return Histogram(name, action.variable,
                         (action.nbins, action.low, action.up),
-                        action.expression, action.prerequisites)
+                        action.expression, action.prerequisites, action.storage)
         elif isinstance(action, Count):
             return Count(name, action.variable, action.prerequisites)
+        elif isinstance(action, Cutflow):
+            return Cutflow(name)
 
     def __eq__(self, other):
         return self.dataset == other.dataset and \
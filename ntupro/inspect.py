@@ -1,9 +1,15 @@
-from ROOT import RDataFrame
 from .utils import rdf_from_dataset_helper
+from .utils import is_arrow_dataset
+from .utils import rdf_from_arrow_dataset
+from .utils import load_root
 
 def get_dataframe(dataset):
+    if is_arrow_dataset(dataset):
+        rdf, arrays = rdf_from_arrow_dataset(dataset, None)
+        setattr(rdf, 'arrays', arrays)
+        return rdf
     tchain, friend_tchains = rdf_from_dataset_helper(dataset)
-    rdf = RDataFrame(tchain)
+    rdf = load_root().RDataFrame(tchain)
     setattr(rdf, 'tchain', tchain)
     setattr(rdf, 'friend_tchains', friend_tchains)
     return rdf
@@ -5,7 +5,14 @@ from .booking import Unit
 from .booking import Selection
 from .booking import Cut
 from .booking import Weight
+from .booking import Dataset
 from .utils import Node
+from .utils import shared_prefix
+from .utils import overlapping_groups
+from .utils import union_of_ntuples
+from .utils import pack_datasets
+from .utils import count_entries
+from .utils import mergeable
 from .utils import PrintedNode
 from .utils import drawTree2
 
@@ -80,6 +87,13 @@ class Graph(Node):
                     priority[node] = number
         return priority
 
+    def shared_prefix(self):
+        """ Return the selection nodes that all the paths of
+        the graph go through before branching off (e.g. trigger
+        and object preselection), in order from the root.
+        """
+        return shared_prefix(self)
+
     def __nodes_from_unit(self, unit):
         nodes = list()
         last_node = list()
@@ -123,6 +137,43 @@ class Graph(Node):
         return nodes
 
 
+class MergedGraph(Graph):
+    """
+    Graph running in a single event loop the graphs of datasets which share
+    ntuples. The dataset of the root node contains the union of their
+    ntuples, each read once; every former graph hangs from a node of kind
+    'membership', whose unit block is the original dataset, that lets
+    through only the entries of the files belonging to it and is therefore
+    the first filter of the former root.
+
+    Args:
+        graphs (list): Graphs to be merged
+        packed (Bool): If True, the datasets have no ntuple in common, and
+            membership is checked on a column with the index of the dataset
+            each file belongs to, defined once for all the datasets
+
+    Attributes:
+        graphs (list): Graphs merged
+        packed (Bool): If True, the datasets have no ntuple in common
+        paths (dict): Union of the paths of the graphs merged
+    """
+    def __init__(self, graphs, packed = False):
+        logger.debug('%%%%%%%%%% Constructing merged graph from {}'.format(graphs))
+        self.graphs = graphs
+        self.packed = packed
+        self.paths = dict()
+        self.split_selections = graphs[0].split_selections
+        datasets = [graph.unit_block for graph in graphs]
+        dataset = Dataset('+'.join([d.name for d in datasets]),
+            union_of_ntuples(datasets))
+        Node.__init__(self, dataset.name, 'dataset', dataset)
+        for graph in graphs:
+            membership = Node(graph.name, 'membership', graph.unit_block)
+            membership.children.extend(graph.children)
+            self.paths.update(graph.paths)
+            self.children.append(membership)
+
+
 class GraphManager:
     """
     Manager for Graph-type objects, with the main function of
@@ -152,10 +203,15 @@ class GraphManager:
         elif int(level) == 1:
             logger.debug('Level 1 optimization selected: merge datasets.')
             self.merge_datasets()
-        elif int(level) >= 2:
+        elif int(level) == 2:
             logger.debug('Level 2 optimization selected: merge datasets and selections.')
             self.merge_datasets()
             self.optimize_selections()
+        elif int(level) >= 3:
+            logger.debug('Level 3 optimization selected: merge datasets, selections and overlapping datasets.')
+            self.merge_datasets()
+            self.optimize_selections()
+            self.merge_overlapping_datasets()
         else:
             logger.debug('Invalid level of optimization, default to FULL OPTIMIZED.')
             self.merge_datasets()
@@ -177,6 +233,59 @@ class GraphManager:
         self.graphs = merged_graphs
         logger.debug('%%%%%%%%%% Merging datasets: DONE')
 
+    def merge_overlapping_datasets(self):
+        """Merge into a MergedGraph the graphs whose datasets share
+        ntuples (with the same tree name and friends), so that the
+        files they have in common are read once.
+        """
+        logger.debug('%%%%%%%%%% Merging overlapping datasets:')
+        groups = overlapping_groups([graph.unit_block for graph in self.graphs])
+        merged_graphs = list()
+        for group in groups:
+            if len(group) == 1:
+                merged_graphs.append(self.graphs[group[0]])
+            else:
+                merged_graphs.append(MergedGraph([self.graphs[i] for i in group]))
+        self.graphs = merged_graphs
+        logger.debug('%%%%%%%%%% Merging overlapping datasets: DONE')
+
+    def pack_small_datasets(self, max_entries = 1000000, entries = None):
+        """Pack the graphs of small datasets with the same tree name and friends
+        into MergedGraphs of at most max_entries entries, so that many small
+        samples pay the cost of a single chain and event loop, while large
+        ones stay separate. Graphs already merged are left alone.
+
+        Args:
+            max_entries (int): Maximum number of entries of a pack
+            entries (dict): Number of entries of each dataset, by name;
+                the datasets not found are counted reading their files
+        """
+        logger.debug('%%%%%%%%%% Packing small datasets:')
+        if entries is None:
+            entries = dict()
+        # Only datasets which can share a chain are counted, and each only
+        # until it is known to be too large to be packed
+        candidates = list()
+        others = list()
+        for graph in self.graphs:
+            if not isinstance(graph, MergedGraph) and mergeable(graph.unit_block):
+                candidates.append(graph)
+            else:
+                others.append(graph)
+        datasets = [graph.unit_block for graph in candidates]
+        counts = [entries[dataset.name] if dataset.name in entries \
+                else count_entries(dataset, max_entries) for dataset in datasets]
+        packed_graphs = list()
+        for pack in pack_datasets(datasets, counts, max_entries):
+            if len(pack) == 1:
+                packed_graphs.append(candidates[pack[0]])
+            else:
+                logger.debug('Packing {} datasets with {} entries'.format(
+                    len(pack), sum([counts[i] for i in pack])))
+                packed_graphs.append(MergedGraph([candidates[i] for i in pack], packed = True))
+        self.graphs = packed_graphs + others
+        logger.debug('%%%%%%%%%% Packing small datasets: DONE')
+
     def optimize_selections(self):
         logger.debug('%%%%%%%%%% Optimizing selections:')
         for merged_graph in self.graphs:
@@ -1,22 +1,36 @@
-import ROOT
 from .run import RunManager
+from .utils import Results
+from .utils import ShardedResults
+from .utils import is_sharded_output
+from .utils import load_root
 
 
 class Customizer:
 
     def __init__(self, source):
         self.histos = {}
-        if isinstance(source, str):
+        ROOT = load_root()
+        if isinstance(source, str) and is_sharded_output(source):
+            # Histograms are read from their shard when first used
+            self.histos = ShardedResults(source, classes = ['TH1D', 'TH1F'])
+        elif isinstance(source, str):
             self.source_file = ROOT.TFile(source)
             names = [key.GetName() for key in self.source_file.GetListOfKeys()]
             for name in names:
                 obj = self.source_file.Get(name)
                 if isinstance(obj, (ROOT.TH1D, ROOT.TH1F)):
                     self.histos[name] = obj
-        elif isinstance(source, RunManager):
-            pass
+        elif isinstance(source, (RunManager, Results)):
+            # Results of a run in the same process, no file is read
+            results = source.results if isinstance(source, RunManager) else source
+            if results is None:
+                raise ValueError('RunManager has not been run yet')
+            for name in results:
+                obj = results.root(name)
+                if isinstance(obj, (ROOT.TH1D, ROOT.TH1F)):
+                    self.histos[name] = obj
         else:
-            raise TypeError('type of source argument can be only str or RunManager')
+            raise TypeError('type of source argument can be only str, RunManager or Results')
 
     def load_style_macro(self, macro_name):
         """Load style macro with inside defined a function with the same name
@@ -27,6 +41,7 @@ class Customizer:
                 function with the same name of the file (e.g. 'setStyle.C' must
                 define the function 'void setStyle() {}')
         """
+        ROOT = load_root()
         ROOT.gInterpreter.ProcessLine('#include "{}"'.format(macro_name))
         function_name = macro_name.split('.')[0]
         setattr(self, function_name, getattr(ROOT, function_name))
@@ -1,18 +1,84 @@
 from multiprocessing import Pool
+from functools import partial
+from copy import copy
 from time import time
+import os
+import re
 
 from .utils import Count
+from .utils import Cutflow
 from .utils import Histogram
+from .utils import BootstrapHistogram
 from .utils import RDataFrameCutWeight
+from .utils import SelectionStep
+from .utils import CountPointer
+from .utils import CutflowPointer
+from .utils import BootstrapPointer
+from .utils import SparsePointer
+from .utils import declare_sparse_helpers
+from .utils import declare_float_helpers
+from .utils import action_column
+from .utils import sparse_entry_expression
+from .utils import histogram_axis
+from .utils import declare_bootstrap_helpers
+from .utils import raw_cutflow_name
 from .utils import rdf_from_dataset_helper
-
-from ROOT import gROOT
-gROOT.SetBatch(True)
-from ROOT import RDataFrame
-from ROOT import TFile
-from ROOT import TChain
-from ROOT import EnableImplicitMT
-from ROOT.std import vector
+from .utils import is_arrow_dataset
+from .utils import rdf_from_arrow_dataset
+from .utils import column_types_from_chain
+from .utils import column_types_from_frame
+from .utils import split_replicas
+from .utils import detach_result
+from .utils import release_objects
+from .utils import graph_identifiers
+from .utils import GraphCodeGenerator
+from .utils import compile_graph_source
+from .utils import ColumnarGraphRunner
+from .utils import split_graph_by_ntuples
+from .utils import merge_results
+from .utils import load_root
+from .utils import IOProfile
+from .utils import IOCounters
+from .utils import StagingCache
+from .utils import SkimCache
+from .utils import EntryListCache
+from .utils import cacheable
+from .utils import prefix_candidates
+from .utils import ZoneMapCache
+from .utils import graph_actions
+from .utils import declare_membership_helpers
+from .utils import membership_column
+from .utils import membership_expression
+from .utils import dataset_id_expression
+from .utils import replace_dataset
+from .utils import DATASET_ID_COLUMN
+from .utils import shared_prefix
+from .utils import Plan
+from .utils import graph_plans
+from .utils import export_results
+from .utils import import_results
+from .utils import block_name
+from .utils import release_blocks
+from .utils import Results
+from .utils import ShardedOutput
+from .utils import ShardedResults
+from .utils import MemoryBudget
+from .utils import resident_memory
+from .utils import peak_resident_memory
+from .utils import GraphProfile
+from .utils import RunProfile
+from .utils import format_profile
+from .utils import filter_counts
+from .utils import ProgressBoard
+from .utils import Progress
+from .utils import PartialSnapshots
+from .utils import declare_progress_helpers
+from .utils import Executor
+from .utils import LocalExecutor
+from .utils import HTCondorExecutor
+from .utils import DaskExecutor
+from .utils import task_costs
+from .utils import pack_tasks
 
 import logging
 logger = logging.getLogger(__name__)
@@ -25,32 +91,202 @@ class RunManager:
     following:
         Dataset()     -->   RDataFrame()
         Selection()   -->   Filter()
-        Count()       -->   Sum()
-        Histogram()   -->   Histo1D()
+        Count()       -->   Sum<T>()
+        Histogram()   -->   Histo1D<T, W>()
+        Cutflow()     -->   Count() and Sum() at every Filter()
+        membership    -->   DefinePerSample() and Filter() on the file
+        BootstrapHistogram()   -->   Histo2D() of the replicas
+
+    Three backends are available:
+        'rdataframe': the graph is booked node by node through PyROOT,
+            with the expressions compiled just in time by the interpreter
+            and the actions booked through typed, templated calls, with the
+            column types resolved up front from the branches of the dataset
+        'compiled': the whole graph is translated into a single C++
+            function with typed Filters, Defines and actions, compiled
+            with ACLiC and cached on disk by hash of the generated code;
+            functions used in the expressions have to be provided as
+            header files through 'includes'; histograms with sparse storage
+            are not supported
+        'columnar': the columns used by the graph are read with uproot
+            in chunks and the graph is evaluated on numpy arrays, with
+            one boolean mask per selection node shared by its children;
+            only flat columns and simple expressions (arithmetic, comparisons,
+            logical operators and mathematical functions) are supported.
+            The graphs are split per ntuple, and the partial results merged,
+            so that the workers are kept busy also with few large datasets
 
     Args:
         graphs (list): List of Graph objects that are converted
             node by node to RDataFrame operations
+        backend (str): One of 'rdataframe', 'compiled' or 'columnar'
+        cache_dir (str): Directory where the generated code and the
+            compiled libraries are stored, used by the 'compiled' backend
+        includes (list): Header files included in the generated code,
+            used by the 'compiled' backend
+        prune_columns (Bool): If True, only the friend chains and the
+            branches referenced by the expressions of a graph are attached,
+            enabled and added to the TTreeCache; off by default, since a
+            column used in a way the expression scanner does not see (in a
+            macro, an alias or a function of the included headers) would be
+            read as disabled or missing
+        io_profile (IOProfile): Cache and prefetch settings applied to the
+            chains; bytes read, read calls and (if measured) time waiting
+            on I/O are logged for every graph
+        staging (StagingCache): If given, the files of each dataset are
+            copied to a local directory before its event loop; when running
+            locally, they are staged in background (in a separate process)
+            in the order in which the graphs are processed, and pinned while
+            a worker reads them
+        skims (SkimCache): If given, the events passing the cuts shared by
+            all the paths of a graph are written (by the 'rdataframe' backend,
+            in the same event loop) to a skim with only the columns needed,
+            which is read instead of the dataset by later runs
+        entry_lists (EntryListCache): If given, the entries passing each
+            selection node are recorded (by single-threaded 'rdataframe'
+            loops) and later runs read only the entries passing the deepest
+            node of the shared prefix of each graph
+        zone_maps (ZoneMapCache): If given, the minimum and maximum of the
+            columns compared with constants in the cuts are recorded for every
+            cluster of every file, and the clusters (or whole files) that
+            cannot contain entries passing any path of a graph are not read
+            by the ROOT backends
+        shared_memory (Bool): If True, the workers of run_locally write bin
+            contents and squared weights of the histograms into shared memory
+            and only small descriptors are pickled; the parent rebuilds the
+            ROOT histograms when writing them. Requires numpy
+        shards (ShardedOutput): If given, each task writes its results to
+            its own file, in directories per dataset and variation, and an
+            index of the results is written at the end; the output file of
+            the run methods is not used
+        memory_budget (MemoryBudget): If given, the memory needed by the
+            results of each graph (one copy per thread) is estimated, and
+            graphs exceeding the budget are run in several passes, each with
+            part of the actions
+        profile_output (str): If given, the profile of each run (times,
+            events, memory and filter efficiencies per task) is written
+            to this JSON file
+        progress (Progress): If given, the entries processed by every task
+            are reported to the parent while run_locally is running, and
+            the progress of the run (throughput and estimated time left)
+            is logged at regular intervals; the 'compiled' backend only
+            reports the tasks when they are finished
+        snapshots (PartialSnapshots): If given, partial results of the
+            selected histograms are written while the event loops are
+            running ('rdataframe' and 'columnar' backends)
 
     Attributes:
         graphs (list): List of graphs to be processed
-        tchains (list): List of TChains created, saved as attribute
-            for the class in order to not let them go out of scope
-        friend_tchains (list): List of friend TChains created,
-            saved as attribute for the class in otder to not let
-            them out of scope
+        backend (str): One of 'rdataframe', 'compiled' or 'columnar'
+        cache_dir (str): Directory where the generated code and the
+            compiled libraries are stored
+        includes (list): Header files included in the generated code
+        prune_columns (Bool): If True, unused friends and branches are
+            not read
+        io_profile (IOProfile): Cache and prefetch settings of the chains
+        io_counters (IOCounters): I/O counters of the graph being processed
+        staging (StagingCache): Local copies of the files
+        staged_dataset (Dataset): Dataset whose staged files are pinned
+            while its graph is processed
+        skims (SkimCache): Skims of the shared prefixes of the graphs
+        skim_request (SkimRequest): Skim booked for the graph being processed
+        entry_lists (EntryListCache): Entries passing the selection nodes
+        entry_records (list): Entries of the selection nodes booked for
+            the graph being processed
+        entry_nodes (list): Nodes of the shared prefix whose entries are
+            recorded for the graph being processed
+        zone_maps (ZoneMapCache): Minimum and maximum of the columns per cluster
+        shared_memory (Bool): If True, histograms are returned through shared memory
+        shards (ShardedOutput): Sharded output of the runs
+        memory_budget (MemoryBudget): Maximum memory of the results of a graph
+        dataset_ids (dict): Index of each dataset of the packed graph being
+            processed, by name
+        results (Results): Results of the last run
+        profile_output (str): JSON file where the profile of a run is written
+        profile (RunProfile): Profile of the last run; the merged profiles
+            are also attached to the graphs and their selection nodes
+        graph_profile (GraphProfile): Profile of the graph being processed
+        filter_reports (list): Reports of the filters of the graph being
+            processed, with the path of their nodes
+        event_counter: Count of the entries of the graph being processed
+        progress (Progress): Settings of the progress reports
+        snapshots (PartialSnapshots): Partial results written during the runs
+        board (ProgressBoard): Entries processed by the tasks of the run,
+            shared by the parent and the workers
+        task_id (int): Index of the task being processed
+        memory_usage (list): Resident memory of the process in bytes before
+            and after each graph processed, as (graph, before, after)
+        tchains (list): List of TChains created for the graph being
+            processed, saved as attribute for the class in order to not
+            let them go out of scope; released after the graph
+        friend_tchains (list): List of friend TChains created for the
+            graph being processed, saved as attribute for the class in
+            order to not let them out of scope; released after the graph
+        rcws (list): Frames of the dataset nodes of the graph being
+            processed, released after the graph
     """
-    def __init__(self, graphs):
+    backends = ['rdataframe', 'compiled', 'columnar']
+
+    def __init__(self, graphs, backend = 'rdataframe',
+            cache_dir = None, includes = None, prune_columns = False,
+            io_profile = None, staging = None, skims = None, entry_lists = None,
+            zone_maps = None, shared_memory = False, shards = None,
+            memory_budget = None, profile_output = None, progress = None,
+            snapshots = None):
         self.graphs = graphs
+        if backend not in self.backends:
+            raise ValueError('Unknown backend {}, allowed backends are: {}'.format(
+                backend, ', '.join(self.backends)))
+        self.backend = backend
+        if backend == 'compiled':
+            sparse = [action.name for graph in graphs for action in graph_actions(graph) \
+                    if isinstance(action, Histogram) and action.storage == 'sparse']
+            if sparse:
+                raise ValueError('Sparse storage is not supported by the compiled backend, used by: {}'.format(
+                    ', '.join(sparse)))
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'ntupro')
+        self.cache_dir = cache_dir
+        self.includes = includes if includes else list()
+        self.prune_columns = prune_columns
+        self.io_profile = io_profile if io_profile is not None else IOProfile()
+        self.io_counters = None
+        self.staging = staging
+        self.staged_dataset = None
+        self.skims = skims
+        self.skim_request = None
+        self.entry_lists = entry_lists
+        self.entry_records = list()
+        self.entry_source = None
+        self.entry_nodes = list()
+        self.zone_maps = zone_maps
+        self.shared_memory = shared_memory
+        self.shards = shards
+        self.memory_budget = memory_budget
+        self.dataset_ids = dict()
+        self.nthreads = 1
         self.tchains = list()
         self.friend_tchains = list()
         self.rcws = list()
+        self.memory_usage = list()
+        self.profile_output = profile_output
+        self.profile = None
+        self.graph_profile = None
+        self.filter_reports = list()
+        self.event_counter = None
+        self.progress = progress
+        self.snapshots = snapshots
+        self.board = None
+        self.task_id = None
+        self.results = None
 
-    def run_locally(self, output, nworkers = 1, nthreads = 1):
-        """Save to file the histograms booked.
+    def run_locally(self, output = None, nworkers = 1, nthreads = 1):
+        """Compute the histograms booked and save them to file; they are
+        also returned (and kept in the attribute results) as a Results object.
 
         Args:
-            output (str): Name of the output .root file
+            output (str): Name of the output .root file; if None, the
+                results are only returned
             nworkers (int): number of slaves passed to the
                 multiprocessing.Pool() function
             nthreads (int): number of threads passed to the
@@ -65,99 +301,591 @@ class RunManager:
             raise TypeError('wrong type for nworkers')
         if nworkers < 1:
             raise ValueError('nworkers has to be larger zero')
+        self.__check_output(output)
         logger.info('Start computing locally results of {} graphs using {} workers with {} thread(s) each'.format(
             len(self.graphs), nworkers, nthreads))
         start = time()
-        pool = Pool(nworkers)
-        final_results = list(pool.map(self._get_results_from_graph, self.graphs))
-        final_results = [j for i in final_results for j in i]
+        tasks, origins = self.__tasks()
+        # Workers get a copy of the manager without graphs once, and then
+        # only the compact plan of each of their tasks
+        plans = graph_plans(tasks)
+        board = ProgressBoard(len(tasks)) if self.progress is not None else None
+        pool = Pool(nworkers, initializer = _init_worker,
+                initargs = (self.__worker_manager(board),))
+        if self.staging is not None:
+            # Started once the workers are forked, in a process of its
+            # own, so that no thread or lock is inherited by the workers
+            self.staging.prefetch([task.unit_block for task in tasks], nworkers)
+        try:
+            pending = pool.map_async(_run_task, enumerate(plans))
+            if board is not None:
+                self.__monitor(pool, pending, board, start)
+            outputs = list(pending.get())
+        except BaseException:
+            if self.shared_memory:
+                # The blocks of the tasks already done have no owner left
+                pool.terminate()
+                pool.join()
+                release_blocks([block_name(os.getpid(), i) for i in range(len(tasks))])
+            raise
+        finally:
+            if self.staging is not None:
+                self.staging.stop_prefetch()
+        pool.close()
+        pool.join()
+        final_results = [output for output, _ in outputs]
+        self.__store_profile([profile for _, profile in outputs], origins,
+            nworkers, time() - start)
+        if self.shards is not None:
+            # Every worker has written its shard, only the index is left
+            entries = dict()
+            for shard_entries in final_results:
+                entries.update(shard_entries)
+            logger.info('Finished computations in {} seconds'.format(int(time() - start)))
+            return self.__store_shards(entries)
+        if self.shared_memory:
+            final_results = [import_results(results) for results in final_results]
+        final_results = self.__harvest(final_results)
         end = time()
         logger.info('Finished computations in {} seconds'.format(int(end - start)))
-        logger.info('Write {} results from {} graphs to file {}'.format(
-            len(final_results), len(self.graphs), output))
-        self.__write_results_to_root_file(output, final_results)
+        return self.__store_results(output, final_results)
 
-    def run_on_htcondor(self, output, map_tag = 'ntupro'):
-        try:
-            import htmap
-        except ImportError:
-            raise ImportError('run_on_htcondor cannot run without htmap; install it with `pip install htmap` and try again')
-        logger.info('Start computing locally results of {} graphs on HTCondor'.format(len(self.graphs)))
+    def run_on_htcondor(self, output = None, map_tag = 'ntupro', target_runtime = None):
+        """Compute the results with one HTCondor job per graph or, if
+        target_runtime is given, per bundle of tasks (see run_with).
+        """
+        return self.run_with(HTCondorExecutor(map_tag), output, target_runtime)
+
+    def run_with(self, executor, output = None, target_runtime = None, profile = None):
+        """Compute the results running bundles of tasks with an executor,
+        e.g. LocalExecutor, HTCondorExecutor or DaskExecutor. If
+        target_runtime is given, the tasks (with datasets of several ntuples
+        split per ntuple if their cost exceeds it) are packed into bundles
+        of at most target_runtime seconds of estimated cost, from the
+        profile of a previous run if available. With shards, the results
+        are sent back and the shards written one after the other by this
+        process, since the jobs do not necessarily share its filesystem;
+        only run_locally writes them in parallel.
+
+        Args:
+            executor (Executor): Executor running the bundles
+            output (str): Name of the output .root file; if None, the
+                results are only returned
+            target_runtime (float): Seconds of estimated cost per bundle;
+                if None, every task is a bundle
+            profile (RunProfile): Profile (or path of the JSON file) of a
+                previous run used to estimate the costs; by default the
+                profile of the last run of this manager, if any
+        """
+        self.__check_output(output)
         start = time()
-        final_results = htmap.map(self._get_results_from_graph, self.graphs, tag = map_tag)
-        final_results.wait(show_progress_bar = True)
-        final_results = [j for i in final_results for j in i]
+        if isinstance(profile, str):
+            profile = RunProfile.read(profile)
+        elif profile is None:
+            profile = self.profile
+        tasks, origins = self.__tasks()
+        split = self.backend == 'columnar' and self.shards is None
+        costs = task_costs(tasks, profile)
+        if target_runtime is not None and not split and self.shards is None:
+            # Partial results of the chunks are merged by the parent
+            chunks = [(i, chunk) for i, task, cost in zip(origins, tasks, costs) \
+                    for chunk in (split_graph_by_ntuples(task) \
+                        if cost > target_runtime else [task])]
+            split = len(chunks) > len(tasks)
+            tasks, origins = [chunk for _, chunk in chunks], [i for i, _ in chunks]
+            costs = task_costs(tasks, profile)
+        bundles = pack_tasks(costs, target_runtime)
+        logger.info('Start computing results of {} graphs in {} tasks and {} jobs with {}'.format(
+            len(self.graphs), len(tasks), len(bundles), executor.name))
+        plans = graph_plans(tasks)
+        jobs = [[(task_id, plans[task_id]) for task_id in bundle] for bundle in bundles]
+        outputs = dict()
+        for job_outputs in executor.map(partial(_run_bundle, self.__worker_manager()), jobs):
+            for task_id, results, task_profile in job_outputs:
+                outputs[task_id] = (results, task_profile)
+        final_results = [outputs[task_id][0] for task_id in range(len(tasks))]
+        self.__store_profile([outputs[task_id][1] for task_id in range(len(tasks))],
+            origins, len(bundles), time() - start)
+        if self.shards is not None:
+            # The shards are written here, since the workers do not
+            # necessarily share the filesystem of the submitting machine
+            entries = dict()
+            for task_id, results in enumerate(final_results):
+                entries.update(self.shards.write_shard(task_id, results))
+            return self.__store_shards(entries)
+        final_results = self.__harvest(final_results, split)
         end = time()
         logger.info('Finished computations in {} seconds'.format(int(end - start)))
-        logger.info('Write {} results from {} graphs to file {}'.format(
-            len(final_results), len(self.graphs), output))
-        self.__write_results_to_root_file(output, final_results)
+        return self.__store_results(output, final_results)
+
+    def __check_output(self, output):
+        if self.shards is not None and output is not None:
+            raise ValueError('Results are written to {}, output cannot be used with shards'.format(
+                self.shards.directory))
+
+    def __store_profile(self, profiles, origins, nworkers, wall_time):
+        self.profile = RunProfile(self.backend, nworkers, self.nthreads)
+        self.profile.wall_time = wall_time
+        for profile in profiles:
+            self.profile.add(profile)
+        self.profile.annotate(self.graphs, origins)
+        events = self.profile.events()
+        logger.info('Processed {} events in {:.1f} seconds ({:.0f} events/s)'.format(
+            events, wall_time, events / wall_time if wall_time > 0 else 0.))
+        for graph in self.graphs:
+            logger.debug('Profile of graph {}:\n{}'.format(repr(graph), format_profile(graph)))
+        if self.profile_output is not None:
+            self.profile.write(self.profile_output)
+
+    def __store_shards(self, entries):
+        self.shards.write_index(entries)
+        self.results = ShardedResults(self.shards.directory)
+        return self.results
+
+    def __monitor(self, pool, pending, board, start):
+        # Report the progress until all the tasks are done, the workers
+        # update the board from the callbacks of their event loops
+        while not pending.ready():
+            pending.wait(self.progress.interval)
+            if pending.ready():
+                break
+            if not self.progress.report(board, start):
+                pool.terminate()
+                pool.join()
+                raise RuntimeError('Run aborted after {:.0f} seconds by the progress callback'.format(
+                    time() - start))
+
+    def __worker_manager(self, board = None):
+        manager = copy(self)
+        manager.board = board
+        if self.progress is not None:
+            # Callbacks are only called by the parent
+            manager.progress = copy(self.progress)
+            manager.progress.callback = None
+        manager.graphs = list()
+        manager.tchains = list()
+        manager.friend_tchains = list()
+        manager.rcws = list()
+        manager.memory_usage = list()
+        manager.profile = None
+        manager.results = None
+        return manager
+
+    def __tasks(self):
+        # The columnar backend processes the ntuples of a dataset
+        # independently, the other ones one graph at a time; with shards,
+        # each task writes final results, thus graphs are not split
+        # Returns also the index of the graph of each task
+        tasks = [(i, graph) for i, graph in enumerate(self.graphs)]
+        if self.memory_budget is not None:
+            # The columnar backend keeps one copy of the results
+            nthreads = 1 if self.backend == 'columnar' else self.nthreads
+            tasks = [(i, task) for i, graph in tasks \
+                    for task in self.memory_budget.split(graph, nthreads)]
+        if self.backend == 'columnar' and self.shards is None:
+            tasks = [(i, task) for i, graph in tasks \
+                    for task in split_graph_by_ntuples(graph)]
+        return [task for _, task in tasks], [i for i, _ in tasks]
+
+    def __harvest(self, results, split = None):
+        # Partial results of graphs split per ntuple are merged
+        results = [j for i in results for j in i]
+        if split is None:
+            split = self.backend == 'columnar'
+        if split:
+            results = merge_results(results)
+        return results
+
+    def _get_results_from_graph(self, graph, task_id = None):
+        # Every graph is built, run and harvested, and then its chains and
+        # frames are released, so that the memory of a worker stays flat
+        # over many graphs
+        self.graph_profile = GraphProfile(graph, task_id)
+        self.task_id = task_id if task_id is not None else 0
+        if self.board is not None:
+            self.board.start(self.task_id)
+        before = resident_memory()
+        try:
+            return self.__results_from_graph(graph)
+        finally:
+            self.__release_graph()
+            if self.staged_dataset is not None:
+                self.staging.release_dataset(self.staged_dataset)
+                self.staged_dataset = None
+            if self.board is not None:
+                self.board.finish(self.task_id, self.graph_profile.events)
+            after = resident_memory()
+            self.memory_usage.append((repr(graph), before, after))
+            self.graph_profile.rss_before = before
+            self.graph_profile.rss_after = after
+            peaks = [rss for rss in [peak_resident_memory(), after] if rss is not None]
+            self.graph_profile.rss_peak = max(peaks) if peaks else None
+            if before is not None and after is not None:
+                logger.debug('Resident memory of worker {} for graph {}: {:.1f} MB before, {:.1f} MB after'.format(
+                    os.getpid(), repr(graph), before / 1024 ** 2, after / 1024 ** 2))
+
+    def __release_graph(self):
+        # Frames go first, then the chains they read and last the friends
+        self.rcws = list()
+        self.filter_reports = list()
+        self.event_counter = None
+        release_objects(self.tchains)
+        self.tchains = list()
+        release_objects(self.friend_tchains)
+        self.friend_tchains = list()
+        self.io_counters = None
+        self.dataset_ids = dict()
 
-    def _get_results_from_graph(self, graph):
+    def __results_from_graph(self, graph):
+        skimmed = False
+        if self.skims is not None:
+            graph, skimmed = self.__use_skim(graph)
+        if self.staging is not None and not skimmed:
+            # The staged files stay pinned until the graph is done
+            # (memberships of merged graphs are matched to the staged files)
+            self.staged_dataset = graph.unit_block
+            graph = replace_dataset(graph, self.staging.stage_dataset(graph.unit_block))
+        if self.backend == 'compiled':
+            return self.__compiled_results_from_graph(graph)
+        if self.backend == 'columnar':
+            return self.__columnar_results_from_graph(graph)
+        if is_arrow_dataset(graph.unit_block) and len(graph.unit_block.ntuples) > 1:
+            # One event loop per file over its memory-mapped columns, so
+            # that the columns of all the files are not copied together
+            results = list()
+            for part in split_graph_by_ntuples(graph):
+                results.extend(self.__rdataframe_results_from_graph(part))
+                self.__release_graph()
+            return merge_results(results)
+        return self.__rdataframe_results_from_graph(graph)
+
+    def __rdataframe_results_from_graph(self, graph):
+        profile = self.graph_profile
         start = time()
         ptrs = self.__node_to_root(graph)
         logger.debug('%%%%%%%%%% Ready to produce a subset of {} shapes'.format(
             len(ptrs)))
+        profile.setup += time() - start
+        # The first result requested runs the event loop
+        start = time()
+        profile.events += int(self.event_counter.GetValue())
+        profile.loop += time() - start
+        start = time()
         results = list()
         for ptr in ptrs:
             th = ptr.GetValue()
-            results.append(th)
-        # Sanity check: event loop run only once for each RDataFrame
+            if isinstance(th, list):
+                results.extend(th)
+            elif isinstance(ptr, (CountPointer, CutflowPointer, BootstrapPointer, SparsePointer)):
+                results.append(th)
+            else:
+                # Histograms of the result pointers would be deleted
+                # together with the frames of the graph
+                results.append(detach_result(th))
+        del ptrs
+        for path, report in self.filter_reports:
+            counts = filter_counts(report, path[-1])
+            if counts is not None:
+                profile.add_filter(path, *counts)
+        self.__log_io(graph)
+        self.__commit_skim()
+        self.__store_entry_lists()
+        # Sanity check: event loop run only once for each RDataFrame of the graph
         for rcw in self.rcws:
             loops = rcw.frame.GetNRuns()
             if loops != 1:
                 logger.warning('Event loop run {} times'.format(loops))
-        end = time()
-        logger.debug('Event loop for graph {:} run in {:.2f} seconds'.format(
-            repr(graph), end - start))
+        profile.harvest += time() - start
+        logger.debug('Event loop for graph {:} run in {:.2f} seconds ({:.2f} seconds of setup, {:.2f} of harvest)'.format(
+            repr(graph), profile.loop, profile.setup, profile.harvest))
+        return results
+
+    def __use_skim(self, graph):
+        # Read the skim of the shared prefix if available, otherwise book
+        # it when running with RDataFrame
+        self.skim_request = None
+        prefix = shared_prefix(graph)
+        selections = [node.unit_block for node in prefix]
+        if not any([selection.cuts for selection in selections]):
+            return graph, False
+        identifiers = graph_identifiers(graph)
+        dataset = self.skims.lookup(graph.unit_block, selections, identifiers)
+        if dataset is not None:
+            logger.info('Reading skim of dataset {} from {}'.format(
+                graph.unit_block.name, dataset.ntuples[0].path))
+            graph = copy(graph)
+            graph.unit_block = dataset
+            return graph, True
+        if self.backend == 'rdataframe' and not is_arrow_dataset(graph.unit_block):
+            self.skim_request = self.skims.request(prefix[-1], graph.unit_block,
+                selections, identifiers)
+        return graph, False
+
+    def __book_skim(self, rcw):
+        request = self.skim_request
+        ROOT = load_root()
+        # Only the columns of the dataset used by the graph are written
+        request.columns = sorted(rcw.types.keys())
+        options = ROOT.RDF.RSnapshotOptions()
+        options.fLazy = True
+        request.snapshot = rcw.frame.Snapshot(SkimCache.tree_name, request.target,
+            ROOT.std.vector['std::string'](request.columns), options)
+        logger.debug('%%%%%%%%%% Booking skim of dataset {} with columns {}'.format(
+            request.dataset.name, ', '.join(request.columns)))
+
+    def __commit_skim(self):
+        if self.skim_request is not None and self.skim_request.snapshot is not None:
+            self.skims.commit(self.skim_request)
+        self.skim_request = None
+
+    def __replay_entry_list(self, chain, dataset, graph):
+        # Entries are recorded only when the global entry numbers are
+        # known, i.e. for single-threaded loops over the full chain
+        self.entry_records = list()
+        self.entry_source = None
+        self.entry_nodes = list()
+        if self.entry_lists is None:
+            return False
+        entry_list = self.entry_lists.replay(chain, graph)
+        if entry_list is not None:
+            # Keep entry list alive
+            self.tchains.append(entry_list)
+            return True
+        if self.nthreads == 1 and self.zone_maps is None and cacheable(dataset):
+            self.entry_source = (chain, dataset)
+            # Only the nodes which can be replayed are recorded
+            self.entry_nodes = [node for node, _ in prefix_candidates(graph)]
+        return False
+
+    def __skip_zones(self, chain, dataset, graph):
+        if self.zone_maps is None:
+            return
+        # A skim written by this loop has to contain all the entries
+        # passing the prefix, not only the ones of the paths of this graph
+        entry_list = self.zone_maps.apply(chain, dataset, graph,
+            prefix_only = self.skim_request is not None)
+        if entry_list is not None:
+            # Keep entry list alive
+            self.tchains.append(entry_list)
+
+    def __store_entry_lists(self):
+        if self.entry_source is not None:
+            chain, dataset = self.entry_source
+            for cuts, entries in self.entry_records:
+                self.entry_lists.store(chain, dataset, cuts, entries.GetValue())
+        self.entry_records = list()
+        self.entry_source = None
+        self.entry_nodes = list()
+
+    def __compiled_results_from_graph(self, graph):
+        if is_arrow_dataset(graph.unit_block):
+            raise NotImplementedError('The compiled backend only runs on ROOT ntuples, use the rdataframe or columnar backend for {}'.format(
+                graph.unit_block))
+        start = time()
+        columns = graph_identifiers(graph)
+        chain, friend_tchains = rdf_from_dataset_helper(graph.unit_block,
+                columns if self.prune_columns else None)
+        # Keep chains alive
+        self.tchains.append(chain)
+        self.friend_tchains.extend(friend_tchains)
+        ROOT = load_root()
+        if self.nthreads != 1:
+            ROOT.EnableImplicitMT(self.nthreads)
+        self.__prepare_chain(graph.unit_block, chain)
+        self.__skip_zones(chain, graph.unit_block, graph)
+        column_types = column_types_from_chain(chain, columns)
+        generator = GraphCodeGenerator(graph, column_types, self.includes)
+        function_name = compile_graph_source(
+            generator.generate(), self.cache_dir, self.includes)
+        logger.debug('%%%%%%%%%% Compiled graph {} into {}'.format(
+            repr(graph), function_name))
+        profile = self.graph_profile
+        profile.setup = time() - start
+        profile.events = int(self.__chain_entries(chain))
+        if self.board is not None:
+            self.board.add_total(self.task_id, profile.events)
+        start = time()
+        output = getattr(ROOT, function_name)(chain)
+        profile.loop = time() - start
+        start = time()
+        self.__log_io(graph)
+        results = list()
+        for obj in output:
+            if obj.GetName() in generator.split_replicas:
+                results.extend(split_replicas(obj))
+            else:
+                results.append(obj)
+        profile.harvest = time() - start
+        logger.debug('Compiled event loop for graph {:} run in {:.2f} seconds ({:.2f} seconds of setup)'.format(
+            repr(graph), profile.loop, profile.setup))
+        return results
+
+    def __columnar_results_from_graph(self, graph):
+        profile = self.graph_profile
+        start = time()
+        runner = ColumnarGraphRunner(graph)
+        if self.board is not None or self.snapshots is not None:
+            runner.progress = self.__columnar_progress(runner)
+        profile.setup = time() - start
+        start = time()
+        results = runner.run()
+        profile.loop = time() - start
+        profile.events = runner.events
+        for path, (entries, passed) in runner.filters.items():
+            profile.add_filter(path, entries, passed)
+        logger.debug('Columnar event loop for graph {:} run in {:.2f} seconds'.format(
+            repr(graph), profile.loop))
         return results
 
-    def __write_results_to_root_file(self, output, final_results):
-        root_file = TFile(output, 'RECREATE')
-        for op in final_results:
-            op.Write()
-        root_file.Close()
+    def __columnar_progress(self, runner):
+        # Called after every chunk, with the entries processed and the
+        # entries of each ntuple when it is opened
+        task_id = self.task_id
+        counts = {'snapshot': 0}
+        def progress(processed, total):
+            if self.board is not None:
+                self.board.add(task_id, processed)
+                self.board.add_total(task_id, total)
+            if self.snapshots is None or not processed:
+                return
+            counts['snapshot'] += processed
+            if counts['snapshot'] < self.snapshots.every:
+                return
+            counts['snapshot'] = 0
+            for name, result in runner.results.items():
+                if self.snapshots.selects(name) and hasattr(result, 'to_uproot') and \
+                        getattr(result, 'kind', 'TH1D') in ['TH1D', 'TH1F']:
+                    self.snapshots.write(task_id, result)
+        return progress
 
-    def __node_to_root(self, node, final_results = None, rcw = None):
+    def __prepare_chain(self, dataset, chain):
+        # Apply the I/O profile and start counting the I/O of the graph
+        files = [ntuple.path for ntuple in dataset.ntuples]
+        open_ahead = self.io_profile.apply(chain, files)
+        if open_ahead is not None:
+            # Released after the chain, as the entry lists
+            self.tchains.append(open_ahead)
+        self.io_counters = IOCounters(chain,
+            self.io_profile.measure_io_time and self.nthreads == 1)
+
+    def __log_io(self, graph):
+        if self.io_counters is not None:
+            logger.info('I/O for graph {}: {}'.format(
+                repr(graph), self.io_counters.stop()))
+            self.graph_profile.bytes_read = self.io_counters.bytes_read
+            self.io_counters = None
+
+    def __store_results(self, output, final_results):
+        self.results = Results(final_results)
+        if output is not None:
+            logger.info('Write {} results from {} graphs to file {}'.format(
+                len(final_results), len(self.graphs), output))
+            self.results.write(output)
+        return self.results
+
+    def __node_to_root(self, node, final_results = None, rcw = None, path = ()):
         if final_results is None:
             final_results = list()
+        path = path + (node.name,)
         if node.kind == 'dataset':
             logger.debug('%%%%%%%%%% __node_to_root, converting to ROOT language the following dataset node\n{}'.format(
                 node))
+            self.dataset_ids = dict()
             result = self.__rdf_from_dataset(
-                node.unit_block)
+                node.unit_block, graph_identifiers(node), node)
+            if getattr(node, 'packed', False):
+                result = self.__dataset_id_from_packed_graph(result, node)
             if result not in self.rcws:
                 self.rcws.append(result)
+            self.event_counter = result.frame.Count()
+            if self.board is not None:
+                declare_progress_helpers()
+                load_root().ntupro.book_progress(self.event_counter,
+                    self.board.address(self.task_id), self.progress.every)
         elif node.kind == 'selection':
             if len(node.children) > 1:
                 logger.debug('%%%%%%%%%% __node_to_root, converting to ROOT language the following crossroad node\n{}'.format(
                     node))
             result = self.__cuts_and_weights_from_selection(
                 rcw, node.unit_block)
+            if self.skim_request is not None and node is self.skim_request.node:
+                self.__book_skim(result)
+            if self.entry_source is not None and any([node is recorded for recorded in self.entry_nodes]):
+                self.entry_records.append((result.cuts,
+                    self.entry_lists.record(result.frame)))
+            if node.unit_block.cuts and node.unit_block.name:
+                self.filter_reports.append((path, result.frame.Report()))
+        elif node.kind == 'membership':
+            logger.debug('%%%%%%%%%% __node_to_root, converting to ROOT language the following membership node\n{}'.format(
+                node))
+            result = self.__filter_from_membership(rcw, node.unit_block)
+            self.filter_reports.append((path, result.frame.Report()))
         elif node.kind == 'action':
             logger.debug('%%%%%%%%%% __node_to_root, converting to ROOT language the following action node\n{}'.format(
                 node))
             if isinstance(node.unit_block, Count):
                 result = self.__sum_from_count(
                     rcw, node.unit_block)
+            elif isinstance(node.unit_block, BootstrapHistogram):
+                result = self.__histo2d_from_bootstrap(
+                    rcw, node.unit_block)
             elif isinstance(node.unit_block, Histogram):
                 result = self.__histo1d_from_histo(
                     rcw, node.unit_block)
+            elif isinstance(node.unit_block, Cutflow):
+                result = self.__counters_from_cutflow(
+                    rcw, node.unit_block)
+            if self.snapshots is not None and self.snapshots.selects(node.unit_block.name):
+                self.__book_snapshot(result, node.unit_block.name)
         if node.children:
             for child in node.children:
-                self.__node_to_root(child, final_results, result)
+                self.__node_to_root(child, final_results, result, path)
+        elif isinstance(result, list):
+            final_results.extend(result)
         else:
             final_results.append(result)
         return final_results
 
-    def __rdf_from_dataset(self, dataset):
-        chain, self.friend_tchains = rdf_from_dataset_helper(dataset)
+    def __book_snapshot(self, result, name):
+        if isinstance(result, (CountPointer, CutflowPointer, SparsePointer)):
+            logger.debug('%%%%%%%%%% No partial results for {}, only histograms are written'.format(name))
+            return
+        ptr = result.ptr if isinstance(result, BootstrapPointer) else result
+        declare_progress_helpers()
+        load_root().ntupro.book_snapshot(ptr,
+            self.snapshots.path(self.task_id, name), self.snapshots.every)
+        logger.debug('%%%%%%%%%% Booking partial results of {}'.format(name))
+
+    def __chain_entries(self, chain):
+        entry_list = chain.GetEntryList()
+        return entry_list.GetN() if entry_list else chain.GetEntries()
+
+    def __rdf_from_dataset(self, dataset, columns, graph):
+        ROOT = load_root()
         if self.nthreads != 1:
-            EnableImplicitMT(self.nthreads)
-        # Keep main chain alive
-        self.tchains.append(chain)
-        rdf = RDataFrame(chain)
-        rcw = RDataFrameCutWeight(rdf)
+            ROOT.EnableImplicitMT(self.nthreads)
+        if is_arrow_dataset(dataset):
+            # Only the columns used in the graph are read, the arrays
+            # backing the data source are kept alive with the chains
+            rdf, arrays = rdf_from_arrow_dataset(dataset, columns)
+            self.tchains.append(arrays)
+        else:
+            chain, friend_tchains = rdf_from_dataset_helper(dataset,
+                    columns if self.prune_columns else None)
+            # Keep main and friend chains alive
+            self.tchains.append(chain)
+            self.friend_tchains.extend(friend_tchains)
+            self.__prepare_chain(dataset, chain)
+            if not self.__replay_entry_list(chain, dataset, graph):
+                self.__skip_zones(chain, dataset, graph)
+            if self.board is not None:
+                self.board.add_total(self.task_id, self.__chain_entries(chain))
+            rdf = ROOT.RDataFrame(chain)
+        # Resolve once the types of all the branches used in the graph,
+        # so that the actions can be booked without jitting
+        types = column_types_from_frame(rdf, columns)
+        rcw = RDataFrameCutWeight(rdf, [], [],
+                [SelectionStep(dataset.name, rdf, [])], types)
         return rcw
 
     def __cuts_and_weights_from_selection(self, rcw, selection):
@@ -167,11 +895,78 @@ class RunManager:
             l_cuts.append(cut)
         for weight in selection.weights:
             l_weights.append(weight)
-        l_rcw = RDataFrameCutWeight(rcw.frame, l_cuts, l_weights)
+        # Apply the cuts of the node as a named filter, so that every
+        # node of the graph corresponds to one node of the RDataFrame
+        # filter chain shared by all its children
+        frame = rcw.frame
+        if selection.cuts:
+            cut_expression = ' && '.join(['(' + cut.expression + ')' for cut in selection.cuts])
+            if selection.name:
+                frame = frame.Filter(cut_expression, selection.name)
+            else:
+                frame = frame.Filter(cut_expression)
+        l_steps = rcw.steps + [SelectionStep(selection.name, frame, l_weights)]
+        l_rcw = RDataFrameCutWeight(frame, l_cuts, l_weights, l_steps,
+                dict(rcw.types))
         return l_rcw
 
-    def __sum_from_count(self, rdf, count):
-        return rdf.Sum(count.variable)
+    def __dataset_id_from_packed_graph(self, rcw, graph):
+        # Index of the dataset of each file of a packed graph, computed
+        # once per file and shared by all the membership filters
+        declare_membership_helpers()
+        datasets = [child.unit_block for child in graph.children \
+                if child.kind == 'membership']
+        self.dataset_ids = dict([(dataset.name, i) for i, dataset in enumerate(datasets)])
+        rcw.frame = rcw.frame.DefinePerSample(DATASET_ID_COLUMN,
+            dataset_id_expression(datasets))
+        return rcw
+
+    def __filter_from_membership(self, rcw, dataset):
+        # The entries of a merged graph belonging to the dataset are the
+        # ones of its files, checked once per file; cutflows start here
+        if dataset.name in self.dataset_ids:
+            frame = rcw.frame.Filter('{} == {}'.format(
+                DATASET_ID_COLUMN, self.dataset_ids[dataset.name]), dataset.name)
+        else:
+            declare_membership_helpers()
+            column = membership_column(dataset)
+            frame = rcw.frame.DefinePerSample(column, membership_expression(dataset))
+            frame = frame.Filter(column, dataset.name)
+        return RDataFrameCutWeight(frame, list(rcw.cuts), list(rcw.weights),
+                [SelectionStep(dataset.name, frame, [])], dict(rcw.types))
+
+    def __define_columns(self, rcw, action):
+        # Create prerequisite columns and the column from expression
+        # if present in the Action object
+        if action.prerequisites:
+            for column, expression in action.prerequisites.items():
+                rcw.frame = rcw.frame.Define(column, expression)
+                rcw.types.pop(column, None)
+        expression = getattr(action, 'expression', None)
+        if expression:
+            rcw.frame = rcw.frame.Define(action.variable, expression)
+            rcw.types.pop(action.variable, None)
+
+    def __sum_from_count(self, rcw, count):
+        self.__define_columns(rcw, count)
+        weight_expression = '*'.join(['(' + weight.expression + ')' for weight in rcw.weights])
+        if not weight_expression:
+            return CountPointer(count.name, rcw.frame.Sum[rcw.column_type(count.variable)](
+                count.variable))
+        weight_name = action_column(count.name)
+        frame = rcw.frame.Define(weight_name, 'static_cast<double>(({})*{})'.format(
+            count.variable, weight_expression))
+        return CountPointer(count.name, frame.Sum['double'](weight_name))
+
+    def __counters_from_cutflow(self, rcw, cutflow):
+        # Counters are booked once per step and shared by all the
+        # cutflows below the same node
+        for step in rcw.steps:
+            step.book_counters()
+        logger.debug('%%%%%%%%%% Attaching cutflow called {} with {} steps'.format(
+            cutflow.name, len(rcw.steps)))
+        return [CutflowPointer(cutflow.name, rcw.steps),
+                CutflowPointer(raw_cutflow_name(cutflow.name), rcw.steps, weighted = False)]
 
     def __histo1d_from_histo(self, rcw, histogram):
         name = histogram.name
@@ -183,56 +978,146 @@ class RunManager:
             nbins = histogram.nbins
             low = histogram.low
             up = histogram.up
-        var_expression = histogram.expression
-        prerequisites = histogram.prerequisites
-
-        # Create prerequisite columns if present in the Histogram object
-        if prerequisites:
-            for column, expression in prerequisites.items():
-                rcw.frame = rcw.frame.Define(column, expression)
 
-        # Create column from expression if present in Histogram object
-        if var_expression:
-            rcw.frame = rcw.frame.Define(var, var_expression)
+        # Create prerequisite columns and column from expression
+        # if present in the Histogram object
+        self.__define_columns(rcw, histogram)
+        var_type = rcw.column_type(var)
 
         # Create macro weight string from sub-weights applied
         # (saved earlier as rdf columns)
         weight_expression = '*'.join(['(' + weight.expression + ')' for weight in rcw.weights])
 
-        # Create macro cut string from sub-cuts applied
-        # (saved earlier as rdf columns)
-        cut_expression = ' && '.join(['(' + cut.expression + ')' for cut in rcw.cuts])
-        if cut_expression:
-            rcw.frame = rcw.frame.Filter(cut_expression)
+        # Cuts are already applied by the filters of the selection
+        # nodes, rcw.frame is the end of the filter chain
+
+        if histogram.storage == 'sparse':
+            return self.__sparse_from_histo(rcw, histogram, weight_expression)
 
         # Create std::vector with the histogram edges
+        ROOT = load_root()
         if edges:
-            l_edges = vector['double']()
+            l_edges = ROOT.std.vector['double']()
             for edge in edges:
                 l_edges.push_back(edge)
+            model = ROOT.RDF.TH1DModel(name, name, nbins, l_edges.data())
+        else:
+            model = ROOT.RDF.TH1DModel(name, name, nbins, low, up)
+
+        if histogram.storage == 'float':
+            # Histo1D only fills TH1D, TH1F objects are filled with Fill
+            model = ROOT.TH1F(name, name, nbins, l_edges.data()) if edges \
+                    else ROOT.TH1F(name, name, nbins, low, up)
+            model.SetDirectory(0)
+            declare_float_helpers()
+            columns = [var]
+            if weight_expression:
+                columns.append(self.__weight_column(rcw, name, weight_expression))
+            logger.debug('%%%%%%%%%% Attaching float histogram called {}'.format(name))
+            return ROOT.ntupro.book_float[var_type](ROOT.RDF.AsRNode(rcw.frame),
+                model, *columns)
 
+        # Book the histogram with the column types known, so that no
+        # specialization has to be jitted for this action
         if not weight_expression:
             logger.debug('%%%%%%%%%% Attaching histogram called {}'.format(name))
-            if edges:
-                histo = rcw.frame.Histo1D((
-                        name, name, nbins, l_edges.data()),
-                        var)
-            else:
-                histo = rcw.frame.Histo1D((
-                        name, name, nbins, low, up),
-                        var)
+            histo = rcw.frame.Histo1D[var_type](model, var)
         else:
-            weight_name = name.replace('#', '_')
-            weight_name = weight_name.replace('-', '_')
-            rcw.frame = rcw.frame.Define(weight_name, weight_expression)
+            weight_name = self.__weight_column(rcw, name, weight_expression)
             logger.debug('%%%%%%%%%% Attaching histogram called {}'.format(name))
-            if edges:
-                histo = rcw.frame.Histo1D((
-                    name, name, nbins, l_edges.data()),
-                    var, weight_name)
-            else:
-                histo = rcw.frame.Histo1D((
-                    name, name, nbins, low, up),
-                    var, weight_name)
+            histo = rcw.frame.Histo1D[var_type, 'double'](model, var, weight_name)
 
         return histo
+
+    def __weight_column(self, rcw, name, weight_expression):
+        weight_name = action_column(name)
+        rcw.frame = rcw.frame.Define(weight_name,
+                'static_cast<double>({})'.format(weight_expression))
+        return weight_name
+
+    def __sparse_from_histo(self, rcw, histogram, weight_expression):
+        # The non-empty bins are collected per thread into maps, filled
+        # from a column with bin index, value and weight of each entry
+        declare_sparse_helpers()
+        column = 'ntupro_sparse_' + re.sub(r'\W', '_', histogram.name)
+        rcw.frame = rcw.frame.Define(column, sparse_entry_expression(histogram,
+            'static_cast<double>({})'.format(weight_expression) if weight_expression else '1.'))
+        ROOT = load_root()
+        logger.debug('%%%%%%%%%% Attaching sparse histogram called {}'.format(histogram.name))
+        ptr = ROOT.ntupro.book_sparse(ROOT.RDF.AsRNode(rcw.frame), column)
+        x_edges, fixed = histogram_axis(histogram)
+        return SparsePointer(histogram.name, x_edges, fixed, ptr)
+
+    def __histo2d_from_bootstrap(self, rcw, histogram):
+        name = histogram.name
+        var = histogram.variable
+        nreplicas = histogram.nreplicas
+        declare_bootstrap_helpers()
+
+        self.__define_columns(rcw, histogram)
+
+        # The variable and the replica index are replicated nreplicas times
+        # and filled together with the Poisson weights, in a single loop over
+        # the replicas for each event
+        weight_expression = '*'.join(['(' + weight.expression + ')' for weight in rcw.weights])
+        if not weight_expression:
+            weight_expression = '1.'
+        column_name = action_column(name)
+        x_name = column_name + '_bootstrap_x'
+        y_name = column_name + '_bootstrap_replica'
+        w_name = column_name + '_bootstrap_weight'
+        frame = rcw.frame.Define(x_name, 'ntupro::replicate({}, {})'.format(
+            var, nreplicas))
+        frame = frame.Define(y_name, 'ntupro::replica_index({})'.format(
+            nreplicas))
+        frame = frame.Define(w_name, 'ntupro::bootstrap_weights({}, {}ULL, {}, {})'.format(
+            histogram.event_variable, histogram.seed, nreplicas, weight_expression))
+
+        logger.debug('%%%%%%%%%% Attaching bootstrap histogram called {} with {} replicas'.format(
+            name, nreplicas))
+        ROOT = load_root()
+        if histogram.edges:
+            l_edges = ROOT.std.vector['double']()
+            for edge in histogram.edges:
+                l_edges.push_back(edge)
+            model = ROOT.RDF.TH2DModel(name, name, len(histogram.edges) - 1, l_edges.data(),
+                nreplicas, 0., float(nreplicas))
+        else:
+            model = ROOT.RDF.TH2DModel(name, name, histogram.nbins, histogram.low, histogram.up,
+                nreplicas, 0., float(nreplicas))
+        replicas_type = 'ROOT::VecOps::RVec<double>'
+        histo = frame.Histo2D[replicas_type, replicas_type, replicas_type](
+            model, x_name, y_name, w_name)
+        return BootstrapPointer(histo, histogram.split_replicas)
+
+
+# Manager of the worker process, set by the initializer of the pool
+_worker_manager = None
+
+
+def _init_worker(manager):
+    global _worker_manager
+    _worker_manager = manager
+
+
+def _run_task(task):
+    task_id, content = task
+    plan = Plan.from_bytes(content)
+    logger.debug('%%%%%%%%%% Worker {} running task {} ({} nodes)'.format(
+        os.getpid(), task_id, len(plan)))
+    results = _worker_manager._get_results_from_graph(plan.graph(), task_id)
+    profile = _worker_manager.graph_profile.to_dict()
+    if _worker_manager.shards is not None:
+        return _worker_manager.shards.write_shard(task_id, results), profile
+    if _worker_manager.shared_memory:
+        return export_results(results, block_name(os.getppid(), task_id)), profile
+    return results, profile
+
+
+def _run_bundle(manager, bundle):
+    # Run the tasks of a bundle one after the other in the same job
+    outputs = list()
+    for task_id, content in bundle:
+        results = manager._get_results_from_graph(Plan.from_bytes(content).graph(), task_id)
+        outputs.append((task_id, results, manager.graph_profile.to_dict()))
+    return outputs
@@ -1,16 +1,127 @@
 from ._booking import Ntuple
+from ._booking import ArrowNtuple
 from ._booking import Dataset
 from ._booking import Cut
 from ._booking import Weight
 from ._booking import Selection
 from ._booking import Action
 from ._booking import Count
+from ._booking import Cutflow
 from ._booking import Histogram
+from ._booking import BootstrapHistogram
 
 from ._optimization import Node
+from ._optimization import shared_prefix
+
+from ._root import load_root
+
+from ._io import IOProfile
+from ._io import IOCounters
+
+from ._staging import StagingCache
+from ._staging import LocalSource
+from ._staging import XRootDSource
+
+from ._skim import SkimCache
+from ._skim import cacheable
+
+from ._entrylists import EntryListCache, file_slices, prefix_candidates
+
+from ._merging import declare_membership_helpers
+from ._merging import membership_column
+from ._merging import membership_expression
+from ._merging import overlapping_groups
+from ._merging import union_of_ntuples
+from ._merging import pack_datasets
+from ._merging import count_entries
+from ._merging import mergeable
+from ._merging import dataset_id_expression
+from ._merging import DATASET_ID_COLUMN
+from ._merging import replace_dataset
+
+from ._plan import Plan
+from ._plan import graph_plans
+from ._plan import PLAN_VERSION
+
+from ._sharedmem import SharedResults
+from ._sharedmem import export_results
+from ._sharedmem import import_results
+from ._sharedmem import block_name
+from ._sharedmem import release_blocks
+
+from ._results import Results
+from ._results import parse_result_name
+
+from ._shards import ShardedOutput
+from ._shards import ShardedResults
+from ._shards import is_sharded_output
+
+from ._memory import MemoryBudget
+from ._memory import prune_graph
+from ._memory import resident_memory
+from ._memory import peak_resident_memory
+
+from ._profile import GraphProfile
+from ._profile import RunProfile
+from ._profile import format_profile
+from ._profile import PROFILE_VERSION
+
+from ._progress import ProgressBoard
+from ._progress import ProgressReport
+from ._progress import Progress
+from ._progress import PartialSnapshots
+from ._progress import declare_progress_helpers
+
+from ._executors import Executor
+from ._executors import LocalExecutor
+from ._executors import HTCondorExecutor
+from ._executors import DaskExecutor
+from ._executors import task_costs
+from ._executors import pack_tasks
+
+from ._zonemaps import ZoneMapCache
+from ._zonemaps import cut_constraints
+from ._zonemaps import graph_actions
 
 from ._run import RDataFrameCutWeight
+from ._run import SelectionStep
+from ._run import CountPointer
+from ._run import CutflowPointer
+from ._run import cutflow_bins
+from ._run import BootstrapPointer
+from ._run import SparsePointer
+from ._run import declare_sparse_helpers
+from ._run import declare_float_helpers
+from ._run import sparse_entry_expression
+from ._run import histogram_axis
+from ._run import raw_cutflow_name
+from ._run import suffixed_action_name
+from ._run import declare_bootstrap_helpers
 from ._run import rdf_from_dataset_helper
+from ._run import column_types_from_chain
+from ._run import column_types_from_frame
+from ._run import split_replicas
+from ._run import detach_result
+from ._run import filter_counts
+from ._run import release_objects
+
+from ._expressions import identifiers
+from ._expressions import graph_identifiers
+
+from ._codegen import GraphCodeGenerator
+from ._codegen import compile_graph_source
+from ._codegen import action_column
+
+from ._arrow import is_arrow_dataset
+from ._arrow import arrow_columns
+from ._arrow import rdf_from_arrow_dataset
+
+from ._columnar import NumpyExpression
+from ._columnar import HistogramArrays
+from ._columnar import SparseHistogram
+from ._columnar import ColumnarGraphRunner
+from ._columnar import split_graph_by_ntuples
+from ._columnar import merge_results
 
 from ._printing import Node as PrintedNode
 from ._printing import drawTree2
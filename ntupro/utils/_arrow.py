@@ -0,0 +1,119 @@
+from ._booking import ArrowNtuple
+from ._root import load_root
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Arrow and Parquet ntuples cannot be read without pyarrow; install it with `pip install pyarrow` and try again')
+    return pyarrow
+
+
+def is_arrow_dataset(dataset):
+    """Return True if all the ntuples of the dataset are ArrowNtuple objects,
+    False if none of them is; datasets mixing the two kinds are not supported.
+    """
+    kinds = set([isinstance(ntuple, ArrowNtuple) for ntuple in dataset.ntuples])
+    if len(kinds) > 1:
+        raise TypeError('Dataset {} mixes Arrow/Parquet and ROOT ntuples'.format(
+            dataset.name))
+    return kinds == set([True])
+
+
+def open_arrow_table(ntuple):
+    """Memory-map the file of the ntuple and return its table; no column
+    is read until it is accessed.
+    """
+    pyarrow = import_pyarrow()
+    if ntuple.file_format == 'parquet':
+        return pyarrow.parquet.ParquetFile(ntuple.path, memory_map = True)
+    return pyarrow.ipc.open_file(pyarrow.memory_map(ntuple.path, 'r')).read_all()
+
+
+def table_column_names(table):
+    if hasattr(table, 'schema_arrow'):
+        return list(table.schema_arrow.names)
+    return list(table.schema.names)
+
+
+def read_table_columns(table, names):
+    """Read the columns named from a memory-mapped table (or Parquet file)
+    and return them as a dictionary {'column': array}. Columns made of a
+    single chunk of a primitive type without nulls are zero-copy views of
+    the mapped buffers.
+    """
+    if not names:
+        return dict()
+    if hasattr(table, 'read'):
+        table = table.read(columns = names)
+    else:
+        table = table.select(names)
+    arrays = dict()
+    for name in names:
+        column = table.column(name)
+        if column.num_chunks == 1:
+            column = column.chunk(0)
+        else:
+            column = column.combine_chunks()
+        arrays[name] = column.to_numpy(zero_copy_only = False)
+    return arrays
+
+
+def arrow_num_entries(ntuple):
+    """Number of entries of an Arrow/Parquet ntuple, read from its metadata."""
+    table = open_arrow_table(ntuple)
+    if hasattr(table, 'metadata'):
+        return table.metadata.num_rows
+    return table.num_rows
+
+
+def arrow_columns(ntuple, columns):
+    """Return the columns among the names passed (all of them if columns
+    is None) which are found in the ntuple or in its friends, as a dictionary
+    {'column': array}. As for friend trees, columns of the main file shadow
+    the ones of the friends.
+    """
+    arrays = dict()
+    for source in [ntuple] + ntuple.friends:
+        table = open_arrow_table(source)
+        names = [name for name in table_column_names(table) \
+                if (columns is None or name in columns) and name not in arrays]
+        arrays.update(read_table_columns(table, names))
+    return arrays
+
+
+def rdf_from_arrow_dataset(dataset, columns):
+    """Create an RDataFrame reading the referenced columns of an Arrow/Parquet
+    dataset through the numpy data source. The arrays are returned together
+    with the RDataFrame, since they have to be kept alive as long as it is
+    used. Columns made of a single chunk are not copied; with more than one
+    ntuple they are concatenated in memory, thus RunManager runs one event
+    loop per ntuple and merges the results.
+    """
+    import numpy
+    per_ntuple = [arrow_columns(ntuple, columns) for ntuple in dataset.ntuples]
+    names = set(per_ntuple[0].keys())
+    for arrays in per_ntuple[1:]:
+        if set(arrays.keys()) != names:
+            raise NameError('Ntuples of dataset {} have different columns'.format(
+                dataset.name))
+    if len(per_ntuple) == 1:
+        arrays = per_ntuple[0]
+    else:
+        arrays = dict([(name, numpy.concatenate([a[name] for a in per_ntuple])) \
+                for name in names])
+    arrays = dict([(name, numpy.ascontiguousarray(array)) for name, array in arrays.items()])
+    logger.debug('%%%%%%%%%% Reading columns {} of dataset {}'.format(
+        ', '.join(sorted(arrays.keys())), dataset.name))
+    ROOT = load_root()
+    if hasattr(ROOT.RDF, 'FromNumpy'):
+        rdf = ROOT.RDF.FromNumpy(arrays)
+    else:
+        rdf = ROOT.RDF.MakeNumpyDataFrame(arrays)
+    return rdf, arrays
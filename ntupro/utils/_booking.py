@@ -31,6 +31,61 @@ class Ntuple:
             self.path, self.directory))
 
 
+class ArrowNtuple(Ntuple):
+    """
+    Ntuple stored as a Parquet or Arrow IPC (Feather) file instead of a
+    ROOT TTree. The files are memory-mapped and only the columns referenced
+    by the graph are read, so that re-reading them costs page-cache hits
+    instead of decompression (for the uncompressed Arrow IPC format without
+    any copy). Friends are other ArrowNtuple objects with the same number
+    of rows, whose columns are added to the ones of the main file.
+
+    Args:
+        path (str): Path of the file
+        friends (list): List of ArrowNtuple objects
+        tag (str): Tag of the friend
+        file_format (str): Either 'parquet' or 'arrow'; if not given, it
+            is inferred from the extension of the file
+
+    Attributes:
+        path (str): Path of the file
+        directory (None): Not used, Arrow and Parquet files contain one table
+        friends (list): List of ArrowNtuple objects
+        tag (str): Tag of the friend
+        file_format (str): Either 'parquet' or 'arrow'
+    """
+    extensions = {
+        '.parquet': 'parquet', '.pq': 'parquet',
+        '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+    def __init__(self, path, friends = None, tag = None, file_format = None):
+        Ntuple.__init__(self, path, None, friends, tag)
+        if file_format is None:
+            extension = '.' + path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+            if extension not in self.extensions:
+                raise ValueError('Cannot infer the format of {}, use file_format'.format(path))
+            file_format = self.extensions[extension]
+        if file_format not in ['parquet', 'arrow']:
+            raise ValueError('file_format has to be either parquet or arrow')
+        self.file_format = file_format
+
+    def __str__(self):
+        if self.tag is None:
+            layout = '({}, {})'.format(self.path, self.file_format)
+        else:
+            layout = '({}, {}, tag = {})'.format(
+                    self.path, self.file_format, self.tag)
+        return layout
+
+    def __eq__(self, other):
+        return isinstance(other, ArrowNtuple) and \
+            self.path == other.path
+
+    def __hash__(self):
+        return hash((
+            self.path, self.file_format))
+
+
 class Dataset:
     def __init__(self, name, ntuples):
         self.name = name
@@ -194,6 +249,33 @@ class Count(Action):
     pass
 
 
+class Cutflow(Action):
+    """
+    Action that, for every selection step of the path leading to it,
+    counts the raw number of entries, the sum of weights and the sum
+    of squared weights. The counters are attached to the filters that
+    are already part of the event loop, thus no extra pass over the
+    dataset is needed.
+
+    Args:
+        name (string): Name of the cutflow
+
+    Attributes:
+        name (string): Name of the cutflow
+        variable (None): Not used, a cutflow does not plot any variable
+        prerequisites (None): Not used, a cutflow does not read any column
+    """
+    def __init__(self, name):
+        Action.__init__(self, name, None)
+
+    def __eq__(self, other):
+        return isinstance(other, Cutflow) and \
+            self.name == other.name
+
+    def __hash__(self):
+        return hash((self.name, 'cutflow'))
+
+
 class Histogram(Action):
     """
     Basic histogram class, which takes as third argument either
@@ -213,6 +295,10 @@ class Histogram(Action):
             the name of the histogram if not yet present
         prerequisites (dict): Dictionary containing columns on which the variable
             depends which are not part of the existent dataframe, in the form {'var': 'expression'}
+        storage (string): Storage of the bins: 'double' (TH1D), 'float' (TH1F,
+            half the memory for the bin contents, enough for counts up to 2^24
+            entries per bin) or 'sparse' (only the non-empty bins are stored,
+            for very fine binnings mostly empty; a TH1D is created when written)
 
     Attributes:
         name (string): Name of the histogram
@@ -228,9 +314,17 @@ class Histogram(Action):
             the name of the histogram if not yet present
         prerequisites (dict): Dictionary containing columns on which the variable
             depends which are not part of the existent dataframe, in the form {'var': 'expression'}
+        storage (string): Storage of the bins, one of 'double', 'float' and 'sparse'
     """
-    def __init__(self, name, variable, setting, expression = None, prerequisites = None):
+    storages = ['double', 'float', 'sparse']
+
+    def __init__(self, name, variable, setting, expression = None, prerequisites = None,
+            storage = 'double'):
         Action.__init__(self, name, variable, prerequisites)
+        if storage not in self.storages:
+            raise ValueError('Unknown storage {}, allowed storages are: {}'.format(
+                storage, ', '.join(self.storages)))
+        self.storage = storage
         if isinstance(setting, list):
             self.edges = setting
         elif isinstance(setting, tuple):
@@ -241,6 +335,9 @@ class Histogram(Action):
         self.expression = expression
 
     def __eq__(self, other):
+        # A Histogram is never equal to a BootstrapHistogram
+        if type(self) is not type(other) or self.storage != other.storage:
+            return False
         if self.edges:
             return self.name == other.name and \
                 self.variable == other.variable and \
@@ -254,6 +351,62 @@ class Histogram(Action):
 
     def __hash__(self):
         if self.edges:
-            return hash((self.name, self.variable, tuple(self.edges)))
+            return hash((self.name, self.variable, tuple(self.edges), self.storage))
         else:
-            return hash((self.name, self.variable, self.nbins, self.low, self.up))
+            return hash((self.name, self.variable, self.nbins, self.low, self.up, self.storage))
+
+
+class BootstrapHistogram(Histogram):
+    """
+    Histogram filled together with nreplicas Poisson bootstrap replicas
+    of itself. Every event enters replica i with an extra weight drawn from
+    a Poisson distribution of mean one, generated deterministically from
+    the event number and the seed, so that the replicas are reproducible
+    and consistent among different histograms. All the replicas are filled
+    in the same loop into a single 2D histogram, with the variable on the
+    x axis and the replica index on the y axis.
+
+    Args:
+        name (string): Name of the histogram
+        variable (string): Variable to be plotted
+        setting (list/tuple): Binning, as in Histogram
+        nreplicas (int): Number of bootstrap replicas
+        seed (int): Seed used together with the event number to generate
+            the Poisson weights
+        event_variable (string): Column holding the event number
+        split_replicas (Bool): If True, the replicas are written as separate
+            histograms instead of a single TH2D
+        expression (string): Definition of the variable, as in Histogram
+        prerequisites (dict): Dictionary containing columns on which the variable
+            depends which are not part of the existent dataframe, in the form {'var': 'expression'}
+
+    Attributes:
+        nreplicas (int): Number of bootstrap replicas
+        seed (int): Seed used together with the event number to generate
+            the Poisson weights
+        event_variable (string): Column holding the event number
+        split_replicas (Bool): If True, the replicas are written as separate
+            histograms instead of a single TH2D
+    """
+    def __init__(self, name, variable, setting, nreplicas = 100, seed = 0,
+            event_variable = 'event', split_replicas = False,
+            expression = None, prerequisites = None):
+        Histogram.__init__(self, name, variable, setting, expression, prerequisites)
+        if not isinstance(nreplicas, int) or nreplicas < 1:
+            raise ValueError('nreplicas has to be a positive integer')
+        self.nreplicas = nreplicas
+        self.seed = seed
+        self.event_variable = event_variable
+        self.split_replicas = split_replicas
+
+    def __eq__(self, other):
+        return isinstance(other, BootstrapHistogram) and \
+            Histogram.__eq__(self, other) and \
+            self.nreplicas == other.nreplicas and \
+            self.seed == other.seed and \
+            self.event_variable == other.event_variable and \
+            self.split_replicas == other.split_replicas
+
+    def __hash__(self):
+        return hash((Histogram.__hash__(self), self.nreplicas, self.seed,
+            self.event_variable, self.split_replicas))
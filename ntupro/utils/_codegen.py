@@ -0,0 +1,444 @@
+import os
+import re
+import hashlib
+
+from ._booking import Count
+from ._booking import Cutflow
+from ._booking import Histogram
+from ._booking import BootstrapHistogram
+from ._expressions import identifiers
+from ._locks import file_lock
+
+import logging
+logger = logging.getLogger(__name__)
+
+FUNCTION_PLACEHOLDER = 'NTUPRO_GRAPH_FUNCTION'
+
+HEADERS = [
+    'ROOT/RDataFrame.hxx',
+    'ROOT/RVec.hxx',
+    'TH1D.h',
+    'TH1F.h',
+    'TH2D.h',
+    'TList.h',
+    'TParameter.h',
+    'TTree.h',
+    'cmath',
+    'vector']
+
+# Columns always available in a RDataFrame
+SPECIAL_COLUMN_TYPES = {
+    'rdfentry_': 'ULong64_t',
+    'rdfslot_': 'unsigned int'}
+
+
+def cpp_string(string):
+    return '"' + str(string).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def cpp_double(value):
+    return repr(float(value))
+
+
+def action_column(name):
+    """Valid identifier of a column defined for the action called name."""
+    return 'ntupro_' + re.sub(r'\W', '_', name)
+
+
+class GraphCodeGenerator:
+    """
+    Translate an optimized Graph into the source of a single C++ function,
+    where every Filter, Define and action is booked through typed, templated
+    RDataFrame calls. Each expression becomes a lambda whose arguments are the
+    columns it depends on, with the types taken from column_types for the
+    input columns and deduced by the compiler for the defined ones, so that
+    nothing is left to the just-in-time compilation of the interpreter.
+
+    The generated function has the signature
+        TList *function_name(TTree *tree)
+    and returns the results of all the actions of the graph after running
+    the event loop once.
+
+    Args:
+        graph (Graph): Graph to translate
+        column_types (dict): Types of the input columns, in the form
+            {'column': 'C++ type'}
+        includes (list): Header files included in the translation unit,
+            needed if the expressions use functions not provided by ROOT
+
+    Attributes:
+        graph (Graph): Graph to translate
+        column_types (dict): Types of the input columns
+        includes (list): Header files included in the translation unit
+        split_replicas (list): Names of the bootstrap histograms which have
+            to be split into one histogram per replica after the run
+    """
+    def __init__(self, graph, column_types, includes = None):
+        self.graph = graph
+        self.column_types = dict(SPECIAL_COLUMN_TYPES)
+        self.column_types.update(column_types)
+        self.includes = includes if includes else list()
+        self.split_replicas = list()
+        self.__booking = list()
+        self.__harvesting = list()
+        self.__counter = 0
+        self.__counters = dict()
+        self.__dataset_ids = dict()
+        self.__needs_bootstrap = False
+        self.__needs_membership = False
+
+    def generate(self):
+        """Return the full source of the translation unit, with the
+        placeholder FUNCTION_PLACEHOLDER in place of the function name.
+        """
+        self.__booking = list()
+        self.__harvesting = list()
+        self.__counters = dict()
+        self.__dataset_ids = dict()
+        self.__counter = 0
+        self.split_replicas = list()
+        self.__needs_membership = False
+        self.__booking.append('ROOT::RDataFrame df(*tree);')
+        self.__booking.append('ROOT::RDF::RNode n0 = df;')
+        frame = 'n0'
+        types = dict(self.column_types)
+        if getattr(self.graph, 'packed', False):
+            frame = self.__dataset_id(frame, types)
+        steps = [(self.graph.name, frame, [])]
+        for child in self.graph.children:
+            self.__node(child, frame, dict(types), [], steps)
+        lines = ['#include "{}"'.format(header) if '.' in header \
+                else '#include <{}>'.format(header) for header in HEADERS]
+        for include in self.includes:
+            lines.append('#include "{}"'.format(os.path.abspath(include)))
+        if self.__needs_bootstrap:
+            from ._run import BOOTSTRAP_CODE
+            lines.append(BOOTSTRAP_CODE)
+        if self.__needs_membership:
+            from ._merging import MEMBERSHIP_CODE
+            lines.append(MEMBERSHIP_CODE)
+        lines.append('')
+        lines.append('TList *{}(TTree *tree)'.format(FUNCTION_PLACEHOLDER))
+        lines.append('{')
+        lines.extend(['   ' + line for line in self.__booking])
+        lines.append('   auto output = new TList();')
+        lines.extend(['   ' + line for line in self.__harvesting])
+        lines.append('   return output;')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def __new_name(self, prefix):
+        self.__counter += 1
+        return '{}{}'.format(prefix, self.__counter)
+
+    def __lambda(self, expression, types, return_type = None):
+        """Return the lambda and the list of columns it takes as arguments."""
+        columns = [name for name in identifiers(expression) if name in types]
+        arguments = ', '.join(['const {} &{}'.format(types[column], column) \
+                for column in columns])
+        if return_type:
+            body = '[]({}) -> {} {{ return {}; }}'.format(arguments, return_type, expression)
+        else:
+            body = '[]({}) {{ return {}; }}'.format(arguments, expression)
+        column_list = '{' + ', '.join([cpp_string(column) for column in columns]) + '}'
+        return body, column_list
+
+    def __define(self, frame, column, expression, types, return_type = None):
+        """Book a typed Define and register the type of the new column,
+        deduced from the return type of the lambda.
+        """
+        function = self.__new_name('f')
+        type_name = self.__new_name('t')
+        new_frame = self.__new_name('n')
+        body, column_list = self.__lambda(expression, types, return_type)
+        self.__booking.append('auto {} = {};'.format(function, body))
+        self.__booking.append('using {} = ROOT::TypeTraits::CallableTraits<decltype({})>::ret_type;'.format(
+            type_name, function))
+        self.__booking.append('ROOT::RDF::RNode {} = {}.Define({}, {}, {});'.format(
+            new_frame, frame, cpp_string(column), function, column_list))
+        types[column] = type_name
+        return new_frame
+
+    def __define_per_sample(self, frame, column, type_name, expression, types):
+        """Book a DefinePerSample of an expression of the RSampleInfo info."""
+        self.__needs_membership = True
+        new_frame = self.__new_name('n')
+        self.__booking.append(
+            'ROOT::RDF::RNode {} = {}.DefinePerSample({}, [](unsigned int, const ROOT::RDF::RSampleInfo &info) -> {} {{ return {}; }});'.format(
+                new_frame, frame, cpp_string(column), type_name, expression))
+        types[column] = type_name
+        return new_frame
+
+    def __dataset_id(self, frame, types):
+        """Index of the dataset of each file of a packed graph, computed
+        once per file and shared by all the membership filters.
+        """
+        from ._merging import DATASET_ID_COLUMN, sample_groups
+        self.__dataset_ids = dict()
+        datasets = [child.unit_block for child in self.graph.children \
+                if child.kind == 'membership']
+        for i, dataset in enumerate(datasets):
+            self.__dataset_ids[dataset.name] = i
+        return self.__define_per_sample(frame, DATASET_ID_COLUMN, 'int',
+            'ntupro::sample_index(info, {})'.format(sample_groups(datasets)), types)
+
+    def __membership(self, dataset, frame, types):
+        """Filter the entries of the files of the dataset, checked once per file."""
+        from ._merging import DATASET_ID_COLUMN, membership_column, sample_group
+        if dataset.name in self.__dataset_ids:
+            column = DATASET_ID_COLUMN
+            body = '[](const int &id) -> bool {{ return id == {}; }}'.format(
+                self.__dataset_ids[dataset.name])
+        else:
+            column = membership_column(dataset)
+            frame = self.__define_per_sample(frame, column, 'bool',
+                'ntupro::sample_in(info, {})'.format(sample_group(dataset)), types)
+            body = '[](const bool &member) -> bool { return member; }'
+        new_frame = self.__new_name('n')
+        self.__booking.append('ROOT::RDF::RNode {} = {}.Filter({}, {{{}}}, {});'.format(
+            new_frame, frame, body, cpp_string(column), cpp_string(dataset.name)))
+        return new_frame
+
+    def __weight_expression(self, weights):
+        if not weights:
+            return None
+        return '*'.join(['(' + weight + ')' for weight in weights])
+
+    def __node(self, node, frame, types, weights, steps):
+        if node.kind == 'selection':
+            selection = node.unit_block
+            if selection.cuts:
+                cut_expression = ' && '.join(['(' + cut.expression + ')' for cut in selection.cuts])
+                body, column_list = self.__lambda(cut_expression, types, 'bool')
+                new_frame = self.__new_name('n')
+                if selection.name:
+                    self.__booking.append('ROOT::RDF::RNode {} = {}.Filter({}, {}, {});'.format(
+                        new_frame, frame, body, column_list, cpp_string(selection.name)))
+                else:
+                    self.__booking.append('ROOT::RDF::RNode {} = {}.Filter({}, {});'.format(
+                        new_frame, frame, body, column_list))
+                frame = new_frame
+            weights = weights + [weight.expression for weight in selection.weights]
+            steps = steps + [(selection.name, frame, weights)]
+            for child in node.children:
+                self.__node(child, frame, dict(types), weights, steps)
+        elif node.kind == 'membership':
+            # Cutflows of the datasets of merged graphs start here
+            frame = self.__membership(node.unit_block, frame, types)
+            steps = [(node.name, frame, [])]
+            for child in node.children:
+                self.__node(child, frame, dict(types), weights, steps)
+        elif node.kind == 'action':
+            self.__action(node.unit_block, frame, types, weights, steps)
+        else:
+            raise NotImplementedError('Node of kind {} not supported by the code generation backend'.format(
+                node.kind))
+
+    def __action(self, action, frame, types, weights, steps):
+        if action.prerequisites:
+            for column, expression in action.prerequisites.items():
+                frame = self.__define(frame, column, expression, types)
+        if isinstance(action, Cutflow):
+            self.__cutflow(action, steps)
+            return
+        if isinstance(action, Histogram) and action.expression:
+            frame = self.__define(frame, action.variable, action.expression, types)
+        if action.variable not in types:
+            raise NameError('Impossible to find the type of column {} used by {}'.format(
+                action.variable, action.name))
+        weight_expression = self.__weight_expression(weights)
+        result = self.__new_name('r')
+        if isinstance(action, BootstrapHistogram):
+            self.__bootstrap(action, frame, types, weight_expression, result)
+        elif isinstance(action, Histogram) and action.storage == 'sparse':
+            raise NotImplementedError('Sparse storage of {} not supported by the code generation backend'.format(
+                action.name))
+        elif isinstance(action, Histogram) and action.storage == 'float':
+            model = self.__float_model(action)
+            columns = [cpp_string(action.variable)]
+            column_types = [types[action.variable]]
+            if weight_expression:
+                weight_name = action_column(action.name)
+                frame = self.__define(frame, weight_name, weight_expression, types, 'double')
+                columns.append(cpp_string(weight_name))
+                column_types.append('double')
+            self.__booking.append('auto {} = {}.Fill<{}>({}, {{{}}});'.format(
+                result, frame, ', '.join(column_types), model, ', '.join(columns)))
+            self.__harvesting.append('output->Add({}->Clone());'.format(result))
+        elif isinstance(action, Histogram):
+            model = self.__model(action)
+            if weight_expression:
+                weight_name = action_column(action.name)
+                frame = self.__define(frame, weight_name, weight_expression, types, 'double')
+                self.__booking.append('auto {} = {}.Histo1D<{}, double>({}, {}, {});'.format(
+                    result, frame, types[action.variable], model,
+                    cpp_string(action.variable), cpp_string(weight_name)))
+            else:
+                self.__booking.append('auto {} = {}.Histo1D<{}>({}, {});'.format(
+                    result, frame, types[action.variable], model,
+                    cpp_string(action.variable)))
+            self.__harvesting.append('output->Add({}->Clone());'.format(result))
+        elif isinstance(action, Count):
+            if weight_expression:
+                count_name = action_column(action.name)
+                frame = self.__define(frame, count_name, '({})*{}'.format(
+                    action.variable, weight_expression), types, 'double')
+                self.__booking.append('auto {} = {}.Sum<double>({});'.format(
+                    result, frame, cpp_string(count_name)))
+            else:
+                self.__booking.append('auto {} = {}.Sum<{}>({});'.format(
+                    result, frame, types[action.variable], cpp_string(action.variable)))
+            self.__harvesting.append('output->Add(new TParameter<double>({}, *{}));'.format(
+                cpp_string(action.name), result))
+        else:
+            raise NotImplementedError('Action {} not supported by the code generation backend'.format(
+                action))
+
+    def __model(self, histogram):
+        if histogram.edges:
+            edges = self.__new_name('e')
+            self.__booking.append('const std::vector<double> {}{{{}}};'.format(
+                edges, ', '.join([cpp_double(edge) for edge in histogram.edges])))
+            return 'ROOT::RDF::TH1DModel({0}, {0}, {1}, {2}.data())'.format(
+                cpp_string(histogram.name), len(histogram.edges) - 1, edges)
+        return 'ROOT::RDF::TH1DModel({0}, {0}, {1}, {2}, {3})'.format(
+            cpp_string(histogram.name), histogram.nbins,
+            cpp_double(histogram.low), cpp_double(histogram.up))
+
+    def __float_model(self, histogram):
+        if histogram.edges:
+            edges = self.__new_name('e')
+            self.__booking.append('const std::vector<double> {}{{{}}};'.format(
+                edges, ', '.join([cpp_double(edge) for edge in histogram.edges])))
+            return 'TH1F({0}, {0}, {1}, {2}.data())'.format(
+                cpp_string(histogram.name), len(histogram.edges) - 1, edges)
+        return 'TH1F({0}, {0}, {1}, {2}, {3})'.format(
+            cpp_string(histogram.name), histogram.nbins,
+            cpp_double(histogram.low), cpp_double(histogram.up))
+
+    def __bootstrap(self, histogram, frame, types, weight_expression, result):
+        self.__needs_bootstrap = True
+        if histogram.event_variable not in types:
+            raise NameError('Impossible to find the type of column {} used by {}'.format(
+                histogram.event_variable, histogram.name))
+        nreplicas = histogram.nreplicas
+        column_name = action_column(histogram.name)
+        frame = self.__define(frame, column_name + '_bootstrap_x',
+            'ntupro::replicate({}, {})'.format(histogram.variable, nreplicas), types)
+        frame = self.__define(frame, column_name + '_bootstrap_replica',
+            'ntupro::replica_index({})'.format(nreplicas), types)
+        frame = self.__define(frame, column_name + '_bootstrap_weight',
+            'ntupro::bootstrap_weights({}, {}ULL, {}, {})'.format(
+                histogram.event_variable, histogram.seed, nreplicas,
+                weight_expression if weight_expression else '1.'), types)
+        if histogram.edges:
+            edges = self.__new_name('e')
+            self.__booking.append('const std::vector<double> {}{{{}}};'.format(
+                edges, ', '.join([cpp_double(edge) for edge in histogram.edges])))
+            model = 'ROOT::RDF::TH2DModel({0}, {0}, {1}, {2}.data(), {3}, 0., {3}.)'.format(
+                cpp_string(histogram.name), len(histogram.edges) - 1, edges, nreplicas)
+        else:
+            model = 'ROOT::RDF::TH2DModel({0}, {0}, {1}, {2}, {3}, {4}, 0., {4}.)'.format(
+                cpp_string(histogram.name), histogram.nbins, cpp_double(histogram.low),
+                cpp_double(histogram.up), nreplicas)
+        self.__booking.append(
+            'auto {0} = {1}.Histo2D<ROOT::RVec<double>, ROOT::RVec<double>, ROOT::RVec<double>>({2}, {3}, {4}, {5});'.format(
+                result, frame, model,
+                cpp_string(column_name + '_bootstrap_x'),
+                cpp_string(column_name + '_bootstrap_replica'),
+                cpp_string(column_name + '_bootstrap_weight')))
+        self.__harvesting.append('output->Add({}->Clone());'.format(result))
+        if histogram.split_replicas:
+            self.split_replicas.append(histogram.name)
+
+    def __step_counters(self, frame, weights):
+        """Book (once per frame and weights) raw entries, sum of weights
+        and sum of squared weights; a selection with only weights shares
+        the frame of its parent but not its sums.
+        """
+        key = (frame, tuple(weights))
+        if key not in self.__counters:
+            counts = [counters[0] for (other, _), counters in self.__counters.items() if other == frame]
+            if counts:
+                count = counts[0]
+            else:
+                count = self.__new_name('c')
+                self.__booking.append('auto {} = {}.Count();'.format(count, frame))
+            weight_expression = self.__weight_expression(weights)
+            if weight_expression:
+                types = dict(self.column_types)
+                weighted = self.__define(frame, 'ntupro_cutflow_weight', weight_expression, types, 'double')
+                weighted = self.__define(weighted, 'ntupro_cutflow_weight2',
+                        'ntupro_cutflow_weight*ntupro_cutflow_weight', types, 'double')
+                sumw = self.__new_name('c')
+                sumw2 = self.__new_name('c')
+                self.__booking.append('auto {} = {}.Sum<double>("ntupro_cutflow_weight");'.format(
+                    sumw, weighted))
+                self.__booking.append('auto {} = {}.Sum<double>("ntupro_cutflow_weight2");'.format(
+                    sumw2, weighted))
+                self.__counters[key] = (count, sumw, sumw2)
+            else:
+                self.__counters[key] = (count, None, None)
+        return self.__counters[key]
+
+    def __cutflow(self, cutflow, steps):
+        from ._run import raw_cutflow_name
+        counters = [self.__step_counters(frame, weights) for _, frame, weights in steps]
+        for name, weighted in [(cutflow.name, True), (raw_cutflow_name(cutflow.name), False)]:
+            histo = self.__new_name('h')
+            self.__harvesting.append('auto {0} = new TH1D({1}, {1}, {2}, 0., {2}.);'.format(
+                histo, cpp_string(name), len(steps)))
+            for i, ((step_name, _, _), (count, sumw, sumw2)) in enumerate(zip(steps, counters), 1):
+                self.__harvesting.append('{}->GetXaxis()->SetBinLabel({}, {});'.format(
+                    histo, i, cpp_string(step_name)))
+                if weighted and sumw is not None:
+                    self.__harvesting.append('{}->SetBinContent({}, *{});'.format(histo, i, sumw))
+                    self.__harvesting.append('{}->SetBinError({}, std::sqrt(*{}));'.format(histo, i, sumw2))
+                else:
+                    self.__harvesting.append('{}->SetBinContent({}, *{});'.format(histo, i, count))
+                    self.__harvesting.append('{}->SetBinError({}, std::sqrt(double(*{})));'.format(
+                        histo, i, count))
+            self.__harvesting.append('{}->SetEntries(*{});'.format(histo, counters[0][0]))
+            self.__harvesting.append('output->Add({});'.format(histo))
+
+
+def source_hash(source, includes = None, salt = ''):
+    """Hash of the generated source, of the content of the included headers
+    and of an optional salt (e.g. the ROOT version), used to cache the compiled
+    libraries on disk.
+    """
+    sha = hashlib.sha1()
+    sha.update(source.encode())
+    for include in includes if includes else list():
+        with open(include, 'rb') as f:
+            sha.update(f.read())
+    sha.update(str(salt).encode())
+    return sha.hexdigest()[:16]
+
+
+def compile_graph_source(source, cache_dir, includes = None):
+    """Write the source to the cache directory, compile it with ACLiC (only
+    if not already done for the same hash) and load the library.
+
+    Returns:
+        function_name (str): Name of the entry point, accessible as ROOT.function_name
+    """
+    from ._root import load_root
+    ROOT = load_root()
+    digest = source_hash(source, includes, ROOT.gROOT.GetVersion())
+    function_name = 'ntupro_graph_{}'.format(digest)
+    source = source.replace(FUNCTION_PLACEHOLDER, function_name)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok = True)
+    path = os.path.join(cache_dir, '{}.C'.format(function_name))
+    with file_lock(path + '.lock'):
+        if not os.path.isfile(path):
+            logger.debug('%%%%%%%%%% Writing generated source to {}'.format(path))
+            with open(path, 'w') as f:
+                f.write(source)
+        else:
+            logger.debug('%%%%%%%%%% Found cached source {}'.format(path))
+        # 'k' keeps the library, which is rebuilt only if older than the source
+        if not ROOT.gSystem.CompileMacro(path, 'kO', '', cache_dir):
+            raise RuntimeError('Compilation of {} failed'.format(path))
+    return function_name
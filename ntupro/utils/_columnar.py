@@ -0,0 +1,773 @@
+import ast
+import re
+from copy import copy
+
+from ._booking import Dataset
+from ._booking import Count
+from ._booking import Cutflow
+from ._booking import Histogram
+from ._booking import BootstrapHistogram
+from ._expressions import action_expressions
+from ._expressions import graph_identifiers
+from ._arrow import arrow_columns
+from ._arrow import arrow_num_entries
+from ._booking import ArrowNtuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('the columnar backend cannot run without numpy; install it with `pip install numpy` and try again')
+    return numpy
+
+
+def import_uproot():
+    try:
+        import uproot
+    except ImportError:
+        raise ImportError('the columnar backend cannot run without uproot; install it with `pip install uproot` and try again')
+    return uproot
+
+
+# Functions that can be used in the expressions evaluated by the columnar
+# backend, with the numpy function they are mapped to
+NUMPY_FUNCTIONS = {
+    'abs': 'abs', 'fabs': 'abs', 'sqrt': 'sqrt', 'exp': 'exp', 'log': 'log',
+    'log10': 'log10', 'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'asin': 'arcsin',
+    'acos': 'arccos', 'atan': 'arctan', 'atan2': 'arctan2', 'sinh': 'sinh',
+    'cosh': 'cosh', 'tanh': 'tanh', 'pow': 'power', 'hypot': 'hypot',
+    'floor': 'floor', 'ceil': 'ceil', 'min': 'minimum', 'max': 'maximum',
+    'fmin': 'fmin', 'fmax': 'fmax'}
+
+FLOAT_SUFFIX_RE = re.compile(r'((?<![\w.])(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)[fF](?!\w)')
+INTEGER_SUFFIX_RE = re.compile(r'((?<![\w.])\d+)(?:[uU][lL]{0,2}|[lL]{1,2}[uU]?)(?!\w)')
+NAMESPACE_RE = re.compile(r'\b(?:std|TMath)::(\w+)')
+
+
+def parenthesized(node, source):
+    """Return True if the node of the syntax tree parsed from source is
+    enclosed in its own parentheses.
+    """
+    lines = source.split('\n')
+    offsets = [0]
+    for line in lines[:-1]:
+        offsets.append(offsets[-1] + len(line) + 1)
+    start = offsets[node.lineno - 1] + node.col_offset
+    end = offsets[node.end_lineno - 1] + node.end_col_offset
+    return source[:start].rstrip().endswith('(') and source[end:].lstrip().startswith(')')
+
+
+class NumpyExpression:
+    """
+    Simple C++ expression (arithmetic, comparisons, logical operators and
+    common mathematical functions on flat columns) translated into a Python
+    syntax tree, evaluated on dictionaries of numpy arrays. Everything that
+    cannot be evaluated column-wise (indexing, ternary operator, member
+    access, casts, user-defined functions) raises NotImplementedError when
+    the expression is created, so that unsupported graphs are spotted before
+    reading any data.
+
+    Args:
+        expression (str): C++ expression, as used with RDataFrame
+
+    Attributes:
+        expression (str): Original C++ expression
+        tree (ast.Expression): Translated Python syntax tree
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        self.tree = self.__parse(expression)
+
+    def __parse(self, expression):
+        if '?' in expression or '~' in expression or '->' in expression:
+            raise NotImplementedError('Expression {} not supported by the columnar backend'.format(
+                expression))
+        translated = FLOAT_SUFFIX_RE.sub(r'\1', expression)
+        translated = INTEGER_SUFFIX_RE.sub(r'\1', translated)
+        translated = NAMESPACE_RE.sub(r'\1', translated)
+        translated = translated.replace('&&', ' and ').replace('||', ' or ')
+        # C++ logical not binds like the Python unary invert, which is thus
+        # used in its place and evaluated as logical not
+        translated = re.sub(r'!(?!=)', '~', translated)
+        translated = re.sub(r'\btrue\b', 'True', translated)
+        translated = re.sub(r'\bfalse\b', 'False', translated)
+        try:
+            tree = ast.parse(translated.strip(), mode = 'eval')
+        except SyntaxError:
+            raise NotImplementedError('Expression {} not supported by the columnar backend'.format(
+                expression))
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Subscript, ast.Attribute, ast.IfExp, ast.Lambda,
+                    ast.Dict, ast.List, ast.Tuple, ast.Set, ast.Starred)):
+                raise NotImplementedError('Expression {} not supported by the columnar backend'.format(
+                    expression))
+            if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) \
+                    or node.func.id not in NUMPY_FUNCTIONS):
+                raise NotImplementedError('Function call in {} not supported by the columnar backend'.format(
+                    expression))
+            # Bitwise and, or and xor bind tighter than comparisons in Python,
+            # looser in C++: without parentheses the two would differ
+            if isinstance(node, ast.Compare):
+                for operand in [node.left] + node.comparators:
+                    if isinstance(operand, ast.BinOp) and \
+                            isinstance(operand.op, (ast.BitAnd, ast.BitOr, ast.BitXor)) and \
+                            not parenthesized(operand, translated.strip()):
+                        raise NotImplementedError('Bitwise operator compared without parentheses in {} not supported by the columnar backend'.format(
+                            expression))
+        return tree
+
+    def evaluate(self, columns):
+        """Evaluate the expression on a dictionary {'column': array}."""
+        return self.__evaluate(self.tree.body, columns, import_numpy())
+
+    def __evaluate(self, node, columns, np):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id == 'True':
+                return True
+            if node.id == 'False':
+                return False
+            if node.id not in columns:
+                raise NameError('Unknown column {} in expression {}'.format(
+                    node.id, self.expression))
+            return columns[node.id]
+        if isinstance(node, ast.BoolOp):
+            values = [self.__evaluate(value, columns, np) for value in node.values]
+            function = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            result = values[0]
+            for value in values[1:]:
+                result = function(result, value)
+            return result
+        if isinstance(node, ast.UnaryOp):
+            operand = self.__evaluate(node.operand, columns, np)
+            if isinstance(node.op, (ast.Invert, ast.Not)):
+                return np.logical_not(operand)
+            if isinstance(node.op, ast.USub):
+                return -operand
+            return operand
+        if isinstance(node, ast.BinOp):
+            left = self.__evaluate(node.left, columns, np)
+            right = self.__evaluate(node.right, columns, np)
+            return self.__binary(node.op, left, right, np)
+        if isinstance(node, ast.Compare):
+            # Comparisons are left-associative in C++, and relational
+            # operators bind tighter than equality ones
+            terms = [self.__evaluate(node.left, columns, np)]
+            equalities = list()
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.__evaluate(comparator, columns, np)
+                if isinstance(op, (ast.Eq, ast.NotEq)):
+                    equalities.append(op)
+                    terms.append(right)
+                else:
+                    terms[-1] = self.__compare(op, terms[-1], right, np)
+            result = terms[0]
+            for op, term in zip(equalities, terms[1:]):
+                result = self.__compare(op, result, term, np)
+            return result
+        if isinstance(node, ast.Call):
+            function = getattr(np, NUMPY_FUNCTIONS[node.func.id])
+            return function(*[self.__evaluate(arg, columns, np) for arg in node.args])
+        raise NotImplementedError('Expression {} not supported by the columnar backend'.format(
+            self.expression))
+
+    def __binary(self, op, left, right, np):
+        if isinstance(op, ast.Add):
+            return np.add(left, right)
+        if isinstance(op, ast.Sub):
+            return np.subtract(left, right)
+        if isinstance(op, ast.Mult):
+            return np.multiply(left, right)
+        if isinstance(op, ast.Div):
+            # C++ division between integers truncates towards zero
+            if np.issubdtype(np.result_type(left), np.integer) and \
+                    np.issubdtype(np.result_type(right), np.integer):
+                return np.fix(np.true_divide(left, right)).astype(np.result_type(left, right))
+            return np.true_divide(left, right)
+        if isinstance(op, ast.Mod):
+            return np.fmod(left, right)
+        if isinstance(op, ast.BitAnd):
+            return np.bitwise_and(left, right)
+        if isinstance(op, ast.BitOr):
+            return np.bitwise_or(left, right)
+        if isinstance(op, ast.BitXor):
+            return np.bitwise_xor(left, right)
+        if isinstance(op, ast.LShift):
+            return np.left_shift(left, right)
+        if isinstance(op, ast.RShift):
+            return np.right_shift(left, right)
+        raise NotImplementedError('Operator in {} not supported by the columnar backend'.format(
+            self.expression))
+
+    def __compare(self, op, left, right, np):
+        functions = {
+            ast.Eq: np.equal, ast.NotEq: np.not_equal, ast.Lt: np.less,
+            ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal}
+        return functions[type(op)](left, right)
+
+
+class HistogramArrays:
+    """
+    Result of an action of the columnar backend, stored as numpy arrays
+    including underflow and overflow bins (same layout as the fArray of the
+    ROOT histograms). Partial results obtained from different chunks or
+    processes are merged with Add, and the ROOT object is created only
+    when needed (e.g. to be written to file).
+
+    Args:
+        name (str): Name of the result
+        kind (str): 'TH1D', 'TH1F' (contents in single precision), 'TH2D'
+            or 'TParameter'
+        x_edges (array): Edges of the x axis (None for TParameter)
+        y_edges (array): Edges of the y axis (only for TH2D)
+        fixed (tuple): (nbins, low, up) if the x axis has fixed binning
+        labels (list): Labels of the bins of the x axis
+        split (Bool): If True, the replicas on the y axis of a TH2D are
+            written as separate histograms
+
+    Attributes:
+        contents (array): Sums of weights, underflow and overflow included
+        sumw2 (array): Sums of squared weights
+        entries (float): Number of fills
+        stats (array): Statistics as used by TH1::PutStats
+    """
+    def __init__(self, name, kind, x_edges = None, y_edges = None,
+            fixed = None, labels = None, split = False):
+        np = import_numpy()
+        self.name = name
+        self.kind = kind
+        self.x_edges = x_edges
+        self.y_edges = y_edges
+        self.fixed = fixed
+        self.labels = labels
+        self.split = split
+        if kind == 'TParameter':
+            shape = 1
+            nstats = 0
+        elif kind in ['TH1D', 'TH1F']:
+            shape = len(x_edges) + 1
+            nstats = 4
+        else:
+            shape = (len(x_edges) + 1) * (len(y_edges) + 1)
+            nstats = 7
+        # As in TH1F, only the contents are in single precision
+        self.contents = np.zeros(shape, dtype = np.float32 if kind == 'TH1F' else np.float64)
+        self.sumw2 = np.zeros(shape)
+        self.stats = np.zeros(nstats)
+        self.entries = 0.
+
+    def GetName(self):
+        return self.name
+
+    def Add(self, other):
+        self.contents += other.contents
+        self.sumw2 += other.sumw2
+        self.stats += other.stats
+        self.entries += other.entries
+        return self
+
+    def to_root(self):
+        """Return the equivalent ROOT object."""
+        from ._root import load_root
+        ROOT = load_root()
+        if self.kind == 'TParameter':
+            return ROOT.TParameter['double'](self.name, float(self.contents[0]))
+        if self.kind in ['TH1D', 'TH1F']:
+            if self.fixed:
+                nbins, low, up = self.fixed
+                histo = getattr(ROOT, self.kind)(self.name, self.name, nbins, low, up)
+            else:
+                edges = ROOT.std.vector['double'](self.x_edges.tolist())
+                histo = getattr(ROOT, self.kind)(self.name, self.name,
+                    len(self.x_edges) - 1, edges.data())
+            if self.labels:
+                for i, label in enumerate(self.labels, 1):
+                    histo.GetXaxis().SetBinLabel(i, label)
+        else:
+            x_edges = ROOT.std.vector['double'](self.x_edges.tolist())
+            y_edges = ROOT.std.vector['double'](self.y_edges.tolist())
+            histo = ROOT.TH2D(self.name, self.name,
+                len(self.x_edges) - 1, x_edges.data(),
+                len(self.y_edges) - 1, y_edges.data())
+        histo.Sumw2()
+        histo.SetDirectory(0)
+        # Bin contents and squared errors are copied in one go
+        np = import_numpy()
+        root_array_view(histo.GetArray(), len(self.contents), np,
+            self.contents.dtype)[:] = self.contents
+        root_array_view(histo.GetSumw2().GetArray(), len(self.sumw2), np)[:] = self.sumw2
+        histo.SetEntries(self.entries)
+        if self.stats.any():
+            stats = ROOT.std.vector['double'](self.stats.tolist())
+            histo.PutStats(stats.data())
+        return histo
+
+    def to_uproot(self):
+        """Return the equivalent histogram in the form written by uproot,
+        for one-dimensional histograms only.
+        """
+        if self.kind not in ['TH1D', 'TH1F']:
+            raise NotImplementedError('Only one-dimensional histograms can be written with uproot, not {}'.format(
+                self.kind))
+        from uproot.writing.identify import to_TAxis, to_TH1x
+        np = import_numpy()
+        nbins = len(self.x_edges) - 1
+        edges = np.asarray(self.x_edges, dtype = np.float64)
+        axis = to_TAxis('xaxis', '', nbins, float(edges[0]), float(edges[-1]),
+            None if self.fixed else edges)
+        sumw, sumw2, sumwx, sumwx2 = [float(value) for value in self.stats]
+        return to_TH1x(self.name, self.name, self.contents, float(self.entries),
+            sumw, sumw2, sumwx, sumwx2, self.sumw2, axis)
+
+    def Write(self):
+        if self.split:
+            from ._run import split_replicas
+            for histo in split_replicas(self.to_root()):
+                histo.Write()
+        else:
+            self.to_root().Write()
+
+
+class SparseHistogram:
+    """
+    Result of a Histogram with 'sparse' storage: only the non-empty bins
+    are stored, as a dictionary from the bin index (flow bins included, as
+    in ROOT) to the sum of weights and of squared weights. Partial results
+    are merged with Add, and a dense TH1D is created only when written.
+
+    Args:
+        name (str): Name of the result
+        x_edges (array): Edges of the x axis
+        fixed (tuple): (nbins, low, up) if the x axis has fixed binning
+
+    Attributes:
+        bins (dict): Sum of weights and of squared weights of the non-empty bins
+        entries (float): Number of fills
+        stats (list): Statistics as used by TH1::PutStats
+    """
+    def __init__(self, name, x_edges, fixed = None):
+        self.name = name
+        self.x_edges = x_edges
+        self.fixed = fixed
+        self.bins = dict()
+        self.entries = 0.
+        self.stats = [0.] * 4
+
+    def GetName(self):
+        return self.name
+
+    def fill(self, bins, values, weights, np):
+        nx = len(self.x_edges) - 1
+        filled, inverse = np.unique(bins, return_inverse = True)
+        sumw = np.bincount(inverse, weights = weights)
+        sumw2 = np.bincount(inverse, weights = weights * weights)
+        for index, w, w2 in zip(filled.tolist(), sumw.tolist(), sumw2.tolist()):
+            self.add_bin(index, w, w2)
+        self.entries += len(bins)
+        inside = (bins >= 1) & (bins <= nx)
+        w = weights[inside]
+        x = np.asarray(values, dtype = np.float64)[inside]
+        for i, value in enumerate([np.sum(w), np.sum(w * w), np.sum(w * x), np.sum(w * x * x)]):
+            self.stats[i] += float(value)
+
+    def add_bin(self, index, sumw, sumw2):
+        if index in self.bins:
+            content = self.bins[index]
+            self.bins[index] = (content[0] + sumw, content[1] + sumw2)
+        else:
+            self.bins[index] = (sumw, sumw2)
+
+    def Add(self, other):
+        for index, (sumw, sumw2) in other.bins.items():
+            self.add_bin(index, sumw, sumw2)
+        self.entries += other.entries
+        self.stats = [a + b for a, b in zip(self.stats, other.stats)]
+        return self
+
+    def to_arrays(self):
+        """Return the equivalent (dense) HistogramArrays."""
+        np = import_numpy()
+        arrays = HistogramArrays(self.name, 'TH1D', np.asarray(self.x_edges), fixed = self.fixed)
+        if self.bins:
+            indices = np.fromiter(self.bins.keys(), dtype = np.int64, count = len(self.bins))
+            values = np.array(list(self.bins.values()))
+            arrays.contents[indices] = values[:, 0]
+            arrays.sumw2[indices] = values[:, 1]
+        arrays.stats[:] = self.stats
+        arrays.entries = self.entries
+        return arrays
+
+    def to_root(self):
+        return self.to_arrays().to_root()
+
+    def to_uproot(self):
+        return self.to_arrays().to_uproot()
+
+    def Write(self):
+        self.to_root().Write()
+
+
+def root_array_view(pointer, size, np, dtype = None):
+    """numpy view of the size values (doubles by default) pointed to by
+    pointer, e.g. the fArray of a histogram as returned by TH1D::GetArray.
+    """
+    pointer.reshape((size,))
+    return np.frombuffer(pointer, dtype = dtype or np.float64, count = size)
+
+
+def find_bins(values, edges, fixed, np):
+    """Bin indices as computed by TAxis::FindBin (0 for underflow and
+    nbins + 1 for overflow).
+    """
+    values = np.asarray(values, dtype = np.float64)
+    if fixed:
+        nbins, low, up = fixed
+        bins = np.full(values.shape, nbins + 1, dtype = np.int64)
+        inside = (values >= low) & (values < up)
+        bins[values < low] = 0
+        bins[inside] = 1 + (nbins * (values[inside] - low) / (up - low)).astype(np.int64)
+        return bins
+    return np.searchsorted(edges, values, side = 'right')
+
+
+def splitmix64(x, np):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def poisson_one(state, np):
+    """Same Poisson(1) generator used by BOOTSTRAP_CODE in C++."""
+    u = (splitmix64(state, np) >> np.uint64(11)).astype(np.float64) * (1.0 / 9007199254740992.0)
+    k = np.zeros(u.shape, dtype = np.int64)
+    p = 0.36787944117144233
+    cdf = p
+    for i in range(1, 33):
+        below = u >= cdf
+        if not below.any():
+            break
+        k[below] += 1
+        p /= i
+        cdf += p
+    return k
+
+
+def bootstrap_weights(events, seed, nreplicas, np):
+    """Array of shape (nevents, nreplicas) with the Poisson(1) weights."""
+    with np.errstate(over = 'ignore'):
+        events = np.asarray(events).astype(np.int64).astype(np.uint64)
+        base = splitmix64(events ^ splitmix64(np.uint64(seed), np), np)
+        states = base[:, None] + np.arange(nreplicas, dtype = np.uint64)[None, :]
+        return poisson_one(states, np)
+
+
+class ColumnarGraphRunner:
+    """
+    Execute an optimized Graph on the numpy arrays read with uproot from the
+    ntuples of its dataset, chunk by chunk. Cuts are evaluated as boolean
+    masks, computed once per selection node and shared by all its children,
+    weights are vectorized products and histograms are filled with bincount.
+    The results of all the chunks are accumulated in HistogramArrays.
+
+    Args:
+        graph (Graph): Graph to execute
+        step_size (int): Number of entries read at once
+        progress (function): If given, called with the entries processed
+            after each chunk, and with the entries of each ntuple (as
+            progress(processed, total)) when it is opened
+
+    Attributes:
+        graph (Graph): Graph to execute
+        step_size (int): Number of entries read at once
+        progress (function): Function called with the progress of the loop
+        expressions (dict): Translated expressions, by C++ expression
+        results (dict): Accumulated results, by name
+        ntuple (Ntuple): Ntuple of the chunk being processed
+        events (int): Number of entries processed
+        filters (dict): Entries reaching and passing each selection and
+            membership node, as [all, pass] by tuple of the node names
+            from the root of the graph
+    """
+    def __init__(self, graph, step_size = 1000000, progress = None):
+        self.graph = graph
+        self.step_size = step_size
+        self.progress = progress
+        self.expressions = dict()
+        self.results = dict()
+        self.ntuple = None
+        self.events = 0
+        self.filters = dict()
+        self.__translate(graph)
+
+    def __translate(self, node):
+        """Translate all the expressions before reading any data."""
+        expressions = list()
+        if node.kind == 'selection':
+            expressions = [operation.expression for operation in \
+                    node.unit_block.cuts + node.unit_block.weights]
+        elif node.kind == 'action':
+            action = node.unit_block
+            if action.prerequisites:
+                expressions.extend(action.prerequisites.values())
+            if getattr(action, 'expression', None):
+                expressions.append(action.expression)
+        elif node.kind not in ['dataset', 'membership']:
+            raise NotImplementedError('Node of kind {} not supported by the columnar backend'.format(
+                node.kind))
+        for expression in expressions:
+            if expression not in self.expressions:
+                self.expressions[expression] = NumpyExpression(expression)
+        for child in node.children:
+            self.__translate(child)
+
+    def evaluate(self, expression, columns):
+        return self.expressions[expression].evaluate(columns)
+
+    def run(self):
+        """Loop over all the ntuples of the dataset and return the list of results."""
+        needed = graph_identifiers(self.graph)
+        for ntuple in self.graph.unit_block.ntuples:
+            for arrays, nentries in self.__chunks(ntuple, needed):
+                self.process(arrays, ntuple, nentries)
+        return list(self.results.values())
+
+    def __chunks(self, ntuple, needed):
+        """Yield the arrays of each chunk with its number of entries, which
+        cannot be deduced from the arrays if the graph reads no column.
+        """
+        if isinstance(ntuple, ArrowNtuple):
+            # Memory-mapped columns are sliced without copies
+            arrays = arrow_columns(ntuple, needed)
+            nentries = arrow_num_entries(ntuple)
+            if self.progress is not None:
+                self.progress(0, nentries)
+            for start in range(0, nentries, self.step_size):
+                stop = min(start + self.step_size, nentries)
+                yield dict([(name, array[start:stop]) \
+                        for name, array in arrays.items()]), stop - start
+            return
+        uproot = import_uproot()
+        trees = [uproot.open(ntuple.path)[ntuple.directory]]
+        for friend in ntuple.friends:
+            trees.append(uproot.open(friend.path)[friend.directory])
+        branches = list()
+        for tree in trees:
+            available = set(tree.keys())
+            branches.append([name for name in needed if name in available])
+        nentries = trees[0].num_entries
+        if self.progress is not None:
+            self.progress(0, nentries)
+        for start in range(0, nentries, self.step_size):
+            stop = min(start + self.step_size, nentries)
+            arrays = dict()
+            for tree, names in zip(trees, branches):
+                if names:
+                    arrays.update(tree.arrays(names, entry_start = start,
+                        entry_stop = stop, library = 'np'))
+            yield arrays, stop - start
+
+    def process(self, arrays, ntuple = None, nentries = None):
+        """Process one chunk, given as a dictionary {'column': array}, of
+        the ntuple passed (needed only by merged graphs). The number of
+        entries of the chunk is taken from the arrays if not given.
+        """
+        np = import_numpy()
+        if nentries is None:
+            nentries = len(next(iter(arrays.values()))) if arrays else 0
+        mask = np.ones(nentries, dtype = bool)
+        steps = [(self.graph.name, mask, None)]
+        self.ntuple = ntuple
+        self.events += nentries
+        for child in self.graph.children:
+            self.__node(child, arrays, mask, None, steps, np, (self.graph.name,))
+        if self.progress is not None:
+            self.progress(nentries, 0)
+
+    def __count(self, path, entries, passed):
+        counts = self.filters.setdefault(path, [0, 0])
+        counts[0] += int(entries)
+        counts[1] += int(passed)
+
+    def __node(self, node, arrays, mask, weight, steps, np, path):
+        path = path + (node.name,)
+        if node.kind == 'membership':
+            # Chunks come from a single ntuple, which either belongs to
+            # the dataset or not
+            entries = np.count_nonzero(mask)
+            if self.ntuple not in node.unit_block.ntuples:
+                self.__count(path, entries, 0)
+                return
+            self.__count(path, entries, entries)
+            steps = [(node.name, mask, None)]
+            for child in node.children:
+                self.__node(child, arrays, mask, weight, steps, np, path)
+        elif node.kind == 'selection':
+            selection = node.unit_block
+            entries = np.count_nonzero(mask) if selection.cuts else None
+            for cut in selection.cuts:
+                mask = np.logical_and(mask, self.evaluate(cut.expression, arrays))
+            if entries is not None:
+                self.__count(path, entries, np.count_nonzero(mask))
+            for w in selection.weights:
+                value = np.broadcast_to(self.evaluate(w.expression, arrays), mask.shape)
+                weight = value if weight is None else weight * value
+            steps = steps + [(selection.name, mask, weight)]
+            for child in node.children:
+                self.__node(child, arrays, mask, weight, steps, np, path)
+        elif node.kind == 'action':
+            self.__action(node.unit_block, arrays, mask, weight, steps, np)
+
+    def __result(self, name, *args, **kwargs):
+        if name not in self.results:
+            self.results[name] = HistogramArrays(name, *args, **kwargs)
+        return self.results[name]
+
+    def __columns(self, action, arrays):
+        defined, _ = action_expressions(action)
+        if not defined:
+            return arrays
+        columns = dict(arrays)
+        for column, expression in defined.items():
+            columns[column] = self.evaluate(expression, columns)
+        return columns
+
+    def __action(self, action, arrays, mask, weight, steps, np):
+        if isinstance(action, Cutflow):
+            self.__cutflow(action, steps, np)
+            return
+        columns = self.__columns(action, arrays)
+        values = np.broadcast_to(columns[action.variable], mask.shape)[mask]
+        w = np.ones(len(values)) if weight is None else \
+                np.asarray(weight[mask], dtype = np.float64)
+        if isinstance(action, Count):
+            result = self.__result(action.name, 'TParameter')
+            result.contents[0] += np.sum(values * w)
+            result.entries += len(values)
+        elif isinstance(action, BootstrapHistogram):
+            self.__bootstrap(action, columns, mask, values, w, np)
+        elif isinstance(action, Histogram) and action.storage == 'sparse':
+            edges, fixed = histogram_edges(action, np)
+            if action.name not in self.results:
+                self.results[action.name] = SparseHistogram(action.name, edges, fixed)
+            self.results[action.name].fill(find_bins(values, edges, fixed, np), values, w, np)
+        elif isinstance(action, Histogram):
+            edges, fixed = histogram_edges(action, np)
+            kind = 'TH1F' if action.storage == 'float' else 'TH1D'
+            result = self.__result(action.name, kind, edges, fixed = fixed)
+            fill(result, [find_bins(values, edges, fixed, np)], [values], w, np)
+        else:
+            raise NotImplementedError('Action {} not supported by the columnar backend'.format(
+                action))
+
+    def __bootstrap(self, histogram, columns, mask, values, w, np):
+        edges, fixed = histogram_edges(histogram, np)
+        nreplicas = histogram.nreplicas
+        y_edges = np.arange(nreplicas + 1, dtype = np.float64)
+        result = self.__result(histogram.name, 'TH2D', edges, y_edges,
+            split = histogram.split_replicas)
+        events = np.broadcast_to(columns[histogram.event_variable], mask.shape)[mask]
+        poisson = bootstrap_weights(events, histogram.seed, nreplicas, np)
+        x_bins = np.repeat(find_bins(values, edges, fixed, np), nreplicas)
+        y_values = np.tile(np.arange(nreplicas, dtype = np.float64) + 0.5, len(values))
+        y_bins = np.tile(np.arange(1, nreplicas + 1), len(values))
+        x_values = np.repeat(np.asarray(values, dtype = np.float64), nreplicas)
+        weights = (w[:, None] * poisson).ravel()
+        fill(result, [x_bins, y_bins], [x_values, y_values], weights, np)
+
+    def __cutflow(self, cutflow, steps, np):
+        from ._run import raw_cutflow_name
+        labels = [name for name, _, _ in steps]
+        edges = np.arange(len(steps) + 1, dtype = np.float64)
+        fixed = (len(steps), 0., float(len(steps)))
+        weighted = self.__result(cutflow.name, 'TH1D', edges, fixed = fixed, labels = labels)
+        raw = self.__result(raw_cutflow_name(cutflow.name), 'TH1D', edges, fixed = fixed, labels = labels)
+        for i, (_, mask, weight) in enumerate(steps, 1):
+            passed = float(np.count_nonzero(mask))
+            raw.contents[i] += passed
+            raw.sumw2[i] += passed
+            if weight is None:
+                weighted.contents[i] += passed
+                weighted.sumw2[i] += passed
+            else:
+                w = np.asarray(weight[mask], dtype = np.float64)
+                weighted.contents[i] += np.sum(w)
+                weighted.sumw2[i] += np.sum(w * w)
+        total = float(np.count_nonzero(steps[0][1]))
+        raw.entries += total
+        weighted.entries += total
+
+
+def histogram_edges(histogram, np):
+    if histogram.edges:
+        return np.asarray(histogram.edges, dtype = np.float64), None
+    fixed = (histogram.nbins, float(histogram.low), float(histogram.up))
+    return np.linspace(fixed[1], fixed[2], fixed[0] + 1), fixed
+
+
+def fill(result, bins, values, weights, np):
+    """Fill result with the given bin indices (one array per axis), values
+    and weights, updating contents, sums of squared weights, entries and
+    the statistics of the in-range entries as TH1::Fill does.
+    """
+    if len(bins) == 1:
+        index = bins[0]
+        nx = len(result.x_edges) - 1
+        inside = (index >= 1) & (index <= nx)
+    else:
+        nx = len(result.x_edges) - 1
+        ny = len(result.y_edges) - 1
+        index = bins[0] + (nx + 2) * bins[1]
+        inside = (bins[0] >= 1) & (bins[0] <= nx) & (bins[1] >= 1) & (bins[1] <= ny)
+    size = len(result.contents)
+    result.contents += np.bincount(index, weights = weights, minlength = size)[:size]
+    result.sumw2 += np.bincount(index, weights = weights * weights, minlength = size)[:size]
+    result.entries += len(index)
+    w = weights[inside]
+    x = values[0][inside]
+    result.stats[0] += np.sum(w)
+    result.stats[1] += np.sum(w * w)
+    result.stats[2] += np.sum(w * x)
+    result.stats[3] += np.sum(w * x * x)
+    if len(bins) == 2:
+        y = values[1][inside]
+        result.stats[4] += np.sum(w * y)
+        result.stats[5] += np.sum(w * y * y)
+        result.stats[6] += np.sum(w * x * y)
+
+
+def split_graph_by_ntuples(graph):
+    """Return shallow copies of graph, one per ntuple of its dataset, so
+    that the ntuples can be processed in parallel and the partial results
+    merged afterwards.
+    """
+    if len(graph.unit_block.ntuples) < 2:
+        return [graph]
+    chunks = list()
+    for ntuple in graph.unit_block.ntuples:
+        chunk = copy(graph)
+        chunk.unit_block = Dataset(graph.unit_block.name, [ntuple])
+        chunks.append(chunk)
+    return chunks
+
+
+def merge_results(results):
+    """Merge the partial results with the same name, preserving the order
+    in which the names appear first.
+    """
+    merged = dict()
+    for result in results:
+        name = result.GetName()
+        if name in merged and not hasattr(result, 'Add'):
+            # TParameter of the Count actions
+            merged[name].SetVal(merged[name].GetVal() + result.GetVal())
+        elif name in merged:
+            merged[name].Add(result)
+        else:
+            merged[name] = result
+    return list(merged.values())
@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+from bisect import bisect_left
+
+from ._root import load_root
+from ._skim import ntuple_fingerprint
+from ._optimization import shared_prefix
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Fill a TEntryList with a slice of the global entry numbers of a chain,
+# shifted to the local entry numbers of the file
+ENTRY_LIST_CODE = '''
+#ifndef NTUPRO_ENTRY_LISTS
+#define NTUPRO_ENTRY_LISTS
+#include "TEntryList.h"
+namespace ntupro {
+inline void fill_entries(TEntryList *list, const std::vector<ULong64_t> &entries,
+                         std::size_t begin, std::size_t end, Long64_t offset)
+{
+   for (std::size_t i = begin; i < end; ++i)
+      list->Enter(entries[i] - offset);
+}
+}
+#endif
+'''
+
+
+def file_slices(entries, offsets):
+    """Split the sorted global entry numbers of a chain by file.
+
+    Args:
+        entries (sequence): Sorted global entry numbers
+        offsets (list): First global entry of each file, followed by the
+            total number of entries
+
+    Returns:
+        slices (list): (begin, end, offset) for each file, where entries
+            [begin, end) belong to the file starting at global entry offset
+    """
+    slices = list()
+    begin = 0
+    for offset, next_offset in zip(offsets[:-1], offsets[1:]):
+        end = bisect_left(entries, next_offset, begin)
+        slices.append((begin, end, offset))
+        begin = end
+    return slices
+
+
+def prefix_candidates(graph):
+    """Nodes of the shared prefix of a graph which apply cuts, with the
+    cumulative cuts up to each of them, from the outermost to the deepest.
+    Only these nodes can be replayed, hence only these are recorded.
+    """
+    cuts = list()
+    candidates = list()
+    for node in shared_prefix(graph):
+        cuts = cuts + node.unit_block.cuts
+        if node.unit_block.cuts:
+            candidates.append((node, list(cuts)))
+    return candidates
+
+
+def cumulative_cuts(cuts):
+    """Single expression with all the cuts applied up to a node."""
+    return ' && '.join(['(' + cut.expression + ')' for cut in cuts])
+
+
+class EntryListCache:
+    """
+    Entries passing each selection node of a graph, stored as one TEntryList
+    per file, keyed by the fingerprint of the file and by the cumulative cut
+    expression of the node. The lists are recorded during single-threaded
+    event loops which do not replay any list themselves. In later runs, the
+    deepest node of the shared prefix of a graph whose lists are available
+    for all the files is replayed: the chain reads only the entries passing
+    it, so adding actions or children under that node does not require a
+    full pass over the dataset. The cuts are still applied, hence results
+    do not change, except the first steps of the cutflows.
+
+    Args:
+        directory (str): Directory where the entry lists are stored
+
+    Attributes:
+        directory (str): Directory where the entry lists are stored
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok = True)
+
+    def __path(self, ntuple, cuts):
+        fingerprint = ntuple_fingerprint(ntuple)
+        if fingerprint is None:
+            return None
+        content = json.dumps([fingerprint, cumulative_cuts(cuts)])
+        return os.path.join(self.directory, '{}.root'.format(
+            hashlib.sha1(content.encode()).hexdigest()[:16]))
+
+    def available(self, dataset, cuts):
+        paths = [self.__path(ntuple, cuts) for ntuple in dataset.ntuples]
+        return all([path is not None and os.path.exists(path) for path in paths])
+
+    def replay(self, chain, graph):
+        """Set on the chain the entry list of the deepest node of the shared
+        prefix of the graph recorded for all the files. Return the list (to
+        be kept alive as long as the chain is used), or None.
+        """
+        for node, cuts in reversed(prefix_candidates(graph)):
+            if self.available(graph.unit_block, cuts):
+                return self.__set_entry_list(chain, graph.unit_block, node, cuts)
+        return None
+
+    def __set_entry_list(self, chain, dataset, node, cuts):
+        ROOT = load_root()
+        entry_list = ROOT.TEntryList('ntupro_entries', '')
+        entry_list.SetDirectory(0)
+        for ntuple in dataset.ntuples:
+            root_file = ROOT.TFile.Open(self.__path(ntuple, cuts))
+            entry_list.Add(root_file.Get('entries'))
+            root_file.Close()
+        chain.SetEntryList(entry_list)
+        logger.info('Replaying {} entries passing node {} of dataset {}'.format(
+            entry_list.GetN(), node.name, dataset.name))
+        return entry_list
+
+    def record(self, frame):
+        """Book the collection of the entries passing the end of frame."""
+        return frame.Take['ULong64_t']('rdfentry_')
+
+    def store(self, chain, dataset, cuts, entries):
+        """Write the entry lists of a node from the global entry numbers
+        collected by the (single-threaded, hence sorted) event loop.
+        """
+        ROOT = load_root()
+        ROOT.gInterpreter.Declare(ENTRY_LIST_CODE)
+        chain.GetEntries()
+        tree_offsets = chain.GetTreeOffset()
+        offsets = [tree_offsets[i] for i in range(chain.GetNtrees() + 1)]
+        slices = file_slices(entries, offsets)
+        for ntuple, (begin, end, offset) in zip(dataset.ntuples, slices):
+            path = self.__path(ntuple, cuts)
+            if path is None:
+                continue
+            entry_list = ROOT.TEntryList('entries', '', ntuple.directory, ntuple.path)
+            entry_list.SetDirectory(0)
+            ROOT.ntupro.fill_entries(entry_list, entries, begin, end, offset)
+            root_file = ROOT.TFile(path + '.part', 'RECREATE')
+            entry_list.Write('entries')
+            root_file.Close()
+            os.replace(path + '.part', path)
+        logger.debug('%%%%%%%%%% Stored {} entries passing {}'.format(
+            entries.size(), cumulative_cuts(cuts)))
@@ -0,0 +1,228 @@
+from multiprocessing import Pool
+from random import Random
+from time import time, sleep
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def task_costs(tasks, profile = None, seconds_per_ntuple = 60.):
+    """Estimated seconds needed by each task: the time per ntuple measured
+    for its dataset in a previous run (profile), if available, times the
+    number of its ntuples, otherwise seconds_per_ntuple for each ntuple.
+    """
+    rates = dict()
+    if profile is not None:
+        totals = dict()
+        for task in profile.tasks:
+            if task.ntuples:
+                seconds, ntuples = totals.get(task.dataset, (0., 0))
+                totals[task.dataset] = (seconds + task.wall_time(), ntuples + task.ntuples)
+        rates = dict([(dataset, seconds / ntuples) for dataset, (seconds, ntuples) in totals.items()])
+    return [rates.get(task.unit_block.name, seconds_per_ntuple) * len(task.unit_block.ntuples) \
+            for task in tasks]
+
+
+def pack_tasks(costs, target = None):
+    """Group the indices of the tasks into bundles with at most target
+    seconds of estimated cost, first fit in order of decreasing cost; tasks
+    costing more than target stay alone. Without target, every task is
+    a bundle of its own.
+    """
+    if target is None:
+        return [[i] for i in range(len(costs))]
+    bundles = list()
+    loads = list()
+    order = sorted(range(len(costs)), key = lambda i: costs[i], reverse = True)
+    for i in order:
+        for j, load in enumerate(loads):
+            if load + costs[i] <= target:
+                bundles[j].append(i)
+                loads[j] += costs[i]
+                break
+        else:
+            bundles.append([i])
+            loads.append(costs[i])
+    return sorted([sorted(bundle) for bundle in bundles])
+
+
+class Executor:
+    """
+    Base class of the executors of RunManager.run_with, which run each job
+    (a bundle of tasks) somewhere and return the outputs of the jobs, in
+    the order of the jobs. Subclasses implement map.
+
+    Attributes:
+        name (str): Name used in the log
+    """
+    name = 'executor'
+
+    def map(self, function, jobs):
+        raise NotImplementedError('map has to be implemented by the executors')
+
+
+def _run_job(function, job, index, attempt, startup, failure_rate, seed):
+    # Failures are reported back instead of raised, so that the parent
+    # can record them and submit the job again
+    start = time()
+    if startup:
+        sleep(startup)
+    try:
+        if Random('{}-{}-{}'.format(seed, index, attempt)).random() < failure_rate:
+            raise RuntimeError('Simulated failure of job {} (attempt {})'.format(index, attempt))
+        output = function(job)
+    except Exception as error:
+        return False, repr(error), start, time(), os.getpid()
+    return True, output, start, time(), os.getpid()
+
+
+class LocalExecutor(Executor):
+    """
+    Executor running the jobs in a pool of local processes. It can simulate
+    a cluster, so that packing strategies can be benchmarked and tested
+    offline: every job waits startup seconds before running, as the start
+    of a job on a batch system, and fails with probability failure_rate;
+    failed jobs (simulated or not) are submitted again up to max_retries
+    times. Every attempt is recorded with its start and end times.
+
+    Args:
+        nworkers (int): Number of processes
+        startup (float): Seconds waited at the start of every job
+        failure_rate (float): Probability that a job fails
+        max_retries (int): Number of times a failed job is submitted again
+        seed (int): Seed of the simulated failures
+        poll_interval (float): Seconds between two checks of the jobs
+
+    Attributes:
+        nworkers (int): Number of processes
+        startup (float): Seconds waited at the start of every job
+        failure_rate (float): Probability that a job fails
+        max_retries (int): Number of times a failed job is submitted again
+        seed (int): Seed of the simulated failures
+        poll_interval (float): Seconds between two checks of the jobs
+        records (list): Attempts of the last map, as dictionaries with job,
+            attempt, pid, start, end and failed
+        wall_time (float): Seconds elapsed in the last map
+    """
+    name = 'local processes'
+
+    def __init__(self, nworkers = 1, startup = 0., failure_rate = 0.,
+            max_retries = 2, seed = 0, poll_interval = 0.01):
+        if not isinstance(nworkers, int):
+            raise TypeError('wrong type for nworkers')
+        if nworkers < 1:
+            raise ValueError('nworkers has to be larger zero')
+        if not 0. <= failure_rate < 1.:
+            raise ValueError('failure_rate has to be in [0, 1)')
+        self.nworkers = nworkers
+        self.startup = startup
+        self.failure_rate = failure_rate
+        self.max_retries = max_retries
+        self.seed = seed
+        self.poll_interval = poll_interval
+        self.records = list()
+        self.wall_time = 0.
+
+    def map(self, function, jobs):
+        self.records = list()
+        start = time()
+        outputs = [None] * len(jobs)
+        pool = Pool(self.nworkers)
+        try:
+            running = dict([(i, (0, self.__submit(pool, function, jobs, i, 0))) \
+                    for i in range(len(jobs))])
+            while running:
+                for i, (attempt, pending) in list(running.items()):
+                    if not pending.ready():
+                        continue
+                    succeeded, output, job_start, job_end, pid = pending.get()
+                    self.records.append({'job': i, 'attempt': attempt, 'pid': pid,
+                        'start': job_start - start, 'end': job_end - start,
+                        'failed': not succeeded})
+                    del running[i]
+                    if succeeded:
+                        outputs[i] = output
+                    elif attempt < self.max_retries:
+                        logger.warning('Job {} failed ({}), submitted again'.format(i, output))
+                        running[i] = (attempt + 1, self.__submit(pool, function, jobs, i, attempt + 1))
+                    else:
+                        raise RuntimeError('Job {} failed {} times, last error: {}'.format(
+                            i, attempt + 1, output))
+                if running:
+                    sleep(self.poll_interval)
+        finally:
+            pool.terminate()
+            pool.join()
+        self.wall_time = time() - start
+        logger.info('Ran {} jobs with {} attempts ({} failed) in {:.2f} seconds'.format(
+            len(jobs), len(self.records), self.failures(), self.wall_time))
+        return outputs
+
+    def __submit(self, pool, function, jobs, i, attempt):
+        return pool.apply_async(_run_job, (function, jobs[i], i, attempt,
+            self.startup, self.failure_rate, self.seed))
+
+    def failures(self):
+        return len([record for record in self.records if record['failed']])
+
+    def busy_time(self):
+        """Seconds spent by the processes in all the attempts, startup included."""
+        return sum([record['end'] - record['start'] for record in self.records])
+
+
+class HTCondorExecutor(Executor):
+    """
+    Executor submitting one HTCondor job per bundle through htmap.
+
+    Args:
+        tag (str): Tag of the map
+
+    Attributes:
+        tag (str): Tag of the map
+    """
+    name = 'HTCondor'
+
+    def __init__(self, tag = 'ntupro'):
+        self.tag = tag
+
+    def map(self, function, jobs):
+        try:
+            import htmap
+        except ImportError:
+            raise ImportError('HTCondorExecutor cannot run without htmap; install it with `pip install htmap` and try again')
+        outputs = htmap.map(function, jobs, tag = self.tag)
+        outputs.wait(show_progress_bar = True)
+        return list(outputs)
+
+
+class DaskExecutor(Executor):
+    """
+    Executor running one Dask task per bundle on a distributed cluster.
+
+    Args:
+        client (Client): Client of the cluster; if None, one is created
+            connecting to address
+        address (str): Address of the scheduler (if None and no client is
+            given, a local cluster is started)
+
+    Attributes:
+        client (Client): Client of the cluster
+        address (str): Address of the scheduler
+    """
+    name = 'Dask'
+
+    def __init__(self, client = None, address = None):
+        self.client = client
+        self.address = address
+
+    def map(self, function, jobs):
+        try:
+            from dask.distributed import Client
+        except ImportError:
+            raise ImportError('DaskExecutor cannot run without dask.distributed; install it with `pip install "dask[distributed]"` and try again')
+        if self.client is None:
+            self.client = Client(self.address)
+        futures = self.client.map(function, jobs, pure = False)
+        return self.client.gather(futures)
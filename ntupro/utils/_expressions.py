@@ -0,0 +1,76 @@
+import re
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Quoted strings are removed before looking for identifiers, so that
+# e.g. the content of a string literal is not taken as a column name
+STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+IDENTIFIER_RE = re.compile(r'(?<![\w.])(?<!::)(?<!->)([A-Za-z_]\w*)(?!\s*(?:\(|::|\w))')
+CPP_KEYWORDS = set([
+    'true', 'false', 'and', 'or', 'not', 'nullptr', 'auto', 'const',
+    'int', 'unsigned', 'float', 'double', 'long', 'bool', 'char', 'short',
+    'return', 'if', 'else', 'sizeof', 'static_cast', 'std', 'ROOT'])
+
+
+def identifiers(expression):
+    """Return the list (without repetitions, in order of appearance) of the
+    identifiers found in a C++ expression, excluding function names, namespaces,
+    members and keywords. These are the candidate column names the expression
+    depends on.
+    """
+    if not expression:
+        return list()
+    stripped = STRING_RE.sub('""', expression)
+    found = list()
+    for name in IDENTIFIER_RE.findall(stripped):
+        if name not in CPP_KEYWORDS and name not in found:
+            found.append(name)
+    return found
+
+
+def action_expressions(action):
+    """Return the expressions, in the form {column: expression}, the action
+    defines before being filled, and the list of the other identifiers it
+    reads directly.
+    """
+    defined = dict()
+    if action.prerequisites:
+        defined.update(action.prerequisites)
+    expression = getattr(action, 'expression', None)
+    if expression:
+        defined[action.variable] = expression
+    read = list()
+    if action.variable is not None and action.variable not in defined:
+        read.append(action.variable)
+    event_variable = getattr(action, 'event_variable', None)
+    if event_variable is not None:
+        read.append(event_variable)
+    return defined, read
+
+
+def node_identifiers(node):
+    """Return the identifiers used by the expressions of a single node."""
+    found = list()
+    if node.kind == 'selection':
+        for operation in node.unit_block.cuts + node.unit_block.weights:
+            found.extend(identifiers(operation.expression))
+    elif node.kind == 'action':
+        defined, read = action_expressions(node.unit_block)
+        for expression in defined.values():
+            found.extend(identifiers(expression))
+        found.extend(read)
+    return found
+
+
+def graph_identifiers(graph):
+    """Return the set of identifiers used by all the expressions (cuts,
+    weights, variables and definitions) of a graph.
+    """
+    found = set()
+    nodes = [graph]
+    while nodes:
+        node = nodes.pop()
+        found.update(node_identifiers(node))
+        nodes.extend(node.children)
+    return found
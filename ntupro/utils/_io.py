@@ -0,0 +1,212 @@
+from time import time
+
+from ._root import load_root
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+OPEN_AHEAD_CODE = '''
+#ifndef NTUPRO_OPEN_AHEAD
+#define NTUPRO_OPEN_AHEAD
+#include <string>
+#include <vector>
+#include "TChain.h"
+#include "TFile.h"
+#include "TObject.h"
+
+namespace ntupro {
+
+// Notified by the chain every time it loads a tree, opens asynchronously
+// the following files; TFile::Open picks up the pending requests by name
+class OpenAhead : public TObject {
+public:
+    OpenAhead(TChain *chain, std::vector<std::string> files, int ahead)
+        : fChain(chain), fFiles(files), fAhead(ahead), fOpened(files.size(), false) {}
+
+    // Requests not picked up by the chain (e.g. files skipped by an entry
+    // list) are completed and closed, so that nothing outlives the graph
+    ~OpenAhead()
+    {
+        for (std::size_t i = 0; i < fFiles.size(); ++i) {
+            if (fOpened[i] && TFile::GetAsyncOpenStatus(fFiles[i].c_str()) != TFile::kAOSNotAsync)
+                delete TFile::Open(fFiles[i].c_str());
+        }
+    }
+
+    void Open(int current)
+    {
+        for (int i = current + 1; i <= current + fAhead && i < int(fFiles.size()); ++i) {
+            if (!fOpened[i]) {
+                TFile::AsyncOpen(fFiles[i].c_str());
+                fOpened[i] = true;
+            }
+        }
+    }
+
+    Bool_t Notify() override
+    {
+        Open(fChain->GetTreeNumber());
+        return kTRUE;
+    }
+
+private:
+    TChain *fChain;
+    std::vector<std::string> fFiles;
+    int fAhead;
+    std::vector<bool> fOpened;
+};
+
+}
+
+#endif
+'''
+
+
+def declare_io_helpers():
+    ROOT = load_root()
+    if not hasattr(ROOT, 'ntupro') or not hasattr(ROOT.ntupro, 'OpenAhead'):
+        ROOT.gInterpreter.Declare(OPEN_AHEAD_CODE)
+
+
+class IOProfile:
+    """
+    Read settings applied to the chains of every graph before the event
+    loop, to be tuned for each storage backend. Settings left to None keep
+    the ROOT defaults.
+
+    Note that with implicit multithreading RDataFrame processes clones of
+    the chain, for which the cache size, the learning phase, the cluster
+    prefetching and the opening ahead of the next files are taken from the
+    ROOT defaults; the global settings (asynchronous prefetching of blocks)
+    apply in both cases.
+
+    Args:
+        cache_size (int): Size in bytes of the TTreeCache
+        learn_entries (int): Number of entries used by the TTreeCache to
+            learn which branches are read
+        cluster_prefetch (Bool): If True, the baskets of the whole next
+            cluster are read ahead
+        async_prefetch (Bool): If True, the next blocks of the current file
+            are read in a separate thread (TFile.AsyncPrefetching) and,
+            every time the chain moves to a new file, the following files
+            are opened ahead with TFile::AsyncOpen, so that the latency of
+            remote storage overlaps with the processing
+        open_ahead (int): Number of files opened ahead when async_prefetch is on
+        measure_io_time (Bool): If True, the time spent waiting on I/O is
+            measured with TTreePerfStats (only for single-threaded loops)
+
+    Attributes:
+        cache_size (int): Size in bytes of the TTreeCache
+        learn_entries (int): Number of entries of the learning phase
+        cluster_prefetch (Bool): Read ahead the baskets of the next cluster
+        async_prefetch (Bool): Prefetch asynchronously blocks and files
+        open_ahead (int): Number of files opened ahead
+        measure_io_time (Bool): Measure the time spent waiting on I/O
+    """
+    def __init__(self, cache_size = None, learn_entries = None,
+            cluster_prefetch = False, async_prefetch = False,
+            open_ahead = 1, measure_io_time = False):
+        if cache_size is not None and cache_size < 0:
+            raise ValueError('cache_size cannot be negative')
+        if learn_entries is not None and learn_entries < 1:
+            raise ValueError('learn_entries has to be larger zero')
+        self.cache_size = cache_size
+        self.learn_entries = learn_entries
+        self.cluster_prefetch = cluster_prefetch
+        self.async_prefetch = async_prefetch
+        self.open_ahead = open_ahead
+        self.measure_io_time = measure_io_time
+
+    def __str__(self):
+        return 'IOProfile(cache_size = {}, learn_entries = {}, cluster_prefetch = {}, async_prefetch = {})'.format(
+            self.cache_size, self.learn_entries, self.cluster_prefetch, self.async_prefetch)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def apply_globals(self):
+        """Set the process-wide settings, to be called before any file is opened."""
+        ROOT = load_root()
+        if self.async_prefetch:
+            ROOT.gEnv.SetValue('TFile.AsyncPrefetching', 1)
+        if self.learn_entries is not None:
+            ROOT.TTreeCache.SetLearnEntries(self.learn_entries)
+
+    def apply(self, chain, files = None):
+        """Apply the settings to a chain made of the files passed. With
+        async_prefetch, return the object opening ahead the following files
+        every time the chain loads a new one (notified by the chain, thus
+        to be kept alive as long as the chain and released with it),
+        otherwise None.
+        """
+        self.apply_globals()
+        if self.cache_size is not None:
+            chain.SetCacheSize(self.cache_size)
+        if self.learn_entries is not None:
+            chain.SetCacheLearnEntries(self.learn_entries)
+        if self.cluster_prefetch:
+            chain.SetClusterPrefetch(True)
+        if not self.async_prefetch or not files or len(files) < 2 or self.open_ahead < 1:
+            return None
+        ROOT = load_root()
+        declare_io_helpers()
+        open_ahead = ROOT.ntupro.OpenAhead(chain,
+            ROOT.std.vector['std::string'](files), self.open_ahead)
+        # The first files are opened right away, the next ones as the
+        # event loop moves through the chain
+        open_ahead.Open(0)
+        chain.SetNotify(open_ahead)
+        logger.debug('%%%%%%%%%% Opening {} files ahead of the chain'.format(self.open_ahead))
+        return open_ahead
+
+
+class IOCounters:
+    """
+    Bytes read, read calls and time spent waiting on I/O during the event
+    loop of a graph. The global counters of TFile are read when the object
+    is created and when stop is called; the time waiting on I/O is measured
+    through TTreePerfStats attached to the chain, only if requested and
+    if the loop is single-threaded.
+
+    Args:
+        chain (TChain): Chain read in the event loop
+        measure_io_time (Bool): If True, attach TTreePerfStats to the chain
+
+    Attributes:
+        bytes_read (int): Bytes read from the files
+        read_calls (int): Number of read calls
+        io_time (float): Seconds spent waiting on I/O (None if not measured)
+        wall_time (float): Seconds elapsed between creation and stop
+    """
+    def __init__(self, chain, measure_io_time = False):
+        ROOT = load_root()
+        self.perf_stats = None
+        if measure_io_time:
+            self.perf_stats = ROOT.TTreePerfStats('ntupro_io', chain)
+        self.start_bytes = ROOT.TFile.GetFileBytesRead()
+        self.start_calls = ROOT.TFile.GetFileReadCalls()
+        self.start_time = time()
+        self.bytes_read = 0
+        self.read_calls = 0
+        self.io_time = None
+        self.wall_time = 0.
+
+    def stop(self):
+        ROOT = load_root()
+        self.bytes_read = ROOT.TFile.GetFileBytesRead() - self.start_bytes
+        self.read_calls = ROOT.TFile.GetFileReadCalls() - self.start_calls
+        self.wall_time = time() - self.start_time
+        if self.perf_stats:
+            self.perf_stats.Finish()
+            self.io_time = self.perf_stats.GetDiskTime()
+        return self
+
+    def __str__(self):
+        layout = '{:.1f} MB read in {} calls'.format(
+            self.bytes_read / 1e6, self.read_calls)
+        if self.io_time is not None:
+            layout += ', {:.2f} of {:.2f} seconds waiting on I/O'.format(
+                self.io_time, self.wall_time)
+        return layout
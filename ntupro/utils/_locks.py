@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+import os
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path, shared by all the processes of the machine
+    (e.g. the workers of a pool compiling the same translation unit or
+    staging the same file). The lock is released if the process dies.
+    """
+    import fcntl
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def process_alive(pid):
+    """Return True if a process with the given id runs on this machine."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
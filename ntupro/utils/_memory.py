@@ -0,0 +1,163 @@
+from copy import copy
+import os
+import sys
+
+from ._booking import Cutflow
+from ._booking import Histogram
+from ._booking import BootstrapHistogram
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def resident_memory():
+    """Resident set size of the current process in bytes, None where
+    /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def peak_resident_memory():
+    """Peak resident set size of the current process in bytes, since it
+    started; None where the resource module is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def action_cells(action, depth = 0):
+    """Number of values filled per thread by an action, flow bins included;
+    depth is the number of selection steps above it (used by cutflows).
+    """
+    if isinstance(action, BootstrapHistogram):
+        nbins = len(action.edges) - 1 if action.edges else action.nbins
+        return (nbins + 2) * (action.nreplicas + 2)
+    if isinstance(action, Histogram):
+        nbins = len(action.edges) - 1 if action.edges else action.nbins
+        return nbins + 2
+    if isinstance(action, Cutflow):
+        return 3 * (depth + 1)
+    # Count and other scalar results
+    return 1
+
+
+def action_defines(action):
+    """Columns defined for an action."""
+    columns = list(action.prerequisites.keys()) if action.prerequisites else list()
+    if getattr(action, 'expression', None):
+        columns.append(action.variable)
+    return columns
+
+
+def action_nodes(node, depth = 0):
+    """Action nodes below node, with the number of selection steps above them."""
+    if node.kind == 'action':
+        return [(node, depth)]
+    if node.kind in ['selection', 'membership']:
+        depth += 1
+    return [item for child in node.children for item in action_nodes(child, depth)]
+
+
+def prune_graph(node, keep):
+    """Copy of the graph with only the action nodes in keep (a set of ids);
+    nodes left without actions below them are dropped.
+    """
+    if node.kind == 'action':
+        return node if id(node) in keep else None
+    children = [prune_graph(child, keep) for child in node.children]
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    pruned = copy(node)
+    pruned.children = children
+    return pruned
+
+
+class MemoryBudget:
+    """
+    Estimate of the memory needed by the event loop of a graph and maximum
+    allowed per worker. RDataFrame (as the compiled event loop) keeps one
+    copy of every result per thread: each action takes its number of cells
+    times 8 bytes, times 2 for the sums of squared weights (12 bytes per cell
+    with float storage, sparse histograms are counted as dense), times the
+    number of threads, and each defined column a buffer per thread. Graphs whose
+    estimate exceeds the budget are split into several passes over the
+    dataset, each with a partition of the actions fitting the budget.
+
+    Args:
+        max_bytes (int): Maximum memory for the results of a graph per worker
+        define_bytes (int): Estimate of the memory per defined column and thread
+
+    Attributes:
+        max_bytes (int): Maximum memory for the results of a graph per worker
+        define_bytes (int): Estimate of the memory per defined column and thread
+    """
+    def __init__(self, max_bytes, define_bytes = 1024):
+        if max_bytes <= 0:
+            raise ValueError('max_bytes has to be larger zero')
+        self.max_bytes = max_bytes
+        self.define_bytes = define_bytes
+
+    def action_bytes(self, action, depth, nthreads):
+        # Histograms with float storage keep 4 bytes per bin content
+        cell_bytes = 12 if getattr(action, 'storage', None) == 'float' else 16
+        return action_cells(action, depth) * cell_bytes * nthreads
+
+    def estimate(self, graph, nthreads = 1):
+        """Estimated memory in bytes of the results and defines of a graph."""
+        return self.__estimate(action_nodes(graph), nthreads)
+
+    def __estimate(self, actions, nthreads):
+        defines = set([column for node, _ in actions for column in action_defines(node.unit_block)])
+        return sum([self.action_bytes(node.unit_block, depth, nthreads) for node, depth in actions]) + \
+                len(defines) * self.define_bytes * nthreads
+
+    def split(self, graph, nthreads = 1):
+        """Return a list with the graph, if it fits the budget, or with one
+        graph per pass, with the actions partitioned in order so that each fits it.
+        Actions which do not fit alone get their own pass.
+        """
+        actions = action_nodes(graph)
+        total = self.__estimate(actions, nthreads)
+        if total <= self.max_bytes:
+            return [graph]
+        partitions = list()
+        current = list()
+        used = 0
+        defines = set()
+        for item in actions:
+            node, depth = item
+            new_defines = set(action_defines(node.unit_block)) - defines
+            needed = self.action_bytes(node.unit_block, depth, nthreads) + \
+                    len(new_defines) * self.define_bytes * nthreads
+            if current and used + needed > self.max_bytes:
+                partitions.append(current)
+                current = list()
+                used = 0
+                defines = set()
+                new_defines = set(action_defines(node.unit_block))
+                needed = self.__estimate([item], nthreads)
+            if not current and needed > self.max_bytes:
+                logger.warning('Action {} alone needs {:.1f} MB with {} thread(s), more than the budget of {:.1f} MB'.format(
+                    node.name, needed / 1024 ** 2, nthreads, self.max_bytes / 1024 ** 2))
+            current.append(item)
+            used += needed
+            defines.update(new_defines)
+        partitions.append(current)
+        passes = [prune_graph(graph, set([id(node) for node, _ in partition])) \
+                for partition in partitions]
+        logger.info('Graph {} needs {:.1f} MB with {} thread(s), split into {} passes of {} actions'.format(
+            repr(graph), total / 1024 ** 2, nthreads, len(passes),
+            ', '.join([str(len(partition)) for partition in partitions])))
+        return passes
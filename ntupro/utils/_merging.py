@@ -0,0 +1,200 @@
+import re
+from copy import copy
+
+from ._root import load_root
+from ._booking import Dataset
+from ._codegen import cpp_string
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Per-sample check of the file being processed, so that the membership of
+# an entry to a dataset costs one comparison per file instead of per entry
+MEMBERSHIP_CODE = '''
+#ifndef NTUPRO_MEMBERSHIP
+#define NTUPRO_MEMBERSHIP
+#include <algorithm>
+namespace ntupro {
+inline bool sample_in(const ROOT::RDF::RSampleInfo &info, const std::vector<std::string> &samples)
+{
+   return std::find(samples.begin(), samples.end(), info.AsString()) != samples.end();
+}
+
+inline int sample_index(const ROOT::RDF::RSampleInfo &info,
+                        const std::vector<std::vector<std::string>> &groups)
+{
+   for (std::size_t i = 0; i < groups.size(); ++i)
+      if (sample_in(info, groups[i]))
+         return i;
+   return -1;
+}
+}
+#endif
+'''
+
+
+def declare_membership_helpers():
+    load_root().gInterpreter.Declare(MEMBERSHIP_CODE)
+
+
+def sample_id(ntuple):
+    """Identifier of the ntuple as returned by RSampleInfo::AsString."""
+    tree = ntuple.directory
+    return ntuple.path + ('' if tree.startswith('/') else '/') + tree
+
+
+def membership_column(dataset):
+    return 'ntupro_member_' + re.sub(r'\W', '_', dataset.name)
+
+
+def sample_group(dataset):
+    """C++ initializer list of the sample identifiers of the files of the dataset."""
+    return '{' + ', '.join([cpp_string(sample_id(ntuple)) for ntuple in dataset.ntuples]) + '}'
+
+
+def sample_groups(datasets):
+    return '{' + ', '.join([sample_group(dataset) for dataset in datasets]) + '}'
+
+
+def membership_expression(dataset):
+    """Per-sample expression telling whether the current file belongs to the dataset."""
+    return 'ntupro::sample_in(rdfsampleinfo_, ' + sample_group(dataset) + ')'
+
+
+# Column of packed graphs with the index of the dataset each file belongs to
+DATASET_ID_COLUMN = 'ntupro_dataset_id'
+
+
+def dataset_id_expression(datasets):
+    """Per-sample expression returning the index of the dataset the current
+    file belongs to, for datasets with disjoint ntuples.
+    """
+    return 'ntupro::sample_index(rdfsampleinfo_, ' + sample_groups(datasets) + ')'
+
+
+def count_entries(dataset, max_entries = None):
+    """Number of entries of the dataset, read from the headers of its files.
+    If max_entries is given, the counting stops as soon as it is exceeded,
+    and the (partial) count returned is larger than max_entries.
+    """
+    ROOT = load_root()
+    entries = 0
+    for ntuple in dataset.ntuples:
+        root_file = ROOT.TFile.Open(ntuple.path)
+        if not root_file or root_file.IsZombie():
+            raise FileNotFoundError('File {} does not exist, abort'.format(ntuple.path))
+        tree = root_file.Get(ntuple.directory)
+        if not tree:
+            root_file.Close()
+            raise NameError('Tree {} does not exist in {}\n'.format(ntuple.directory, ntuple.path))
+        entries += tree.GetEntries()
+        root_file.Close()
+        if max_entries is not None and entries > max_entries:
+            break
+    return entries
+
+
+def pack_datasets(datasets, entries, max_entries):
+    """Group the indices of the datasets into packs with at most max_entries
+    entries in total, first fit in order of decreasing size. Only datasets
+    with the same layout and no ntuple in common are packed together; datasets
+    which cannot be merged, or with more than max_entries entries, stay alone.
+    """
+    packs = list()
+    order = sorted(range(len(datasets)), key = lambda i: entries[i], reverse = True)
+    for i in order:
+        dataset = datasets[i]
+        if not mergeable(dataset) or entries[i] > max_entries:
+            packs.append([i])
+            continue
+        for pack in packs:
+            first = datasets[pack[0]]
+            if mergeable(first) and layout(first) == layout(dataset) and \
+                    sum([entries[j] for j in pack]) + entries[i] <= max_entries and \
+                    not set(dataset.ntuples).intersection(
+                        [ntuple for j in pack for ntuple in datasets[j].ntuples]):
+                pack.append(i)
+                break
+        else:
+            packs.append([i])
+    return sorted([sorted(pack) for pack in packs])
+
+
+def friend_tags(ntuple):
+    return tuple(sorted([str(friend.tag) for friend in ntuple.friends]))
+
+
+def mergeable(dataset):
+    """Datasets can share an event loop only if made of ROOT ntuples with the
+    same tree name and the same friends, as required by a single chain.
+    """
+    if not dataset.ntuples:
+        return False
+    if any([ntuple.directory is None for ntuple in dataset.ntuples]):
+        return False
+    layouts = set([(ntuple.directory, friend_tags(ntuple)) for ntuple in dataset.ntuples])
+    return len(layouts) == 1
+
+
+def layout(dataset):
+    ntuple = dataset.ntuples[0]
+    return (ntuple.directory, friend_tags(ntuple))
+
+
+def overlapping_groups(datasets):
+    """Group the indices of the datasets sharing (directly or through other
+    datasets) at least one ntuple. Datasets that cannot be merged are left
+    alone, and only datasets with the same layout end up in the same group.
+    """
+    parents = list(range(len(datasets)))
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+    owners = dict()
+    for i, dataset in enumerate(datasets):
+        if not mergeable(dataset):
+            continue
+        for ntuple in dataset.ntuples:
+            key = (ntuple, layout(dataset))
+            if key in owners:
+                parents[find(i)] = find(owners[key])
+            else:
+                owners[key] = i
+    groups = dict()
+    for i in range(len(datasets)):
+        groups.setdefault(find(i), list()).append(i)
+    return sorted(groups.values())
+
+
+def union_of_ntuples(datasets):
+    """Ntuples of the datasets, without repetitions, in order of appearance."""
+    ntuples = list()
+    for dataset in datasets:
+        for ntuple in dataset.ntuples:
+            if ntuple not in ntuples:
+                ntuples.append(ntuple)
+    return ntuples
+
+
+def replace_dataset(graph, dataset):
+    """Return a copy of the graph reading dataset, whose ntuples replace in
+    order the ones of the graph (e.g. staged copies of the files). The
+    datasets of the membership nodes are rewritten accordingly, so that
+    the files read are still matched to the datasets they belong to.
+    """
+    replacements = dict(zip(graph.unit_block.ntuples, dataset.ntuples))
+    graph = copy(graph)
+    graph.unit_block = dataset
+    children = list()
+    for child in graph.children:
+        if child.kind == 'membership':
+            child = copy(child)
+            child.unit_block = Dataset(child.unit_block.name,
+                [replacements.get(ntuple, ntuple) for ntuple in child.unit_block.ntuples])
+        children.append(child)
+    graph.children = children
+    return graph
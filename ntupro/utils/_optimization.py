@@ -26,3 +26,15 @@ class Node:
         return hash((
             self.name, self.kind, self.unit_block))
 
+
+
+def shared_prefix(node):
+    """Return the list of selection nodes shared by all the paths starting
+    from node, i.e. the chain of selection nodes which are the only child
+    of their parent.
+    """
+    prefix = list()
+    while len(node.children) == 1 and node.children[0].kind == 'selection':
+        node = node.children[0]
+        prefix.append(node)
+    return prefix
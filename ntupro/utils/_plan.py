@@ -0,0 +1,169 @@
+import pickle
+
+from ._booking import Ntuple
+from ._booking import ArrowNtuple
+from ._booking import Dataset
+from ._booking import Cut
+from ._booking import Weight
+from ._booking import Selection
+from ._booking import Action
+from ._booking import Count
+from ._booking import Cutflow
+from ._booking import Histogram
+from ._booking import BootstrapHistogram
+from ._optimization import Node
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Version of the plan format, increased at every incompatible change
+PLAN_VERSION = 1
+
+KINDS = ['dataset', 'selection', 'action', 'membership']
+
+# Classes whose objects can be unit blocks (or part of them) in a plan
+BLOCK_CLASSES = dict([(cls.__name__, cls) for cls in [
+    Ntuple, ArrowNtuple, Dataset, Cut, Weight, Selection,
+    Action, Count, Cutflow, Histogram, BootstrapHistogram]])
+
+
+class Plan:
+    """
+    Compact, versioned form of an optimized graph, sent to the workers
+    instead of the graph itself. The nodes are stored in depth-first order
+    as flat lists of kinds, names and parent indices; their unit blocks (and
+    the objects inside them, e.g. ntuples and cuts) are stored once each in
+    a table of blocks, and every string (names, expressions, paths) once in
+    a table of strings.
+
+    Args:
+        graph (Node): Root node of the graph
+
+    Attributes:
+        version (int): Version of the plan format
+        strings (list): Interned strings
+        kinds (list): Index in KINDS of the kind of each node
+        names (list): Index in strings of the name of each node
+        parents (list): Index of the parent of each node, -1 for the root
+        blocks (list): Index in block_table of the unit block of each node
+        block_table (list): Unit blocks in the form (class, attributes), with
+            the attributes as (name, value) pairs of encoded values
+        packed (Bool): If True, the graph is a packed MergedGraph
+    """
+    def __init__(self, graph):
+        self.version = PLAN_VERSION
+        self.strings = list()
+        self.kinds = list()
+        self.names = list()
+        self.parents = list()
+        self.blocks = list()
+        self.block_table = list()
+        self.packed = getattr(graph, 'packed', False)
+        self.__string_ids = dict()
+        self.__block_ids = dict()
+        stack = [(graph, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(self.kinds)
+            self.kinds.append(KINDS.index(node.kind))
+            self.names.append(self.__intern(node.name))
+            self.parents.append(parent)
+            self.blocks.append(self.__block(node.unit_block))
+            for child in reversed(node.children):
+                stack.append((child, index))
+        del self.__string_ids
+        del self.__block_ids
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __intern(self, string):
+        if string not in self.__string_ids:
+            self.__string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.__string_ids[string]
+
+    def __block(self, obj):
+        # Blocks are identified by identity, since equal objects (e.g.
+        # selections with different names) are not interchangeable
+        key = id(obj)
+        if key not in self.__block_ids:
+            name = type(obj).__name__
+            if BLOCK_CLASSES.get(name) is not type(obj):
+                raise TypeError('Objects of type {} cannot be part of a plan'.format(name))
+            self.__block_ids[key] = len(self.block_table)
+            self.block_table.append(None)
+            attributes = tuple([(self.__intern(attribute), self.__encode(value)) \
+                    for attribute, value in sorted(vars(obj).items())])
+            self.block_table[self.__block_ids[key]] = (self.__intern(name), attributes)
+        return self.__block_ids[key]
+
+    def __encode(self, value):
+        # Values are tagged pairs: (s)tring, (v)alue, (l)ist, (t)uple,
+        # (d)ictionary and (b)lock
+        if isinstance(value, str):
+            return ('s', self.__intern(value))
+        if value is None or isinstance(value, (bool, int, float)):
+            return ('v', value)
+        if isinstance(value, list):
+            return ('l', tuple([self.__encode(item) for item in value]))
+        if isinstance(value, tuple):
+            return ('t', tuple([self.__encode(item) for item in value]))
+        if isinstance(value, dict):
+            return ('d', tuple([(self.__encode(key), self.__encode(item)) \
+                    for key, item in value.items()]))
+        return ('b', self.__block(value))
+
+    def to_bytes(self):
+        return pickle.dumps(self, protocol = pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def from_bytes(content):
+        plan = pickle.loads(content)
+        if not isinstance(plan, Plan) or getattr(plan, 'version', None) != PLAN_VERSION:
+            raise ValueError('Plan of version {} cannot be read, expected version {}'.format(
+                getattr(plan, 'version', None), PLAN_VERSION))
+        return plan
+
+    def graph(self):
+        """Rebuild the graph, as a tree of Node objects."""
+        objects = [None] * len(self.block_table)
+        def block(index):
+            if objects[index] is None:
+                name, attributes = self.block_table[index]
+                obj = BLOCK_CLASSES[self.strings[name]].__new__(BLOCK_CLASSES[self.strings[name]])
+                objects[index] = obj
+                for attribute, value in attributes:
+                    setattr(obj, self.strings[attribute], decode(value))
+            return objects[index]
+        def decode(value):
+            tag, content = value
+            if tag == 's':
+                return self.strings[content]
+            if tag == 'v':
+                return content
+            if tag == 'l':
+                return [decode(item) for item in content]
+            if tag == 't':
+                return tuple([decode(item) for item in content])
+            if tag == 'd':
+                return dict([(decode(key), decode(item)) for key, item in content])
+            return block(content)
+        nodes = list()
+        for kind, name, parent, index in zip(self.kinds, self.names, self.parents, self.blocks):
+            node = Node(self.strings[name], KINDS[kind], block(index))
+            if parent >= 0:
+                nodes[parent].children.append(node)
+            nodes.append(node)
+        nodes[0].packed = self.packed
+        return nodes[0]
+
+
+def graph_plans(graphs):
+    """Serialized plans of the graphs, one per graph."""
+    plans = [Plan(graph).to_bytes() for graph in graphs]
+    logger.debug('%%%%%%%%%% Serialized {} plans, {} bytes in total'.format(
+        len(plans), sum([len(plan) for plan in plans])))
+    return plans
@@ -0,0 +1,245 @@
+import os
+import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Version of the format of the profile, increased at every incompatible change
+PROFILE_VERSION = 1
+
+
+def node_key(path):
+    """Key of a node in the profiles: names of the nodes from the root of
+    the graph down to it, separated by '/'.
+    """
+    return '/'.join(path)
+
+
+class GraphProfile:
+    """
+    Profile of the processing of one task (a graph or part of it) by a
+    worker: wall time split into setup (booking, type resolution and
+    compilation), event loop and harvest, events processed, resident memory
+    and entries reaching and passing the filter of each selection and
+    membership node. With the 'rdataframe' backend the expressions are
+    jitted at the start of the event loop and counted in its time.
+
+    Args:
+        graph (Graph): Task profiled
+        task_id (int): Index of the task in the run
+
+    Attributes:
+        graph (str): Name of the task
+        dataset (str): Name of the dataset
+        ntuples (int): Number of ntuples of the dataset
+        task_id (int): Index of the task in the run
+        pid (int): Process which ran the task
+        setup (float): Seconds spent before the event loop
+        loop (float): Seconds spent in the event loop
+        harvest (float): Seconds spent collecting the results
+        events (int): Number of events processed
+        bytes_read (int): Bytes read from the files, if measured
+        rss_before (int): Resident memory in bytes before the task
+        rss_after (int): Resident memory in bytes after the task
+        rss_peak (int): Peak resident memory of the process in bytes
+        filters (dict): Entries reaching and passing the filter of each
+            node, as [all, pass] by node_key
+    """
+    def __init__(self, graph = None, task_id = None):
+        self.graph = repr(graph) if graph is not None else None
+        self.dataset = graph.unit_block.name if graph is not None else None
+        self.ntuples = len(graph.unit_block.ntuples) if graph is not None else 0
+        self.task_id = task_id
+        self.pid = os.getpid()
+        self.setup = 0.
+        self.loop = 0.
+        self.harvest = 0.
+        self.events = 0
+        self.bytes_read = None
+        self.rss_before = None
+        self.rss_after = None
+        self.rss_peak = None
+        self.filters = dict()
+
+    def add_filter(self, path, entries, passed):
+        key = node_key(path)
+        counts = self.filters.setdefault(key, [0, 0])
+        counts[0] += int(entries)
+        counts[1] += int(passed)
+
+    def wall_time(self):
+        return self.setup + self.loop + self.harvest
+
+    def events_per_second(self):
+        return self.events / self.loop if self.loop > 0 else None
+
+    def to_dict(self):
+        profile = dict(self.__dict__)
+        profile['wall_time'] = self.wall_time()
+        profile['events_per_second'] = self.events_per_second()
+        return profile
+
+    @staticmethod
+    def from_dict(content):
+        profile = GraphProfile()
+        for name, value in content.items():
+            if name in profile.__dict__:
+                setattr(profile, name, value)
+        return profile
+
+
+class RunProfile:
+    """
+    Structured profile of a run, with the GraphProfile of every task, which
+    can be written to and read from JSON. Profiles are attached to the
+    optimized graphs (see annotate) and the cost of a graph measured in a
+    run can be used to schedule the tasks of later runs.
+
+    Args:
+        backend (str): Backend of the run
+        nworkers (int): Number of workers
+        nthreads (int): Number of threads per worker
+
+    Attributes:
+        backend (str): Backend of the run
+        nworkers (int): Number of workers
+        nthreads (int): Number of threads per worker
+        wall_time (float): Seconds elapsed for the whole run
+        tasks (list): GraphProfile of every task
+    """
+    def __init__(self, backend = None, nworkers = 1, nthreads = 1):
+        self.backend = backend
+        self.nworkers = nworkers
+        self.nthreads = nthreads
+        self.wall_time = 0.
+        self.tasks = list()
+
+    def add(self, profile):
+        if isinstance(profile, dict):
+            profile = GraphProfile.from_dict(profile)
+        self.tasks.append(profile)
+
+    def events(self):
+        return sum([task.events for task in self.tasks])
+
+    def costs(self):
+        """Seconds spent on each graph, by name, summed over its tasks."""
+        costs = dict()
+        for task in self.tasks:
+            costs[task.graph] = costs.get(task.graph, 0.) + task.wall_time()
+        return costs
+
+    def merged(self, tasks):
+        """Dictionary with the sums over the tasks given of times, events
+        and filter counts, and the peak of the resident memory.
+        """
+        merged = GraphProfile()
+        for task in tasks:
+            merged.setup += task.setup
+            merged.loop += task.loop
+            merged.harvest += task.harvest
+            merged.events += task.events
+            peaks = [rss for rss in [merged.rss_peak, task.rss_peak] if rss is not None]
+            merged.rss_peak = max(peaks) if peaks else None
+            for key, (entries, passed) in task.filters.items():
+                merged.add_filter([key], entries, passed)
+        content = merged.to_dict()
+        for name in ['graph', 'dataset', 'ntuples', 'task_id', 'pid', 'rss_before', 'rss_after']:
+            del content[name]
+        content['tasks'] = len(tasks)
+        return content
+
+    def annotate(self, graphs, origins = None):
+        """Attach the profiles to the graphs: each graph gets the merged
+        profile of its tasks as attribute profile, and each selection and
+        membership node a dictionary with entries, passed and efficiency.
+
+        Args:
+            graphs (list): Graphs of the run
+            origins (list): Index of the graph of each task, if the graphs
+                were split into several tasks; by default tasks and
+                graphs correspond one to one
+        """
+        if origins is None:
+            origins = list(range(len(self.tasks)))
+        by_task = dict([(task.task_id, task) for task in self.tasks])
+        for i, graph in enumerate(graphs):
+            tasks = [by_task[task_id] for task_id, origin in enumerate(origins) \
+                    if origin == i and task_id in by_task]
+            if not tasks:
+                continue
+            graph.profile = self.merged(tasks)
+            self.__annotate_node(graph, [], graph.profile['filters'])
+
+    def __annotate_node(self, node, path, filters):
+        path = path + [node.name]
+        key = node_key(path)
+        if node.kind in ['selection', 'membership'] and key in filters:
+            entries, passed = filters[key]
+            node.profile = {'all': entries, 'pass': passed,
+                    'efficiency': passed / entries if entries else None}
+        for child in node.children:
+            self.__annotate_node(child, path, filters)
+
+    def to_dict(self):
+        return {
+            'version': PROFILE_VERSION,
+            'backend': self.backend,
+            'nworkers': self.nworkers,
+            'nthreads': self.nthreads,
+            'wall_time': self.wall_time,
+            'events': self.events(),
+            'tasks': [task.to_dict() for task in self.tasks]}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent = 1)
+        logger.info('Wrote profile of {} tasks to {}'.format(len(self.tasks), path))
+        return path
+
+    @staticmethod
+    def read(path):
+        with open(path) as f:
+            content = json.load(f)
+        if content.get('version') != PROFILE_VERSION:
+            raise ValueError('Profile {} of version {} cannot be read, expected version {}'.format(
+                path, content.get('version'), PROFILE_VERSION))
+        profile = RunProfile(content['backend'], content['nworkers'], content['nthreads'])
+        profile.wall_time = content['wall_time']
+        for task in content['tasks']:
+            profile.add(task)
+        return profile
+
+
+def format_profile(graph):
+    """Tree of the nodes of an annotated graph with the entries passing
+    each filter and its efficiency, to spot the hot branches at a glance.
+    """
+    lines = list()
+    summary = getattr(graph, 'profile', None)
+    if summary is not None:
+        rate = summary['events_per_second']
+        lines.append('{}: {} events, {:.2f} s (setup {:.2f}, loop {:.2f}, harvest {:.2f}){}'.format(
+            repr(graph), summary['events'], summary['wall_time'], summary['setup'],
+            summary['loop'], summary['harvest'],
+            ', {:.0f} events/s'.format(rate) if rate else ''))
+    else:
+        lines.append(repr(graph))
+    _format_node(graph, 1, lines)
+    return '\n'.join(lines)
+
+
+def _format_node(node, depth, lines):
+    for child in node.children:
+        if child.kind == 'action':
+            continue
+        line = '{}{}'.format('  ' * depth, repr(child))
+        profile = getattr(child, 'profile', None)
+        if profile is not None:
+            line += ': {} of {}'.format(profile['pass'], profile['all'])
+            if profile['efficiency'] is not None:
+                line += ' ({:.1%})'.format(profile['efficiency'])
+        lines.append(line)
+        _format_node(child, depth + 1, lines)
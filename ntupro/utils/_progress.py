@@ -0,0 +1,276 @@
+from multiprocessing import RawArray
+from fnmatch import fnmatch
+from time import time
+import ctypes
+import os
+import re
+
+from ._root import load_root
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Fields of each task on the progress board
+PROCESSED, TOTAL, STATE, PID = range(4)
+NFIELDS = 4
+
+# States of a task
+PENDING, RUNNING, DONE = range(3)
+
+
+PROGRESS_CODE = '''
+#ifndef NTUPRO_PROGRESS
+#define NTUPRO_PROGRESS
+#include <cstdint>
+#include <cstdio>
+#include <memory>
+#include <mutex>
+#include <string>
+#include "ROOT/RDataFrame.hxx"
+#include "TDirectory.h"
+#include "TFile.h"
+
+namespace ntupro {
+
+// Add every entries to the counter at address (an element of the
+// progress board shared with the parent) each time a thread has
+// processed that many entries
+void book_progress(ROOT::RDF::RResultPtr<ULong64_t> &count, std::uintptr_t address, ULong64_t every)
+{
+    auto counter = reinterpret_cast<ULong64_t *>(address);
+    count.OnPartialResultSlot(every, [counter, every](unsigned int, ULong64_t &) {
+        __atomic_fetch_add(counter, every, __ATOMIC_RELAXED);
+    });
+}
+
+std::mutex snapshot_mutex;
+
+// Write the partial result to path every entries, through a temporary
+// file renamed at the end so that readers never see incomplete files
+template <typename T>
+void book_snapshot(ROOT::RDF::RResultPtr<T> &result, std::string path, ULong64_t every)
+{
+    result.OnPartialResult(every, [path](T &histo) {
+        std::lock_guard<std::mutex> lock(snapshot_mutex);
+        TDirectory::TContext context;
+        const auto part = path + ".part";
+        {
+            std::unique_ptr<TFile> file(TFile::Open(part.c_str(), "RECREATE"));
+            file->WriteTObject(&histo, histo.GetName());
+        }
+        std::rename(part.c_str(), path.c_str());
+    });
+}
+
+}
+
+#endif
+'''
+
+
+def declare_progress_helpers():
+    ROOT = load_root()
+    if not hasattr(ROOT, 'ntupro') or not hasattr(ROOT.ntupro, 'book_progress'):
+        ROOT.gInterpreter.Declare(PROGRESS_CODE)
+
+
+class ProgressBoard:
+    """
+    Entries processed and to be processed by every task of a run, with its
+    state and the process running it, in memory shared by the parent and
+    the workers of the pool. The workers only add to the counter of their
+    task (from the callbacks of the event loop), the parent only reads.
+
+    Args:
+        ntasks (int): Number of tasks of the run
+
+    Attributes:
+        ntasks (int): Number of tasks of the run
+        array (RawArray): Fields of all the tasks
+    """
+    def __init__(self, ntasks):
+        self.ntasks = ntasks
+        self.array = RawArray(ctypes.c_ulonglong, max(ntasks, 1) * NFIELDS)
+
+    def address(self, task_id):
+        """Address of the counter of the entries processed by a task."""
+        return ctypes.addressof(self.array) + \
+                (task_id * NFIELDS + PROCESSED) * ctypes.sizeof(ctypes.c_ulonglong)
+
+    def start(self, task_id):
+        offset = task_id * NFIELDS
+        self.array[offset + PROCESSED] = 0
+        self.array[offset + TOTAL] = 0
+        self.array[offset + PID] = os.getpid()
+        self.array[offset + STATE] = RUNNING
+
+    def add_total(self, task_id, entries):
+        self.array[task_id * NFIELDS + TOTAL] += int(entries)
+
+    def add(self, task_id, entries):
+        self.array[task_id * NFIELDS + PROCESSED] += int(entries)
+
+    def finish(self, task_id, entries = None):
+        # The callbacks are called every given number of entries, the
+        # exact number is known only at the end
+        offset = task_id * NFIELDS
+        if entries is not None:
+            self.array[offset + PROCESSED] = int(entries)
+            self.array[offset + TOTAL] = int(entries)
+        self.array[offset + STATE] = DONE
+
+    def task(self, task_id):
+        offset = task_id * NFIELDS
+        return tuple(self.array[offset:offset + NFIELDS])
+
+
+class ProgressReport:
+    """
+    Progress of a run at a given time.
+
+    Attributes:
+        elapsed (float): Seconds since the start of the run
+        processed (int): Entries processed by all the tasks
+        total (float): Entries to be processed, estimated for the tasks not
+            started yet from the mean of the started ones
+        done (int): Number of finished tasks
+        running (int): Number of running tasks
+        ntasks (int): Number of tasks
+        workers (dict): Entries processed by the running tasks, by process
+        rate (float): Entries processed per second
+        eta (float): Estimated seconds left, None if not known yet
+    """
+    def __init__(self, board, elapsed):
+        self.elapsed = elapsed
+        self.ntasks = board.ntasks
+        tasks = [board.task(i) for i in range(board.ntasks)]
+        started = [task for task in tasks if task[STATE] != PENDING]
+        self.processed = sum([task[PROCESSED] for task in tasks])
+        self.done = len([task for task in tasks if task[STATE] == DONE])
+        self.running = len(started) - self.done
+        self.workers = dict()
+        for task in started:
+            if task[STATE] == RUNNING:
+                self.workers[task[PID]] = self.workers.get(task[PID], 0) + task[PROCESSED]
+        known = [task[TOTAL] for task in started if task[TOTAL]]
+        self.total = sum(known)
+        if known:
+            self.total += (self.ntasks - len(started)) * float(self.total) / len(known)
+        self.rate = self.processed / elapsed if elapsed > 0 else 0.
+        self.eta = None
+        if self.rate > 0 and self.total:
+            self.eta = max(self.total - self.processed, 0) / self.rate
+
+    def fraction(self):
+        return min(self.processed / self.total, 1.) if self.total else 0.
+
+    def __str__(self):
+        layout = '{} of {} tasks done, {} running: {} of ~{:.0f} entries ({:.1%}), {:.0f} entries/s'.format(
+            self.done, self.ntasks, self.running, self.processed,
+            self.total, self.fraction(), self.rate)
+        if self.eta is not None:
+            layout += ', ETA {:.0f} s'.format(self.eta)
+        return layout
+
+
+class Progress:
+    """
+    Settings of the progress reports of run_locally. The event loops add
+    the entries processed to a board shared with the parent every given
+    number of entries (per thread, through OnPartialResultSlot with the
+    'rdataframe' backend, per chunk with the 'columnar' one), so that the
+    overhead is bounded; the parent logs the entries processed, the
+    throughput and the estimated time left at regular intervals.
+
+    Args:
+        interval (float): Seconds between two reports
+        every (int): Entries between two updates of the board per thread
+        callback (function): If given, called with every ProgressReport;
+            if it returns False the run is aborted
+
+    Attributes:
+        interval (float): Seconds between two reports
+        every (int): Entries between two updates of the board per thread
+        callback (function): Function called with every ProgressReport
+    """
+    def __init__(self, interval = 60., every = 100000, callback = None):
+        if interval <= 0:
+            raise ValueError('interval has to be larger zero')
+        if every < 1:
+            raise ValueError('every has to be larger zero')
+        self.interval = interval
+        self.every = every
+        self.callback = callback
+
+    def report(self, board, start):
+        """Log the progress of the run and return False if it has to be aborted."""
+        report = ProgressReport(board, time() - start)
+        logger.info('Progress: {}'.format(report))
+        for pid, entries in sorted(report.workers.items()):
+            logger.debug('%%%%%%%%%% Worker {}: {} entries of the running task'.format(
+                pid, entries))
+        if self.callback is not None:
+            return self.callback(report) is not False
+        return True
+
+
+def snapshot_file_name(name):
+    return re.sub(r'[^\w.-]', '_', name) + '.root'
+
+
+class PartialSnapshots:
+    """
+    Partial results of selected histograms, written while the event loops
+    are running so that the shapes can be checked early: every given number
+    of entries each task writes the histograms whose names match one of the
+    patterns to a file per task and histogram, replaced at every update.
+    With several threads, the partial result written is the one of the
+    thread which reached the given number of entries.
+
+    Args:
+        directory (str): Directory where the snapshots are written
+        patterns (list): Patterns (as in fnmatch) of the names of the results
+        every (int): Entries between two snapshots
+
+    Attributes:
+        directory (str): Directory where the snapshots are written
+        patterns (list): Patterns of the names of the results
+        every (int): Entries between two snapshots
+    """
+    def __init__(self, directory, patterns, every = 1000000):
+        if every < 1:
+            raise ValueError('every has to be larger zero')
+        self.directory = os.path.abspath(directory)
+        self.patterns = list(patterns)
+        self.every = every
+
+    def selects(self, name):
+        return any([fnmatch(name, pattern) for pattern in self.patterns])
+
+    def path(self, task_id, name):
+        """File of the snapshot of a result for a task."""
+        directory = os.path.join(self.directory, 'task_{}'.format(task_id))
+        os.makedirs(directory, exist_ok = True)
+        return os.path.join(directory, snapshot_file_name(name))
+
+    def files(self, name):
+        """Files of the snapshots of a result written so far, one per task."""
+        paths = list()
+        if not os.path.isdir(self.directory):
+            return paths
+        for task in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, task, snapshot_file_name(name))
+            if os.path.exists(path):
+                paths.append(path)
+        return paths
+
+    def write(self, task_id, result):
+        """Write a partial result of the columnar backend with uproot."""
+        from ._columnar import import_uproot
+        uproot = import_uproot()
+        path = self.path(task_id, result.GetName())
+        with uproot.recreate(path + '.part') as f:
+            f[result.GetName()] = result.to_uproot()
+        os.replace(path + '.part', path)
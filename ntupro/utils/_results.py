@@ -0,0 +1,163 @@
+from ._columnar import import_numpy
+from ._columnar import HistogramArrays
+from ._columnar import root_array_view
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def parse_result_name(name):
+    """Split a name in the form dataset#selections#action#variation built by
+    Unit into its four parts; names in other forms are taken as actions.
+    """
+    parts = name.split('#')
+    if len(parts) == 4:
+        return tuple(parts)
+    return (None, None, name, None)
+
+
+class Results:
+    """
+    Results of a run, kept in memory and indexed by dataset, selection path
+    (names of the selections joined by '-'), action and variation, as parsed
+    once from the names of the results. Bin contents and squared weights are
+    available as numpy views, and the ROOT objects are created only when
+    asked for (e.g. for results returned through shared memory).
+
+    Args:
+        results (list): ROOT objects or HistogramArrays
+
+    Attributes:
+        objects (dict): Results by name, in the order in which they are given
+        index (dict): Names of the results by (dataset, selections, action,
+            variation)
+    """
+    def __init__(self, results):
+        self.objects = dict()
+        self.index = dict()
+        for result in results:
+            name = str(result.GetName())
+            self.objects[name] = result
+            self.index[parse_result_name(name)] = name
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __contains__(self, name):
+        return name in self.objects
+
+    def __getitem__(self, name):
+        return self.objects[name]
+
+    def get(self, dataset, selections, action, variation = 'Nominal'):
+        """Return the result of an action, None if not found."""
+        name = self.index.get((dataset, selections, action, variation))
+        if name is None:
+            return None
+        return self[name]
+
+    def select(self, dataset = None, selections = None, action = None, variation = None):
+        """Return the names of the results matching the parts given."""
+        query = (dataset, selections, action, variation)
+        return [name for key, name in self.index.items() \
+                if all([wanted is None or wanted == part for wanted, part in zip(query, key)])]
+
+    def __parts(self, i):
+        return sorted(set([key[i] for key in self.index if key[i] is not None]))
+
+    def datasets(self):
+        return self.__parts(0)
+
+    def selections(self):
+        return self.__parts(1)
+
+    def actions(self):
+        return self.__parts(2)
+
+    def variations(self):
+        return self.__parts(3)
+
+    def __view(self, name, sumw2, flow):
+        np = import_numpy()
+        obj = self[name]
+        if hasattr(obj, 'to_arrays'):
+            obj = obj.to_arrays()
+        if isinstance(obj, HistogramArrays):
+            kind = obj.kind
+            array = obj.sumw2 if sumw2 else obj.contents
+            shape = None if kind != 'TH2D' else (len(obj.y_edges) + 1, len(obj.x_edges) + 1)
+        else:
+            kind = obj.ClassName()
+            if kind.startswith('TParameter'):
+                return np.array([obj.GetVal()])
+            if kind not in ['TH1D', 'TH1F', 'TH2D']:
+                raise TypeError('Result {} of type {} has no bins'.format(name, kind))
+            if sumw2 and not obj.GetSumw2N():
+                obj.Sumw2()
+            if sumw2:
+                array = root_array_view(obj.GetSumw2().GetArray(), obj.GetNcells(), np)
+            else:
+                array = root_array_view(obj.GetArray(), obj.GetNcells(), np,
+                        np.float32 if kind == 'TH1F' else None)
+            shape = None if kind != 'TH2D' else \
+                    (obj.GetNbinsY() + 2, obj.GetNbinsX() + 2)
+        if kind == 'TParameter':
+            return array
+        if shape is not None:
+            array = array.reshape(shape)
+            return array if flow else array[1:-1, 1:-1]
+        return array if flow else array[1:-1]
+
+    def values(self, name, flow = False):
+        """Return a numpy view of the bin contents of a histogram, without
+        underflow and overflow unless flow is True; for 2D histograms, the
+        first index runs over the bins of the y axis.
+        """
+        return self.__view(name, False, flow)
+
+    def sumw2(self, name, flow = False):
+        """Return a numpy view of the sums of squared weights, as values."""
+        return self.__view(name, True, flow)
+
+    def root(self, name):
+        """Return the ROOT object of a result, created once if needed."""
+        obj = self[name]
+        if hasattr(obj, 'to_root'):
+            obj = obj.to_root()
+            self.objects[name] = obj
+        return obj
+
+    def write(self, output):
+        """Write all the results to a .root file."""
+        from ._root import load_root
+        root_file = load_root().TFile(output, 'RECREATE')
+        for name in self:
+            self[name].Write()
+        root_file.Close()
+
+    @staticmethod
+    def read(path):
+        """Return the Results stored in a .root file written by a run, or
+        in sharded output (given its directory or index), read lazily.
+        """
+        from ._shards import is_sharded_output
+        from ._shards import ShardedResults
+        if is_sharded_output(path):
+            return ShardedResults(path)
+        from ._root import load_root
+        ROOT = load_root()
+        root_file = ROOT.TFile.Open(path)
+        if not root_file or root_file.IsZombie():
+            raise FileNotFoundError('File {} does not exist, abort'.format(path))
+        results = list()
+        for key in root_file.GetListOfKeys():
+            obj = key.ReadObj()
+            if hasattr(obj, 'SetDirectory'):
+                obj.SetDirectory(0)
+            results.append(obj)
+        root_file.Close()
+        return Results(results)
@@ -0,0 +1,16 @@
+import logging
+logger = logging.getLogger(__name__)
+
+
+def load_root():
+    """Import ROOT, in batch mode, the first time it is actually needed
+    (i.e. when a file is opened or an event loop is run), so that booking
+    and optimization can run on machines where ROOT is not available and
+    'import ntupro' does not pay the cost of loading it.
+
+    Returns:
+        ROOT (module): The ROOT module
+    """
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    return ROOT
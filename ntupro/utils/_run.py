@@ -1,14 +1,29 @@
-from ROOT import TChain
+from math import sqrt
+
+import hashlib
+
+from ._root import load_root
+from ._codegen import cpp_double
+from ._columnar import SparseHistogram
 
 import logging
 logger = logging.getLogger(__name__)
 
 class RDataFrameCutWeight:
     def __init__(self,
-            frame, cuts = [], weights = []):
+            frame, cuts = [], weights = [], steps = [], types = None):
         self.frame = frame
         self.cuts = cuts
         self.weights = weights
+        self.steps = steps
+        # C++ types of the columns available in frame, resolved up front
+        # for the inputs and after each Define for the defined ones
+        self.types = types if types is not None else dict()
+
+    def column_type(self, column):
+        if column not in self.types:
+            self.types[column] = str(self.frame.GetColumnType(column))
+        return self.types[column]
 
     def __str__(self):
         return str((
@@ -27,7 +42,464 @@ class RDataFrameCutWeight:
         return hash((
             self.frame, self.cuts, self.weights))
 
-def rdf_from_dataset_helper(dataset):
+
+class SelectionStep:
+    """
+    Filtered frame of a node of the graph, together with the weights
+    accumulated up to it. Every step holds (lazily booked) the counters
+    needed by the Cutflow actions found below the node, so that cutflows
+    sharing part of their path also share the counters.
+
+    Args:
+        name (str): Name of the node (dataset or selection)
+        frame (RNode): RDataFrame node after the cuts of the step
+        weights (list): Weights accumulated up to the step
+
+    Attributes:
+        name (str): Name of the node (dataset or selection)
+        frame (RNode): RDataFrame node after the cuts of the step
+        weights (list): Weights accumulated up to the step
+        counters (tuple): Pointers to raw entries, sum of weights
+            and sum of squared weights, None until booked
+    """
+    def __init__(self, name, frame, weights):
+        self.name = name
+        self.frame = frame
+        self.weights = weights
+        self.counters = None
+
+    def book_counters(self):
+        if self.counters is None:
+            count = self.frame.Count()
+            if self.weights:
+                weight_expression = '*'.join(['(' + weight.expression + ')' for weight in self.weights])
+                frame = self.frame.Define('ntupro_cutflow_weight',
+                        'static_cast<double>({})'.format(weight_expression))
+                frame = frame.Define('ntupro_cutflow_weight2',
+                        'ntupro_cutflow_weight*ntupro_cutflow_weight')
+                self.counters = (
+                        count,
+                        frame.Sum['double']('ntupro_cutflow_weight'),
+                        frame.Sum['double']('ntupro_cutflow_weight2'))
+            else:
+                self.counters = (count, None, None)
+        return self.counters
+
+
+class CountPointer:
+    """Wrap the pointer to the sum booked for a Count action, so that
+    the value returned can be written to file like the histograms.
+    """
+    def __init__(self, name, ptr):
+        self.name = name
+        self.ptr = ptr
+
+    def GetValue(self):
+        ROOT = load_root()
+        return ROOT.TParameter['double'](self.name, self.ptr.GetValue())
+
+
+class CutflowPointer:
+    """Lazy result of a Cutflow action. GetValue returns a histogram with
+    one bin per step of the path: if weighted, bin contents are sums of
+    weights and bin errors the square root of the sums of squared weights,
+    otherwise bin contents are the raw numbers of entries.
+    """
+    def __init__(self, name, steps, weighted = True):
+        self.name = name
+        self.steps = steps
+        self.weighted = weighted
+
+    def GetValue(self):
+        ROOT = load_root()
+        nsteps = len(self.steps)
+        histo = ROOT.TH1D(self.name, self.name, nsteps, 0, nsteps)
+        values = [tuple(counter.GetValue() if counter is not None else None \
+                for counter in step.counters) for step in self.steps]
+        for i, (step, (content, error)) in enumerate(zip(self.steps,
+                cutflow_bins(values, self.weighted)), 1):
+            histo.GetXaxis().SetBinLabel(i, step.name)
+            histo.SetBinContent(i, content)
+            histo.SetBinError(i, error)
+        histo.SetEntries(values[0][0])
+        return histo
+
+
+def cutflow_bins(values, weighted = True):
+    """Content and error of the bin of every step of a cutflow, from the
+    values (raw entries, sum of weights, sum of squared weights) of its
+    counters; the sums are None for the steps without weights, which
+    are filled with the raw entries as the unweighted cutflows.
+    """
+    bins = list()
+    for count, sumw, sumw2 in values:
+        if weighted and sumw is not None:
+            bins.append((sumw, sqrt(sumw2)))
+        else:
+            bins.append((count, sqrt(count)))
+    return bins
+
+
+class BootstrapPointer:
+    """Lazy result of a BootstrapHistogram action. GetValue returns the TH2D
+    with all the replicas or, if split_replicas is set, a list with one
+    TH1D per replica named after the action with the suffix '_replica<i>'.
+    """
+    def __init__(self, ptr, split_replicas = False):
+        self.ptr = ptr
+        self.split_replicas = split_replicas
+
+    def GetValue(self):
+        histo2d = self.ptr.GetValue()
+        if not self.split_replicas:
+            return detach_result(histo2d)
+        return split_replicas(histo2d)
+
+
+class SparsePointer:
+    """Lazy result of a Histogram with 'sparse' storage, booked as an
+    Aggregate filling a map of the non-empty bins. GetValue returns the
+    SparseHistogram, converted to a TH1D only when written.
+    """
+    def __init__(self, name, x_edges, fixed, ptr):
+        self.name = name
+        self.x_edges = x_edges
+        self.fixed = fixed
+        self.ptr = ptr
+
+    def GetValue(self):
+        ROOT = load_root()
+        bins = self.ptr.GetValue()
+        histo = SparseHistogram(self.name, self.x_edges, self.fixed)
+        flat = list(ROOT.ntupro.sparse_flat(bins))
+        for i in range(0, len(flat), 3):
+            histo.bins[int(flat[i])] = (flat[i + 1], flat[i + 2])
+        histo.stats = [float(bins.stats[i]) for i in range(4)]
+        histo.entries = float(bins.entries)
+        return histo
+
+
+def filter_counts(report, name):
+    """Entries reaching and passing the last filter of a report booked with
+    Report on the frame of a node, None if it is not the filter named name.
+    """
+    infos = list(report.GetValue())
+    if not infos or str(infos[-1].GetName()) != name:
+        return None
+    return infos[-1].GetAll(), infos[-1].GetPass()
+
+
+def detach_result(histo):
+    """Copy of a histogram held by the result pointer of an action, which
+    is deleted together with the frames of the graph.
+    """
+    detached = histo.Clone()
+    detached.SetDirectory(0)
+    return detached
+
+
+def release_objects(objects):
+    """Drop the references to the objects in the order they were created,
+    so that each chain is deleted before the entry list attached to it.
+    """
+    for i in range(len(objects)):
+        objects[i] = None
+
+
+def split_replicas(histo2d):
+    """Split the TH2D of a BootstrapHistogram into one TH1D per replica."""
+    replicas = list()
+    name = histo2d.GetName()
+    for i in range(histo2d.GetNbinsY()):
+        replica_name = suffixed_action_name(name, '_replica{}'.format(i))
+        replica = histo2d.ProjectionX(replica_name, i + 1, i + 1, 'e')
+        replica.SetTitle(replica_name)
+        replica.SetDirectory(0)
+        replicas.append(replica)
+    return replicas
+
+
+# Poisson(1) weights generated from a counter-based generator (splitmix64)
+# seeded with the event number, so that the same event gets the same
+# weights in every histogram and every run
+BOOTSTRAP_CODE = '''
+#ifndef NTUPRO_BOOTSTRAP
+#define NTUPRO_BOOTSTRAP
+namespace ntupro {
+inline unsigned long long splitmix64(unsigned long long x)
+{
+   x += 0x9E3779B97F4A7C15ULL;
+   x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+   x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+   return x ^ (x >> 31);
+}
+
+inline int poisson_one(unsigned long long state)
+{
+   const double u = (splitmix64(state) >> 11) * (1.0 / 9007199254740992.0);
+   double p = 0.36787944117144233;
+   double cdf = p;
+   int k = 0;
+   while (u >= cdf && k < 32) {
+      ++k;
+      p /= k;
+      cdf += p;
+   }
+   return k;
+}
+
+template <typename E>
+ROOT::RVec<double> bootstrap_weights(E event, unsigned long long seed, unsigned int nreplicas, double weight)
+{
+   ROOT::RVec<double> weights(nreplicas);
+   const unsigned long long base = splitmix64(static_cast<unsigned long long>(event) ^ splitmix64(seed));
+   for (unsigned int i = 0; i < nreplicas; ++i)
+      weights[i] = weight * poisson_one(base + i);
+   return weights;
+}
+
+template <typename T>
+ROOT::RVec<double> replicate(T value, unsigned int nreplicas)
+{
+   return ROOT::RVec<double>(nreplicas, static_cast<double>(value));
+}
+
+inline ROOT::RVec<double> replica_index(unsigned int nreplicas)
+{
+   ROOT::RVec<double> index(nreplicas);
+   for (unsigned int i = 0; i < nreplicas; ++i)
+      index[i] = i + 0.5;
+   return index;
+}
+}
+#endif
+'''
+
+
+def declare_bootstrap_helpers():
+    load_root().gInterpreter.Declare(BOOTSTRAP_CODE)
+
+
+# Per-thread maps of the non-empty bins of the histograms with 'sparse'
+# storage, merged at the end of the event loop
+SPARSE_CODE = '''
+#ifndef NTUPRO_SPARSE
+#define NTUPRO_SPARSE
+#include <algorithm>
+#include <unordered_map>
+namespace ntupro {
+struct SparseEntry {
+   Long64_t bin;
+   bool inside;
+   double x;
+   double w;
+};
+
+struct SparseBins {
+   std::unordered_map<Long64_t, std::pair<double, double>> bins;
+   double stats[4] = {0., 0., 0., 0.};
+   double entries = 0.;
+};
+
+inline Long64_t fixed_bin(double x, int nbins, double low, double up)
+{
+   if (x < low)
+      return 0;
+   if (!(x < up))
+      return nbins + 1;
+   return 1 + static_cast<Long64_t>(nbins * (x - low) / (up - low));
+}
+
+inline Long64_t variable_bin(double x, const std::vector<double> &edges)
+{
+   return std::upper_bound(edges.begin(), edges.end(), x) - edges.begin();
+}
+
+inline SparseEntry sparse_entry(Long64_t bin, int nbins, double x, double w)
+{
+   return SparseEntry{bin, bin >= 1 && bin <= nbins, x, w};
+}
+
+inline void sparse_fill(SparseBins &acc, const SparseEntry &entry)
+{
+   auto &content = acc.bins[entry.bin];
+   content.first += entry.w;
+   content.second += entry.w * entry.w;
+   acc.entries += 1.;
+   if (entry.inside) {
+      acc.stats[0] += entry.w;
+      acc.stats[1] += entry.w * entry.w;
+      acc.stats[2] += entry.w * entry.x;
+      acc.stats[3] += entry.w * entry.x * entry.x;
+   }
+}
+
+inline ROOT::RDF::RResultPtr<SparseBins> book_sparse(ROOT::RDF::RNode frame, const std::string &column)
+{
+   return frame.Aggregate(
+      [](SparseBins &acc, const SparseEntry &entry) { sparse_fill(acc, entry); },
+      [](std::vector<SparseBins> &accs) {
+         for (std::size_t i = 1; i < accs.size(); ++i) {
+            for (auto &item : accs[i].bins) {
+               auto &content = accs[0].bins[item.first];
+               content.first += item.second.first;
+               content.second += item.second.second;
+            }
+            for (int j = 0; j < 4; ++j)
+               accs[0].stats[j] += accs[i].stats[j];
+            accs[0].entries += accs[i].entries;
+         }
+      },
+      column, SparseBins());
+}
+
+inline std::vector<double> sparse_flat(const SparseBins &acc)
+{
+   std::vector<double> flat;
+   flat.reserve(3 * acc.bins.size());
+   for (auto &item : acc.bins) {
+      flat.push_back(item.first);
+      flat.push_back(item.second.first);
+      flat.push_back(item.second.second);
+   }
+   return flat;
+}
+}
+#endif
+'''
+
+
+def declare_sparse_helpers():
+    load_root().gInterpreter.Declare(SPARSE_CODE)
+
+
+# Histograms with 'float' storage are booked from C++, so that the TH1F
+# model is moved into Fill and the type of the variable is the only
+# template argument
+FLOAT_CODE = '''
+#ifndef NTUPRO_FLOAT
+#define NTUPRO_FLOAT
+#include "TH1F.h"
+namespace ntupro {
+template <typename T>
+ROOT::RDF::RResultPtr<TH1F> book_float(ROOT::RDF::RNode frame, const TH1F &model,
+                                       const std::string &column)
+{
+   return frame.Fill<T>(TH1F(model), {column});
+}
+
+template <typename T>
+ROOT::RDF::RResultPtr<TH1F> book_float(ROOT::RDF::RNode frame, const TH1F &model,
+                                       const std::string &column, const std::string &weight)
+{
+   return frame.Fill<T, double>(TH1F(model), {column, weight});
+}
+}
+#endif
+'''
+
+
+def declare_float_helpers():
+    load_root().gInterpreter.Declare(FLOAT_CODE)
+
+
+def sparse_entry_expression(histogram, weight):
+    """Expression of the column filled into a histogram with 'sparse'
+    storage; the edges of variable binnings are declared once as a global.
+    """
+    variable = 'static_cast<double>({})'.format(histogram.variable)
+    if histogram.edges:
+        nbins = len(histogram.edges) - 1
+        values = ', '.join([cpp_double(edge) for edge in histogram.edges])
+        edges = 'edges_' + hashlib.sha1(values.encode()).hexdigest()[:16]
+        load_root().gInterpreter.Declare(
+            '#ifndef NTUPRO_{0}\n#define NTUPRO_{0}\nnamespace ntupro {{ const std::vector<double> {0}{{{1}}}; }}\n#endif'.format(
+                edges, values))
+        bin_expression = 'ntupro::variable_bin({}, ntupro::{})'.format(variable, edges)
+    else:
+        nbins = histogram.nbins
+        bin_expression = 'ntupro::fixed_bin({}, {}, {}, {})'.format(variable, nbins,
+            cpp_double(histogram.low), cpp_double(histogram.up))
+    return 'ntupro::sparse_entry({}, {}, {}, {})'.format(bin_expression, nbins,
+        variable, weight)
+
+
+def histogram_axis(histogram):
+    """Edges of the x axis (as a list) and fixed binning of a histogram."""
+    if histogram.edges:
+        return list(histogram.edges), None
+    nbins, low, up = histogram.nbins, float(histogram.low), float(histogram.up)
+    return [low + (up - low) * i / nbins for i in range(nbins + 1)], (nbins, low, up)
+
+
+def suffixed_action_name(name, suffix):
+    """Append suffix to the action part of dataset#selections#action#variation."""
+    parts = name.split('#')
+    if len(parts) == 4:
+        parts[2] = parts[2] + suffix
+        return '#'.join(parts)
+    return name + suffix
+
+
+def raw_cutflow_name(name):
+    """Name of the histogram with the raw entries of a cutflow, obtained
+    by appending '_raw' to the action part of dataset#selections#action#variation.
+    """
+    return suffixed_action_name(name, '_raw')
+
+
+def column_types_from_chain(chain, columns):
+    """Return the C++ types, in the form {'column': 'type'}, of the columns
+    (branches of the chain and of its friends) found among the names passed.
+    Names which are not columns of the chain are skipped.
+    """
+    return column_types_from_frame(load_root().RDataFrame(chain), columns)
+
+
+def column_types_from_frame(rdf, columns):
+    """Same as column_types_from_chain, for an existing RDataFrame."""
+    available = set([str(column) for column in rdf.GetColumnNames()])
+    return dict([(column, str(rdf.GetColumnType(column))) \
+            for column in sorted(columns) if column in available])
+
+
+def chain_branches(chain):
+    """Return a dictionary {'column': 'branch'} with the branches and leaves
+    of the first tree of the chain, and the branch each of them belongs to.
+    """
+    if chain.LoadTree(0) < 0:
+        return dict()
+    tree = chain.GetTree()
+    branches = dict()
+    for leaf in tree.GetListOfLeaves():
+        branches[leaf.GetName()] = leaf.GetBranch().GetName()
+    for branch in tree.GetListOfBranches():
+        branches[branch.GetName()] = branch.GetName()
+    return branches
+
+
+def prune_chain(chain, branches, columns):
+    """Enable only the branches of the chain holding the columns passed and
+    register them in the TTreeCache, so that no other basket is read.
+    Return the set of columns found in the chain.
+    """
+    found = set([column for column in columns if column in branches])
+    enabled = sorted(set([branches[column] for column in found]))
+    chain.SetBranchStatus('*', 0)
+    chain.SetCacheSize()
+    for branch in enabled:
+        chain.SetBranchStatus(branch, 1)
+        chain.AddBranchToCache(branch, True)
+    return found
+
+
+def rdf_from_dataset_helper(dataset, columns = None):
+    """Create the TChain of the dataset, with one friend TChain per tag of
+    the friends of its ntuples. If the columns used by the graph are given,
+    only the friend chains providing some of them are attached, and only
+    the branches holding them are enabled and added to the TTreeCache
+    (columns of the main chain shadow the ones of the friends, as in ROOT).
+    """
     t_names = [ntuple.directory for ntuple in \
         dataset.ntuples]
     if len(set(t_names)) == 1:
@@ -35,7 +507,8 @@ def rdf_from_dataset_helper(dataset):
     else:
         raise NameError(
             'Impossible to create RDataFrame with different tree names')
-    chain = TChain()
+    ROOT = load_root()
+    chain = ROOT.TChain()
     ftag_fchain = {}
     friend_tchains = []
     for ntuple in dataset.ntuples:
@@ -43,9 +516,19 @@ def rdf_from_dataset_helper(dataset):
             ntuple.path, ntuple.directory))
         for friend in ntuple.friends:
             if friend.tag not in ftag_fchain.keys():
-                ftag_fchain[friend.tag] = TChain()
+                ftag_fchain[friend.tag] = ROOT.TChain()
             ftag_fchain[friend.tag].Add('{}/{}'.format(
                 friend.path, friend.directory))
+    if columns is not None:
+        missing = set(columns) - prune_chain(chain, chain_branches(chain), columns)
+        for tag in list(ftag_fchain.keys()):
+            fchain = ftag_fchain[tag]
+            branches = chain_branches(fchain)
+            if not missing.intersection(branches):
+                logger.debug('%%%%%%%%%% Friend {} not used, not attached'.format(tag))
+                del ftag_fchain[tag]
+                continue
+            missing -= prune_chain(fchain, branches, missing)
     for ch in ftag_fchain.values():
         chain.AddFriend(ch)
         # Keep friend chains alive
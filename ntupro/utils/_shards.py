@@ -0,0 +1,191 @@
+import os
+import json
+
+from ._root import load_root
+from ._results import Results
+from ._results import parse_result_name
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+# Version of the format of the index, increased at every incompatible change
+INDEX_VERSION = 2
+
+# Compression algorithms, with the codes of ROOT::RCompressionSetting::EAlgorithm
+COMPRESSION_ALGORITHMS = {'zlib': 1, 'lzma': 2, 'lz4': 4, 'zstd': 5}
+
+
+def shard_key(name):
+    """Directory (dataset/variation) and key (selections#action) of a result
+    in a shard; results with names in other forms are stored at the top level.
+    """
+    dataset, selections, action, variation = parse_result_name(name)
+    if dataset is None:
+        return '', name
+    return '{}/{}'.format(dataset, variation), '{}#{}'.format(selections, action)
+
+
+def root_objects(result):
+    """ROOT objects to be written for a result."""
+    if not hasattr(result, 'to_root'):
+        return [result]
+    if getattr(result, 'split', False):
+        from ._run import split_replicas
+        return split_replicas(result.to_root())
+    return [result.to_root()]
+
+
+class ShardedOutput:
+    """
+    Output written as one .root file (shard) per task, by the worker which
+    ran it, in parallel, instead of a single file written by the parent.
+    Inside each shard the results are organised in directories per dataset
+    and variation. The parent then writes a small index (index.json) mapping
+    every result name to its shard and key, so that readers (Results.read,
+    Customizer) fetch single histograms without scanning all the keys.
+
+    Args:
+        directory (str): Directory where shards and index are written
+        compression (str): One of 'zlib', 'lzma', 'lz4' and 'zstd'
+        level (int): Compression level, from 0 (no compression) to 9
+
+    Attributes:
+        directory (str): Directory where shards and index are written
+        compression (str): Compression algorithm
+        level (int): Compression level
+    """
+    index_name = 'index.json'
+
+    def __init__(self, directory, compression = 'zstd', level = 5):
+        if compression not in COMPRESSION_ALGORITHMS:
+            raise ValueError('Unknown compression {}, allowed ones are: {}'.format(
+                compression, ', '.join(sorted(COMPRESSION_ALGORITHMS))))
+        if not isinstance(level, int) or not 0 <= level <= 9:
+            raise ValueError('level has to be an integer from 0 to 9')
+        self.directory = os.path.abspath(directory)
+        self.compression = compression
+        self.level = level
+
+    def compression_settings(self):
+        """Compression settings in the form used by TFile (100 * algorithm + level)."""
+        return 100 * COMPRESSION_ALGORITHMS[self.compression] + self.level
+
+    def shard_name(self, task_id):
+        return 'shard_{}.root'.format(task_id)
+
+    def write_shard(self, task_id, results):
+        """Write the results of a task to its shard and return the entries
+        of the index, in the form {'name': [shard, 'directory/key', 'class']}.
+        """
+        os.makedirs(self.directory, exist_ok = True)
+        ROOT = load_root()
+        shard = self.shard_name(task_id)
+        path = os.path.join(self.directory, shard)
+        root_file = ROOT.TFile(path + '.part', 'RECREATE', '', self.compression_settings())
+        entries = dict()
+        for result in results:
+            for obj in root_objects(result):
+                name = str(obj.GetName())
+                directory, key = shard_key(name)
+                target = root_file
+                if directory:
+                    # mkdir of a nested path returns its top directory
+                    if not root_file.GetDirectory(directory):
+                        root_file.mkdir(directory, '', True)
+                    target = root_file.GetDirectory(directory)
+                target.WriteTObject(obj, key)
+                entries[name] = [shard, directory + '/' + key if directory else key,
+                    str(obj.ClassName())]
+        root_file.Close()
+        os.replace(path + '.part', path)
+        logger.debug('%%%%%%%%%% Wrote {} results to shard {}'.format(len(entries), path))
+        return entries
+
+    def write_index(self, entries):
+        """Write the index of the results from the entries of all the shards."""
+        shards = sorted(set([entry[0] for entry in entries.values()]))
+        positions = dict([(shard, i) for i, shard in enumerate(shards)])
+        index = {
+            'version': INDEX_VERSION,
+            'shards': shards,
+            'results': dict([(name, [positions[shard], key, class_name]) \
+                    for name, (shard, key, class_name) in entries.items()])}
+        path = os.path.join(self.directory, self.index_name)
+        with open(path + '.part', 'w') as f:
+            json.dump(index, f)
+        os.replace(path + '.part', path)
+        logger.info('Wrote index of {} results in {} shards to {}'.format(
+            len(entries), len(shards), path))
+        return path
+
+
+def is_sharded_output(path):
+    return os.path.isdir(path) or path.endswith('.json')
+
+
+class ShardedResults(Results):
+    """
+    Results written as sharded output, read through the index: a result is
+    read from its shard the first time it is used.
+
+    Args:
+        path (str): Directory of the shards or path of the index
+        classes (list): If given, only the results of these ROOT classes
+            (e.g. ['TH1D', 'TH1F']) are kept
+
+    Attributes:
+        directory (str): Directory of the shards
+        shards (list): Names of the shard files
+        keys (dict): Shard and key of every result, by name
+        classes (dict): ROOT class of every result, by name
+        files (dict): Shards opened so far, by position in shards
+    """
+    def __init__(self, path, classes = None):
+        if os.path.isdir(path):
+            path = os.path.join(path, ShardedOutput.index_name)
+        with open(path) as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION:
+            raise ValueError('Index {} of version {} cannot be read, expected version {}'.format(
+                path, index.get('version'), INDEX_VERSION))
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.shards = index['shards']
+        self.keys = dict([(name, (shard, key)) for name, (shard, key, class_name) \
+                in index['results'].items() if classes is None or class_name in classes])
+        self.classes = dict([(name, class_name) for name, (_, _, class_name) \
+                in index['results'].items() if name in self.keys])
+        self.names = list(self.keys)
+        self.objects = dict()
+        self.index = dict([(parse_result_name(name), name) for name in self.names])
+        self.files = dict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.keys
+
+    def __getitem__(self, name):
+        if name not in self.objects:
+            shard, key = self.keys[name]
+            if shard not in self.files:
+                ROOT = load_root()
+                self.files[shard] = ROOT.TFile.Open(os.path.join(self.directory, self.shards[shard]))
+            obj = self.files[shard].Get(key)
+            if not obj:
+                raise KeyError('Result {} not found in shard {}'.format(
+                    name, self.shards[shard]))
+            if hasattr(obj, 'SetDirectory'):
+                obj.SetDirectory(0)
+            self.objects[name] = obj
+        return self.objects[name]
+
+    def close(self):
+        for root_file in self.files.values():
+            root_file.Close()
+        self.files = dict()
@@ -0,0 +1,195 @@
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+
+from ._columnar import import_numpy
+from ._columnar import HistogramArrays
+from ._columnar import root_array_view
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class SharedResults:
+    """
+    Results of a task sent back to the parent process. Bin contents and
+    squared weights of the histograms are written by the worker into a
+    shared memory block allocated for the task, so that only the
+    descriptors (name, binning, statistics and offset in the block) go
+    through the pipe; objects which are not histograms are pickled as usual.
+
+    Args:
+        block (str): Name of the shared memory block, None if empty
+        descriptors (list): One dictionary per histogram, with the
+            arguments of HistogramArrays, stats, entries, offset and size
+        objects (list): Other results
+
+    Attributes:
+        block (str): Name of the shared memory block, None if empty
+        descriptors (list): Descriptors of the histograms in the block
+        objects (list): Other results
+    """
+    def __init__(self, block, descriptors, objects):
+        self.block = block
+        self.descriptors = descriptors
+        self.objects = objects
+
+    def __len__(self):
+        return len(self.descriptors) + len(self.objects)
+
+
+def axis_edges(axis, np):
+    edges = axis.GetXbins()
+    if edges.GetSize():
+        return root_array_view(edges.GetArray(), edges.GetSize(), np).copy()
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins() + 1)
+
+
+def histogram_arrays_from_root(obj):
+    """Return the HistogramArrays equivalent to a TH1D, TH1F, TH2D or
+    TParameter<double>, None for other objects.
+    """
+    if not hasattr(obj, 'ClassName'):
+        return None
+    np = import_numpy()
+    class_name = obj.ClassName()
+    if class_name == 'TParameter<double>':
+        arrays = HistogramArrays(obj.GetName(), 'TParameter')
+        arrays.contents[0] = obj.GetVal()
+        return arrays
+    if class_name not in ['TH1D', 'TH1F', 'TH2D']:
+        return None
+    x_axis = obj.GetXaxis()
+    fixed = None
+    if class_name != 'TH2D' and not x_axis.GetXbins().GetSize():
+        fixed = (x_axis.GetNbins(), x_axis.GetXmin(), x_axis.GetXmax())
+    labels = None
+    if x_axis.GetLabels():
+        labels = [str(x_axis.GetBinLabel(i)) for i in range(1, x_axis.GetNbins() + 1)]
+    arrays = HistogramArrays(obj.GetName(), class_name, axis_edges(x_axis, np),
+        axis_edges(obj.GetYaxis(), np) if class_name == 'TH2D' else None,
+        fixed, labels)
+    size = obj.GetNcells()
+    arrays.contents[:] = root_array_view(obj.GetArray(), size, np,
+            np.float32 if class_name == 'TH1F' else None)
+    if obj.GetSumw2N():
+        arrays.sumw2[:] = root_array_view(obj.GetSumw2().GetArray(), size, np)
+    else:
+        arrays.sumw2[:] = arrays.contents
+    stats = np.zeros(13)
+    obj.GetStats(stats)
+    arrays.stats[:] = stats[:len(arrays.stats)]
+    arrays.entries = obj.GetEntries()
+    return arrays
+
+
+def block_name(parent, task_id):
+    """Name of the shared memory block of a task, known to the parent
+    process so that it can release the blocks of a failed run.
+    """
+    return 'ntupro_{}_{}'.format(parent, task_id)
+
+
+def create_block(name, size):
+    try:
+        return shared_memory.SharedMemory(name = name, create = True, size = size)
+    except FileExistsError:
+        # Left over by a run of a former process with the same pid
+        release_blocks([name])
+        return shared_memory.SharedMemory(name = name, create = True, size = size)
+
+
+def release_blocks(names):
+    """Unlink the shared memory blocks which still exist among names, e.g.
+    the ones of the tasks completed before a run failed or was aborted.
+    """
+    for name in names:
+        try:
+            block = shared_memory.SharedMemory(name = name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
+        logger.debug('%%%%%%%%%% Released shared memory block {}'.format(name))
+
+
+def export_results(results, name = None):
+    """Write the histograms among the results into a new shared memory
+    block, named name if given, and return the SharedResults describing
+    them. Called by the workers; the block is released by import_results
+    in the parent. The edges of axes with fixed binning are not sent.
+    """
+    np = import_numpy()
+    histograms = list()
+    objects = list()
+    for result in results:
+        arrays = result if isinstance(result, HistogramArrays) \
+                else histogram_arrays_from_root(result)
+        if arrays is None:
+            objects.append(result)
+        else:
+            histograms.append(arrays)
+    size = sum([2 * len(arrays.contents) for arrays in histograms])
+    if not size:
+        return SharedResults(None, list(), objects)
+    if name is None:
+        block = shared_memory.SharedMemory(create = True, size = size * 8)
+    else:
+        block = create_block(name, size * 8)
+    buffer = np.ndarray((size,), dtype = np.float64, buffer = block.buf)
+    descriptors = list()
+    offset = 0
+    for arrays in histograms:
+        length = len(arrays.contents)
+        buffer[offset:offset + length] = arrays.contents
+        buffer[offset + length:offset + 2 * length] = arrays.sumw2
+        descriptors.append({
+            'name': arrays.name, 'kind': arrays.kind,
+            'x_edges': arrays.x_edges if arrays.fixed is None else None,
+            'y_edges': arrays.y_edges,
+            'fixed': arrays.fixed, 'labels': arrays.labels, 'split': arrays.split,
+            'stats': arrays.stats, 'entries': arrays.entries,
+            'offset': offset, 'size': length})
+        offset += 2 * length
+    del buffer
+    name = block.name
+    block.close()
+    # The parent process owns the block from now on
+    resource_tracker.unregister(block._name, 'shared_memory')
+    logger.debug('%%%%%%%%%% Exported {} histograms ({} bytes) to shared memory block {}'.format(
+        len(descriptors), size * 8, name))
+    return SharedResults(name, descriptors, objects)
+
+
+def import_results(shared):
+    """Return the results of a task as a list of HistogramArrays (converted
+    to ROOT objects only when written) and other objects, releasing the
+    shared memory block.
+    """
+    if shared.block is None:
+        return list(shared.objects)
+    np = import_numpy()
+    block = shared_memory.SharedMemory(name = shared.block)
+    try:
+        buffer = np.ndarray((block.size // 8,), dtype = np.float64, buffer = block.buf)
+        results = list()
+        for descriptor in shared.descriptors:
+            x_edges = descriptor['x_edges']
+            if descriptor['fixed'] is not None:
+                nbins, low, up = descriptor['fixed']
+                x_edges = np.linspace(low, up, nbins + 1)
+            arrays = HistogramArrays(descriptor['name'], descriptor['kind'],
+                x_edges, descriptor['y_edges'], descriptor['fixed'],
+                descriptor['labels'], descriptor['split'])
+            offset = descriptor['offset']
+            length = descriptor['size']
+            arrays.contents[:] = buffer[offset:offset + length]
+            arrays.sumw2[:] = buffer[offset + length:offset + 2 * length]
+            arrays.stats[:] = descriptor['stats']
+            arrays.entries = descriptor['entries']
+            results.append(arrays)
+        del buffer
+    finally:
+        block.close()
+        block.unlink()
+    return results + list(shared.objects)
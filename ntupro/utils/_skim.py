@@ -0,0 +1,169 @@
+import os
+import glob
+import json
+import hashlib
+
+from ._booking import Ntuple
+from ._booking import Dataset
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def ntuple_fingerprint(ntuple):
+    """Path, tree, size and modification time of an ntuple and of its
+    friends. None if any of the files is not on the local filesystem (e.g.
+    root:// URLs): their changes cannot be detected, so nothing derived
+    from them (skims, entry lists, zone maps) is cached.
+    """
+    if not os.path.exists(ntuple.path):
+        return None
+    friends = [ntuple_fingerprint(friend) for friend in ntuple.friends]
+    if None in friends:
+        return None
+    stat = os.stat(ntuple.path)
+    return [ntuple.path, ntuple.directory, stat.st_size, int(stat.st_mtime), friends]
+
+
+def cacheable(dataset):
+    """Return True if results derived from the files of the dataset can be cached."""
+    return all([ntuple_fingerprint(ntuple) is not None for ntuple in dataset.ntuples])
+
+
+def prefix_cuts(selections):
+    """Cut expressions of a list of selections, in order."""
+    return [cut.expression for selection in selections for cut in selection.cuts]
+
+
+class SkimRequest:
+    """
+    Skim booked in the event loop of a graph.
+
+    Args:
+        node (Node): Last node of the shared prefix
+        dataset (Dataset): Dataset being skimmed
+        selections (list): Selections of the shared prefix
+        identifiers (set): Identifiers used by the graph
+        target (str): Temporary path of the skim
+
+    Attributes:
+        columns (list): Columns written to the skim
+        snapshot (RResultPtr): Lazy Snapshot booked
+    """
+    def __init__(self, node, dataset, selections, identifiers, target):
+        self.node = node
+        self.dataset = dataset
+        self.selections = selections
+        self.identifiers = identifiers
+        self.target = target
+        self.columns = None
+        self.snapshot = None
+
+
+class SkimCache:
+    """
+    Skims of the datasets with the events passing the cuts shared by all
+    the paths of a graph (its shared prefix), stored with only the columns
+    the graph needs. A skim is keyed by the files of the dataset, by the
+    prefix cuts and by the identifiers of the graph, and is written the
+    first time a graph with that prefix is run with the 'rdataframe'
+    backend, in the same event loop as the actions. Later runs read a skim
+    of the same files and cuts containing all the columns they need,
+    written for the same or more identifiers; the prefix cuts and weights are
+    still applied, so results do not change, except the first step of the
+    cutflows, which starts from the skimmed events.
+
+    Args:
+        directory (str): Directory where skims and their metadata are stored
+
+    Attributes:
+        directory (str): Directory where skims and their metadata are stored
+    """
+    tree_name = 'ntupro_skim'
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok = True)
+
+    def key(self, dataset, selections):
+        """Key of the files and prefix cuts, None if the files cannot be cached."""
+        fingerprints = [ntuple_fingerprint(ntuple) for ntuple in dataset.ntuples]
+        if None in fingerprints:
+            return None
+        content = json.dumps([fingerprints, prefix_cuts(selections)])
+        return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+    def __base(self, dataset, selections):
+        key = self.key(dataset, selections)
+        if key is None:
+            return None
+        return os.path.join(self.directory, '{}_{}'.format(dataset.name, key))
+
+    def __paths(self, base, identifiers):
+        # Graphs with the same prefix but different columns write
+        # different skims
+        digest = hashlib.sha1(json.dumps(sorted(identifiers)).encode()).hexdigest()[:8]
+        return '{}_{}.root'.format(base, digest), '{}_{}.json'.format(base, digest)
+
+    def lookup(self, dataset, selections, identifiers):
+        """Return the Dataset of the smallest skim of the files and prefix
+        cuts written for a graph using (at least) the same identifiers, thus
+        containing all the columns of the dataset needed, None if none exists.
+        """
+        base = self.__base(dataset, selections)
+        if base is None:
+            return None
+        candidates = list()
+        for metadata in glob.glob(glob.escape(base) + '_*.json'):
+            try:
+                with open(metadata) as f:
+                    available = set(json.load(f)['identifiers'])
+            except (IOError, ValueError, KeyError):
+                continue
+            skim = metadata[:-len('.json')] + '.root'
+            if set(identifiers).issubset(available) and os.path.exists(skim):
+                candidates.append((len(available), skim))
+        if not candidates:
+            logger.debug('%%%%%%%%%% No skim of dataset {} with columns {}'.format(
+                dataset.name, ', '.join(sorted(identifiers))))
+            return None
+        return Dataset(dataset.name, [Ntuple(min(candidates)[1], self.tree_name)])
+
+    def target(self, dataset, selections, identifiers):
+        """Temporary path where a new skim is written, None if the files
+        cannot be cached.
+        """
+        base = self.__base(dataset, selections)
+        if base is None:
+            return None
+        skim, _ = self.__paths(base, identifiers)
+        return '{}.{}.part'.format(skim, os.getpid())
+
+    def request(self, node, dataset, selections, identifiers):
+        """Request of a new skim, None if the files cannot be cached."""
+        target = self.target(dataset, selections, identifiers)
+        if target is None:
+            return None
+        return SkimRequest(node, dataset, selections, identifiers, target)
+
+    def commit(self, request):
+        """Move a skim written by the event loop in place and then publish
+        its metadata, both through atomic renames: a skim is found only
+        once both are in place, and the metadata always describe the skim
+        next to them, since the path of a skim depends on its identifiers.
+        """
+        dataset = request.dataset
+        selections = request.selections
+        skim, metadata = self.__paths(self.__base(dataset, selections), request.identifiers)
+        os.replace(request.target, skim)
+        partial = '{}.{}.part'.format(metadata, os.getpid())
+        with open(partial, 'w') as f:
+            json.dump({
+                'dataset': dataset.name,
+                'files': [ntuple.path for ntuple in dataset.ntuples],
+                'cuts': prefix_cuts(selections),
+                'identifiers': sorted(request.identifiers),
+                'columns': sorted(request.columns)}, f, indent = 1)
+        os.replace(partial, metadata)
+        logger.info('Skim of dataset {} written to {}'.format(dataset.name, skim))
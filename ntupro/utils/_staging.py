@@ -0,0 +1,435 @@
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+import zlib
+from copy import copy
+from time import time
+from multiprocessing import Process
+from multiprocessing import Event
+from concurrent.futures import ThreadPoolExecutor
+
+from ._booking import Dataset
+from ._locks import file_lock
+from ._locks import process_alive
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def adler32(path, block_size = 4 * 1024 * 1024):
+    """Adler-32 checksum of a file as 8 hexadecimal digits, the format
+    used by XRootD and EOS.
+    """
+    value = 1
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            value = zlib.adler32(block, value)
+    return '{:08x}'.format(value & 0xffffffff)
+
+
+class LocalSource:
+    """
+    Stage-in source for files reachable through the filesystem (e.g. slow
+    network filesystems or a local directory standing in for a remote store).
+
+    Args:
+        prefix (str): If given, only paths starting with it are handled
+    """
+    def __init__(self, prefix = None):
+        self.prefix = prefix
+
+    def handles(self, path):
+        if self.prefix is not None:
+            return path.startswith(self.prefix)
+        return '://' not in path
+
+    def size(self, path):
+        return os.path.getsize(path)
+
+    def checksum(self, path):
+        return adler32(path)
+
+    def fetch(self, path, destination):
+        shutil.copyfile(path, destination)
+
+
+class XRootDSource:
+    """
+    Stage-in source for files accessed through XRootD (root:// URLs), using
+    the xrdfs and xrdcp command line clients.
+
+    Args:
+        xrdcp (str): xrdcp executable
+        xrdfs (str): xrdfs executable
+    """
+    def __init__(self, xrdcp = 'xrdcp', xrdfs = 'xrdfs'):
+        self.xrdcp = xrdcp
+        self.xrdfs = xrdfs
+        self.running = set()
+        self.cancelled = False
+
+    def __getstate__(self):
+        # Copies running in this process are not passed to other ones
+        state = dict(self.__dict__)
+        state['running'] = set()
+        state['cancelled'] = False
+        return state
+
+    def handles(self, path):
+        return path.startswith('root://')
+
+    def __split(self, path):
+        # root://host//path/to/file -> (root://host, /path/to/file)
+        server, _, name = path[len('root://'):].partition('/')
+        return 'root://' + server, '/' + name.lstrip('/')
+
+    def size(self, path):
+        server, name = self.__split(path)
+        output = subprocess.check_output([self.xrdfs, server, 'stat', name],
+                universal_newlines = True)
+        for line in output.splitlines():
+            if line.strip().startswith('Size:'):
+                return int(line.split(':', 1)[1])
+        raise IOError('Cannot get the size of {}'.format(path))
+
+    def checksum(self, path):
+        server, name = self.__split(path)
+        try:
+            output = subprocess.check_output(
+                    [self.xrdfs, server, 'query', 'checksum', name],
+                    universal_newlines = True)
+        except subprocess.CalledProcessError:
+            return None
+        kind, _, value = output.strip().partition(' ')
+        if kind != 'adler32':
+            return None
+        return value.split()[0].zfill(8)
+
+    def fetch(self, path, destination):
+        command = [self.xrdcp, '--nopbar', '--force', path, destination]
+        process = subprocess.Popen(command)
+        self.running.add(process)
+        if self.cancelled:
+            process.kill()
+        try:
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, command)
+        finally:
+            self.running.discard(process)
+
+    def cancel(self):
+        """Kill the copies running in this process; they fail as if
+        the transfer had been interrupted.
+        """
+        self.cancelled = True
+        for process in list(self.running):
+            process.kill()
+
+
+class StagingCache:
+    """
+    Local copies of remote (or slow) ntuples, staged ahead of the event loop
+    and reused across runs. Each file is copied by the first source handling
+    it, then its size and Adler-32 checksum are verified against the ones of
+    the source. Staged files are tracked in an index (index.json) with their
+    last use, and the least recently used ones are evicted when the total
+    size would exceed the quota. Several processes of the same machine can
+    share the directory: the index and each file are protected by file
+    locks, the space of a file is reserved in the index (evicting other
+    files if needed) before it is fetched, and the files in use by a
+    process are pinned until released, so that they are never evicted
+    under it.
+
+    Args:
+        directory (str): Local scratch directory
+        quota (int): Maximum size in bytes of the staged files (no limit if None)
+        sources (list): Stage-in sources, tried in order; by default XRootD
+            for root:// URLs and the filesystem for everything else
+        verify_checksum (Bool): If True, the checksum of every staged file
+            is compared with the one of the source
+
+    Attributes:
+        directory (str): Local scratch directory
+        quota (int): Maximum size in bytes of the staged files
+        sources (list): Stage-in sources, tried in order
+        verify_checksum (Bool): If True, the checksums are verified
+        prefetcher (Process): Process staging files in background, if any
+        stop_event (Event): Event telling the prefetcher to stop
+    """
+    index_name = 'index.json'
+
+    def __init__(self, directory, quota = None, sources = None, verify_checksum = True):
+        self.directory = os.path.abspath(directory)
+        if quota is not None and quota <= 0:
+            raise ValueError('quota has to be larger zero')
+        self.quota = quota
+        self.sources = sources if sources is not None else [XRootDSource(), LocalSource()]
+        self.verify_checksum = verify_checksum
+        os.makedirs(os.path.join(self.directory, 'locks'), exist_ok = True)
+        self.prefetcher = None
+        self.stop_event = None
+
+    def __getstate__(self):
+        # Background staging stays in the process that started it
+        state = dict(self.__dict__)
+        state['prefetcher'] = None
+        state['stop_event'] = None
+        return state
+
+    def __source(self, path):
+        for source in self.sources:
+            if source.handles(path):
+                return source
+        raise ValueError('No staging source for {}'.format(path))
+
+    def __key(self, path):
+        return hashlib.sha1(path.encode()).hexdigest()[:16]
+
+    def __local_path(self, path):
+        return os.path.join(self.directory, '{}_{}'.format(
+            self.__key(path), os.path.basename(path)))
+
+    def __read_index(self):
+        try:
+            with open(os.path.join(self.directory, self.index_name)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def __write_index(self, index):
+        path = os.path.join(self.directory, self.index_name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f, indent = 1)
+        os.replace(path + '.tmp', path)
+
+    def __index_lock(self):
+        return file_lock(os.path.join(self.directory, 'locks', 'index.lock'))
+
+    def __file_lock(self, path):
+        return file_lock(os.path.join(self.directory, 'locks', self.__key(path) + '.lock'))
+
+    def __pin(self, entry):
+        pins = [pid for pid in entry.get('pins', []) if process_alive(pid)]
+        if os.getpid() not in pins:
+            pins.append(os.getpid())
+        entry['pins'] = pins
+
+    def __discard(self, entry):
+        """Remove the local copy of an entry and its partial copy, if any."""
+        for path in [entry['local'], entry['local'] + '.part']:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __in_use(self, entry):
+        """True if the file is being fetched or is pinned by a running process."""
+        if entry.get('pending') is not None and process_alive(entry['pending']):
+            return True
+        return any([process_alive(pid) for pid in entry.get('pins', [])])
+
+    def lookup(self, path, pin = False):
+        """Return the local copy of path if already staged and intact, None
+        otherwise; if pin is True, the copy is pinned for this process.
+        """
+        with self.__index_lock():
+            index = self.__read_index()
+            entry = index.get(path)
+            if entry is None:
+                return None
+            if entry.get('pending') is not None:
+                # Being fetched by another process, or left over by a
+                # process which died while fetching it
+                if not process_alive(entry['pending']):
+                    self.__discard(entry)
+                    del index[path]
+                    self.__write_index(index)
+                return None
+            if not os.path.exists(entry['local']) or \
+                    os.path.getsize(entry['local']) != entry['size']:
+                del index[path]
+                self.__write_index(index)
+                return None
+            entry['last_used'] = time()
+            if pin:
+                self.__pin(entry)
+            self.__write_index(index)
+            return entry['local']
+
+    def stage(self, path, pin = True):
+        """Return the path of the local copy of path, staging it if needed.
+        Unless pin is False, the copy is pinned for this process until
+        released (see release).
+        """
+        # Processes staging the same file wait for the first one to finish
+        with self.__file_lock(path):
+            local = self.lookup(path, pin)
+            if local is not None:
+                logger.debug('%%%%%%%%%% Reusing staged copy of {}'.format(path))
+                return local
+            return self.__stage(path, pin)
+
+    def release(self, paths):
+        """Unpin the local copies of the paths for this process."""
+        with self.__index_lock():
+            index = self.__read_index()
+            for path in paths:
+                entry = index.get(path)
+                if entry is not None and os.getpid() in entry.get('pins', []):
+                    entry['pins'].remove(os.getpid())
+            self.__write_index(index)
+
+    def __stage(self, path, pin):
+        source = self.__source(path)
+        size = source.size(path)
+        if self.quota is not None and size > self.quota:
+            raise IOError('File {} ({} bytes) larger than the staging quota'.format(
+                path, size))
+        local = self.__local_path(path)
+        self.__reserve(path, local, size)
+        partial = local + '.part'
+        start = time()
+        try:
+            source.fetch(path, partial)
+            if os.path.getsize(partial) != size:
+                raise IOError('Size mismatch for staged copy of {}'.format(path))
+            if self.verify_checksum:
+                expected = source.checksum(path)
+                if expected is not None and adler32(partial) != expected:
+                    raise IOError('Checksum mismatch for staged copy of {}'.format(path))
+            os.replace(partial, local)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            with self.__index_lock():
+                index = self.__read_index()
+                index.pop(path, None)
+                self.__write_index(index)
+            raise
+        logger.debug('%%%%%%%%%% Staged {} ({} bytes) in {:.2f} seconds'.format(
+            path, size, time() - start))
+        with self.__index_lock():
+            index = self.__read_index()
+            entry = {'local': local, 'size': size, 'last_used': time()}
+            if pin:
+                self.__pin(entry)
+            index[path] = entry
+            self.__write_index(index)
+        return local
+
+    def __reserve(self, path, local, size):
+        """Evict the least recently used files not in use until size bytes
+        fit in the quota, and reserve them for path, in one step under the
+        lock of the index so that concurrent stagings cannot exceed it.
+        """
+        with self.__index_lock():
+            index = self.__read_index()
+            if self.quota is not None:
+                used = sum([entry['size'] for entry in index.values()])
+                for other, entry in sorted(index.items(), key = lambda item: item[1]['last_used']):
+                    if used + size <= self.quota:
+                        break
+                    if self.__in_use(entry):
+                        continue
+                    logger.debug('%%%%%%%%%% Evicting staged copy of {}'.format(other))
+                    self.__discard(entry)
+                    used -= entry['size']
+                    del index[other]
+                if used + size > self.quota:
+                    self.__write_index(index)
+                    raise IOError('Cannot stage {} ({} bytes): the files in use fill the staging quota'.format(
+                        path, size))
+            index[path] = {'local': local, 'size': size, 'last_used': time(),
+                    'pending': os.getpid()}
+            self.__write_index(index)
+
+    def usage(self):
+        """Total size in bytes of the staged (and reserved) files."""
+        with self.__index_lock():
+            return sum([entry['size'] for entry in self.__read_index().values()])
+
+    def stage_ntuple(self, ntuple):
+        """Return a copy of the ntuple (and of its friends) pointing to the staged files."""
+        staged = copy(ntuple)
+        staged.path = self.stage(ntuple.path)
+        staged.friends = [self.stage_ntuple(friend) for friend in ntuple.friends]
+        return staged
+
+    def stage_dataset(self, dataset):
+        """Return a copy of the dataset pointing to the staged files, which
+        stay pinned for this process until released with release_dataset.
+        """
+        return Dataset(dataset.name, [self.stage_ntuple(ntuple) for ntuple in dataset.ntuples])
+
+    def release_dataset(self, dataset):
+        """Unpin the staged files of the (original) dataset."""
+        self.release(dataset_paths([dataset]))
+
+    def prefetch(self, datasets, nworkers = 2):
+        """Start staging the files of the datasets, in order, in a separate
+        process with nworkers threads, so that staging overlaps with the
+        processing of the files already staged. Files staged in background
+        are not pinned; processes needing a file being staged wait for it
+        on its lock.
+        """
+        self.stop_prefetch()
+        self.stop_event = Event()
+        self.prefetcher = Process(target = _prefetch,
+            args = (self, dataset_paths(datasets), nworkers, self.stop_event))
+        self.prefetcher.daemon = True
+        self.prefetcher.start()
+        return self.prefetcher
+
+    def stop_prefetch(self, timeout = 60.):
+        """Stop the background staging, if still running: no other file is
+        started and the running copies are interrupted (copies through the
+        filesystem are completed), so that partial files are removed and
+        their reservations released. The prefetcher is terminated only if
+        it does not stop within timeout seconds.
+        """
+        if self.prefetcher is not None:
+            self.stop_event.set()
+            self.prefetcher.join(timeout)
+            if self.prefetcher.is_alive():
+                logger.warning('Background staging did not stop in {} seconds, terminating it'.format(
+                    timeout))
+                self.prefetcher.terminate()
+                self.prefetcher.join()
+            self.prefetcher = None
+            self.stop_event = None
+
+
+def _prefetch(cache, paths, nworkers, stop_event):
+    def stage(path):
+        if stop_event.is_set():
+            return
+        try:
+            cache.stage(path, pin = False)
+        except Exception as error:
+            if not stop_event.is_set():
+                logger.warning('Background staging of {} failed: {}'.format(path, error))
+    with ThreadPoolExecutor(nworkers) as executor:
+        futures = [executor.submit(stage, path) for path in paths]
+        while not stop_event.wait(0.1):
+            if all([future.done() for future in futures]):
+                return
+        for source in cache.sources:
+            if hasattr(source, 'cancel'):
+                source.cancel()
+
+
+def dataset_paths(datasets):
+    """Paths of the files of the datasets (ntuples and friends), in order
+    and without repetitions.
+    """
+    paths = list()
+    for dataset in datasets:
+        for ntuple in dataset.ntuples:
+            for path in [ntuple.path] + [friend.path for friend in ntuple.friends]:
+                if path not in paths:
+                    paths.append(path)
+    return paths
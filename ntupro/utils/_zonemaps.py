@@ -0,0 +1,354 @@
+import os
+import re
+import json
+import struct
+import hashlib
+
+from ._root import load_root
+from ._booking import Cutflow
+from ._skim import ntuple_fingerprint
+from ._skim import cacheable
+from ._optimization import shared_prefix
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?[fFuUlL]*'
+COMPARISON_RE = re.compile(r'^([A-Za-z_]\w*)\s*(==|!=|<=|>=|<|>)\s*(' + NUMBER + r')$')
+REVERSED_COMPARISON_RE = re.compile(r'^(' + NUMBER + r')\s*(==|!=|<=|>=|<|>)\s*([A-Za-z_]\w*)$')
+FLIPPED = {'==': '==', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+# Minimum and maximum of the columns for every cluster of a tree; columns
+# which are not scalar leaves of the tree get NaN (no information)
+ZONE_MAP_CODE = '''
+#ifndef NTUPRO_ZONE_MAPS
+#define NTUPRO_ZONE_MAPS
+#include <cmath>
+#include <limits>
+#include "TTree.h"
+#include "TLeaf.h"
+#include "TBranch.h"
+#include "TEntryList.h"
+namespace ntupro {
+inline std::vector<double> zone_map(TTree *tree, const std::vector<std::string> &columns,
+                                    std::vector<Long64_t> &starts)
+{
+   const double nan = std::numeric_limits<double>::quiet_NaN();
+   tree->SetBranchStatus("*", 0);
+   std::vector<TLeaf *> leaves;
+   for (auto &column : columns) {
+      TLeaf *leaf = tree->GetLeaf(column.c_str());
+      if (leaf && (leaf->GetLen() != 1 || leaf->GetLeafCount()))
+         leaf = nullptr;
+      if (leaf)
+         tree->SetBranchStatus(leaf->GetBranch()->GetName(), 1);
+      leaves.push_back(leaf);
+   }
+   std::vector<double> result;
+   const Long64_t nentries = tree->GetEntries();
+   auto clusters = tree->GetClusterIterator(0);
+   Long64_t start;
+   while ((start = clusters()) < nentries) {
+      const Long64_t end = clusters.GetNextEntry();
+      starts.push_back(start);
+      std::vector<double> low(leaves.size(), std::numeric_limits<double>::infinity());
+      std::vector<double> up(leaves.size(), -std::numeric_limits<double>::infinity());
+      for (Long64_t entry = start; entry < end; ++entry) {
+         tree->GetEntry(entry);
+         for (std::size_t i = 0; i < leaves.size(); ++i) {
+            if (!leaves[i])
+               continue;
+            const double value = leaves[i]->GetValue(0);
+            low[i] = std::min(low[i], value);
+            up[i] = std::max(up[i], value);
+         }
+      }
+      for (std::size_t i = 0; i < leaves.size(); ++i) {
+         result.push_back(leaves[i] ? low[i] : nan);
+         result.push_back(leaves[i] ? up[i] : nan);
+      }
+   }
+   starts.push_back(nentries);
+   return result;
+}
+
+inline TEntryList *ranges_entry_list(const std::string &tree, const std::string &file,
+                                     const std::vector<Long64_t> &starts,
+                                     const std::vector<Long64_t> &ends)
+{
+   auto list = new TEntryList("entries", "", tree.c_str(), file.c_str());
+   list->SetDirectory(nullptr);
+   for (std::size_t i = 0; i < starts.size(); ++i)
+      for (Long64_t entry = starts[i]; entry < ends[i]; ++entry)
+         list->Enter(entry);
+   return list;
+}
+}
+#endif
+'''
+
+
+def strip_parentheses(expression):
+    """Remove the parentheses enclosing the whole expression."""
+    expression = expression.strip()
+    while expression.startswith('(') and expression.endswith(')'):
+        depth = 0
+        for i, char in enumerate(expression):
+            depth += {'(': 1, ')': -1}.get(char, 0)
+            if depth == 0 and i < len(expression) - 1:
+                return expression
+        expression = expression[1:-1].strip()
+    return expression
+
+
+def split_top_level(expression, operator):
+    """Split an expression at the occurrences of operator outside parentheses."""
+    terms = list()
+    depth = 0
+    last = 0
+    i = 0
+    while i < len(expression):
+        char = expression[i]
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif depth == 0 and expression.startswith(operator, i):
+            terms.append(expression[last:i])
+            last = i + len(operator)
+            i = last
+            continue
+        i += 1
+    terms.append(expression[last:])
+    return terms
+
+
+def literal_value(literal):
+    """Value of a numeric literal as C++ compares it, or None if the
+    comparison cannot be evaluated conservatively: unsigned literals convert
+    negative signed columns to large unsigned values.
+    """
+    if 'u' in literal.lower():
+        return None
+    value = float(literal.rstrip('fFlL'))
+    if literal[-1] in 'fF':
+        # Single-precision literals are rounded before the comparison
+        value = struct.unpack('f', struct.pack('f', value))[0]
+    return value
+
+
+def cut_constraints(expression):
+    """Return the comparisons between a column and a constant, in the form
+    (column, operator, value), that an entry must satisfy to pass the cut.
+    Terms which are not simple comparisons combined with && are ignored,
+    and expressions with a top-level || give no constraint, so that the
+    result is always conservative.
+    """
+    expression = strip_parentheses(expression)
+    if len(split_top_level(expression, '||')) > 1 or '?' in expression:
+        return list()
+    terms = split_top_level(expression, '&&')
+    if len(terms) > 1:
+        return [constraint for term in terms for constraint in cut_constraints(term)]
+    term = expression.strip()
+    match = COMPARISON_RE.match(term)
+    if match:
+        column, operator, literal = match.groups()
+    else:
+        match = REVERSED_COMPARISON_RE.match(term)
+        if not match:
+            return list()
+        literal, operator, column = match.groups()
+        operator = FLIPPED[operator]
+    value = literal_value(literal)
+    if value is None:
+        return list()
+    return [(column, operator, value)]
+
+
+def path_constraints(graph):
+    """Return one list of constraints for every action of the graph, from
+    the cuts of the selections on the path leading to it.
+    """
+    paths = list()
+    def walk(node, constraints):
+        if node.kind == 'selection':
+            constraints = constraints + [constraint for cut in node.unit_block.cuts \
+                    for constraint in cut_constraints(cut.expression)]
+        if node.kind == 'action':
+            paths.append(constraints)
+        for child in node.children:
+            walk(child, constraints)
+    walk(graph, list())
+    return paths
+
+
+def prefix_constraints(graph):
+    """Return the constraints from the cuts of the shared prefix of the
+    graph, which all the entries reaching any of its actions satisfy.
+    """
+    return [constraint for node in shared_prefix(graph) \
+            for cut in node.unit_block.cuts for constraint in cut_constraints(cut.expression)]
+
+
+def satisfiable(constraint, low, up):
+    """Return False only if no value in [low, up] satisfies the constraint."""
+    _, operator, value = constraint
+    if low != low or up != up:
+        return True
+    if operator == '==':
+        return low <= value <= up
+    if operator == '!=':
+        return not (low == up == value)
+    if operator == '<':
+        return low < value
+    if operator == '<=':
+        return low <= value
+    if operator == '>':
+        return up > value
+    return up >= value
+
+
+def zone_may_pass(paths, stats):
+    """Return True if the entries of a zone, with stats in the form
+    {'column': (min, max)}, may pass the cuts of at least one path.
+    """
+    for constraints in paths:
+        if all([satisfiable(constraint, *stats[constraint[0]]) \
+                for constraint in constraints if constraint[0] in stats]):
+            return True
+    return False
+
+
+class ZoneMapCache:
+    """
+    Minimum and maximum of the columns used in the cuts of the graphs, for
+    every cluster of every file, computed once and stored as JSON keyed by
+    the fingerprint of the file. Before the event loop of a graph, the
+    comparisons between a column and a constant in the cuts of each path
+    are checked against them: clusters (and whole files) in which no path
+    can have passing entries are not read. Graphs with a Cutflow are not
+    pruned, since its first steps count all the entries.
+
+    Args:
+        directory (str): Directory where the zone maps are stored
+
+    Attributes:
+        directory (str): Directory where the zone maps are stored
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok = True)
+
+    def __path(self, ntuple):
+        content = json.dumps(ntuple_fingerprint(ntuple))
+        return os.path.join(self.directory, '{}.json'.format(
+            hashlib.sha1(content.encode()).hexdigest()[:16]))
+
+    def zone_map(self, ntuple, columns):
+        """Return the zone map of the ntuple, in the form {'starts': [...],
+        'columns': {'column': [[min, max], ...]}}, computing the columns not
+        yet known.
+        """
+        path = self.__path(ntuple)
+        zones = {'starts': None, 'columns': dict()}
+        if os.path.exists(path):
+            with open(path) as f:
+                zones = json.load(f)
+        missing = sorted(set(columns) - set(zones['columns'].keys()))
+        if not missing:
+            return zones
+        ROOT = load_root()
+        ROOT.gInterpreter.Declare(ZONE_MAP_CODE)
+        root_file = ROOT.TFile.Open(ntuple.path)
+        tree = root_file.Get(ntuple.directory)
+        starts = ROOT.std.vector['Long64_t']()
+        values = ROOT.ntupro.zone_map(tree, ROOT.std.vector['std::string'](missing), starts)
+        root_file.Close()
+        zones['starts'] = [int(start) for start in starts]
+        nclusters = len(zones['starts']) - 1
+        for i, column in enumerate(missing):
+            zones['columns'][column] = [
+                [float(values[2 * (cluster * len(missing) + i)]),
+                 float(values[2 * (cluster * len(missing) + i) + 1])] \
+                for cluster in range(nclusters)]
+        logger.debug('%%%%%%%%%% Computed zone map of {} for {}'.format(
+            ntuple.path, ', '.join(missing)))
+        with open(path + '.part', 'w') as f:
+            json.dump(zones, f)
+        os.replace(path + '.part', path)
+        return zones
+
+    def kept_ranges(self, dataset, graph, prefix_only = False):
+        """Return, for every ntuple of the dataset, the list of entry ranges
+        (start, end) that may contain entries passing the cuts of the graph
+        (only the ones of its shared prefix if prefix_only is True, e.g. when
+        the entries passing the prefix are written to a skim), or None if
+        nothing can be skipped.
+        """
+        if any([isinstance(action, Cutflow) for action in graph_actions(graph)]):
+            logger.debug('%%%%%%%%%% Graph {} has a cutflow, no zone skipped'.format(
+                repr(graph)))
+            return None
+        if not cacheable(dataset):
+            logger.debug('%%%%%%%%%% Files of dataset {} are not local, no zone skipped'.format(
+                dataset.name))
+            return None
+        paths = [prefix_constraints(graph)] if prefix_only else path_constraints(graph)
+        columns = set([constraint[0] for constraints in paths for constraint in constraints])
+        if not paths or any([not constraints for constraints in paths]):
+            return None
+        ranges = list()
+        skipped = 0
+        total = 0
+        for ntuple in dataset.ntuples:
+            zones = self.zone_map(ntuple, columns)
+            starts = zones['starts']
+            kept = list()
+            for cluster in range(len(starts) - 1):
+                stats = dict([(column, zones['columns'][column][cluster]) for column in columns])
+                if zone_may_pass(paths, stats):
+                    if kept and kept[-1][1] == starts[cluster]:
+                        kept[-1] = (kept[-1][0], starts[cluster + 1])
+                    else:
+                        kept.append((starts[cluster], starts[cluster + 1]))
+                else:
+                    skipped += starts[cluster + 1] - starts[cluster]
+            total += starts[-1]
+            ranges.append(kept)
+        logger.info('Zone maps skip {} of {} entries of dataset {}'.format(
+            skipped, total, dataset.name))
+        if not skipped:
+            return None
+        return ranges
+
+    def apply(self, chain, dataset, graph, prefix_only = False):
+        """Set on the chain an entry list with the entry ranges that may pass
+        the cuts of the graph (see kept_ranges). Return the list (to be kept
+        alive as long as the chain is used), or None if nothing is skipped.
+        """
+        ranges = self.kept_ranges(dataset, graph, prefix_only)
+        if ranges is None:
+            return None
+        ROOT = load_root()
+        ROOT.gInterpreter.Declare(ZONE_MAP_CODE)
+        entry_list = ROOT.TEntryList('ntupro_zones', '')
+        entry_list.SetDirectory(0)
+        for ntuple, kept in zip(dataset.ntuples, ranges):
+            if not kept:
+                continue
+            sub_list = ROOT.ntupro.ranges_entry_list(ntuple.directory, ntuple.path,
+                ROOT.std.vector['Long64_t']([start for start, _ in kept]),
+                ROOT.std.vector['Long64_t']([end for _, end in kept]))
+            ROOT.SetOwnership(sub_list, True)
+            entry_list.Add(sub_list)
+        chain.SetEntryList(entry_list)
+        return entry_list
+
+
+def graph_actions(node):
+    if node.kind == 'action':
+        return [node.unit_block]
+    return [action for child in node.children for action in graph_actions(child)]
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from ntupro.booking import ArrowNtuple, Ntuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import ColumnarGraphRunner, arrow_columns
+
+
+class TestArrowNtuples(unittest.TestCase):
+    """ Test the booking of Parquet and Arrow ntuples
+    """
+    def test_format_and_comparison(self):
+        """
+        Format is inferred from the extension, ROOT ntuples are never equal
+        """
+        self.assertEqual(ArrowNtuple('skim.parquet').file_format, 'parquet')
+        self.assertEqual(ArrowNtuple('skim.feather').file_format, 'arrow')
+        self.assertEqual(ArrowNtuple('skim.parquet'), ArrowNtuple('skim.parquet'))
+        self.assertNotEqual(ArrowNtuple('skim.parquet'), Ntuple('skim.parquet', 'tree'))
+        with self.assertRaises(ValueError):
+            ArrowNtuple('skim.root')
+
+    def test_merge_datasets(self):
+        """
+        Graphs of datasets made of the same files are merged
+        """
+        units = [Unit(Dataset('ds', [ArrowNtuple('skim.parquet')]),
+                [Selection('sel', cuts = [('x > 0', 'positive')])],
+                [Histogram(name, 'x', (10, 0., 1.))]) for name in ['a', 'b']]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(1)
+        self.assertEqual(len(graph_manager.graphs), 1)
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow not available')
+class TestArrowColumns(unittest.TestCase):
+    """ Test the memory-mapped reading of Parquet and Arrow files
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.main = os.path.join(self.directory, 'main.arrow')
+        self.friend = os.path.join(self.directory, 'friend.parquet')
+        pyarrow.feather.write_feather(pyarrow.table({
+            'x': numpy.array([0.5, 1.5, 2.5]), 'unused': numpy.zeros(3)}),
+            self.main, compression = 'uncompressed')
+        pyarrow.parquet.write_table(pyarrow.table({
+            'w': numpy.array([1., 2., 3.])}), self.friend)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_referenced_columns(self):
+        """
+        Only referenced columns are read, also from the friends
+        """
+        ntuple = ArrowNtuple(self.main, [ArrowNtuple(self.friend, tag = 'weights')])
+        arrays = arrow_columns(ntuple, set(['x', 'w']))
+        self.assertEqual(sorted(arrays.keys()), ['w', 'x'])
+        self.assertEqual(arrays['x'].tolist(), [0.5, 1.5, 2.5])
+
+    def test_columnar_backend(self):
+        """
+        The columnar backend runs on Arrow datasets
+        """
+        ntuple = ArrowNtuple(self.main, [ArrowNtuple(self.friend, tag = 'weights')])
+        unit = Unit(Dataset('ds', [ntuple]),
+                [Selection('sel', cuts = [('x > 1', 'cut')], weights = [('w', 'weight')])],
+                [Histogram('x', 'x', (3, 0., 3.))])
+        graph_manager = GraphManager([unit])
+        graph_manager.optimize(2)
+        results = ColumnarGraphRunner(graph_manager.graphs[0]).run()
+        self.assertEqual(results[0].contents.tolist(), [0., 0., 2., 3., 0.])
+
+
+if __name__ == '__main__':
+    unittest.main()
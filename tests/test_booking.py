@@ -1,6 +1,9 @@
 import unittest
+from unittest import mock
 
 from ntupro.booking import Ntuple, Dataset, Cut, Weight
+from ntupro.booking import Selection, Cutflow, Unit, Histogram, BootstrapHistogram
+from ntupro.utils import SelectionStep, cutflow_bins
 
 
 class TestBookingMethods(unittest.TestCase):
@@ -54,6 +57,73 @@ class TestBookingMethods(unittest.TestCase):
         self.assertEqual(self.wh, same_wh)
         self.assertNotEqual(self.wh, other_wh)
 
+    def test_cutflow_naming(self):
+        """
+        Cutflows booked in a Unit get the same naming scheme as the histograms
+        """
+        selection = Selection('sel', cuts = [self.ct], weights = [self.wh])
+        unit = Unit(self.ds, [selection], [Cutflow('cutflow')])
+        self.assertIsInstance(unit.actions[0], Cutflow)
+        self.assertEqual(unit.actions[0].name, 'ds#sel#cutflow#Nominal')
+
+    def test_cutflow_bins(self):
+        """
+        Weighted cutflows hold sums of weights where the steps have weights,
+        raw cutflows always the entries, with Poisson errors
+        """
+        values = [(100, None, None), (40, 20., 16.), (10, 5., 4.)]
+        self.assertEqual(cutflow_bins(values), [(100, 10.), (20., 4.), (5., 2.)])
+        self.assertEqual(cutflow_bins(values, weighted = False),
+                [(100, 10.), (40, 40 ** 0.5), (10, 10 ** 0.5)])
+
+    def test_selection_step_counters(self):
+        """
+        Steps book the sums of weights only if they have weights, and only once
+        """
+        frame = mock.MagicMock()
+        unweighted = SelectionStep('ds', frame, [])
+        count, sumw, sumw2 = unweighted.book_counters()
+        self.assertIs(count, frame.Count.return_value)
+        self.assertEqual((sumw, sumw2), (None, None))
+        weighted = SelectionStep('sel', frame, [self.wh, Weight('2', 'two')])
+        counters = weighted.book_counters()
+        self.assertIs(weighted.book_counters(), counters)
+        frame.Define.assert_called_once_with('ntupro_cutflow_weight',
+                'static_cast<double>((weight_exp)*(2))')
+        self.assertEqual(frame.Count.call_count, 2)
+        self.assertIsNotNone(counters[1])
+
+    def test_bootstrap_histogram_booking(self):
+        """
+        Bootstrap settings survive the renaming done by Unit
+        """
+        histo = BootstrapHistogram('histo', 'var', (10, 0., 1.), nreplicas = 50, seed = 7)
+        unit = Unit(self.ds, [Selection('sel', cuts = [self.ct])], [histo])
+        booked = unit.actions[0]
+        self.assertIsInstance(booked, BootstrapHistogram)
+        self.assertEqual(booked.name, 'ds#sel#histo#Nominal')
+        self.assertEqual((booked.nreplicas, booked.seed, booked.event_variable), (50, 7, 'event'))
+        split = BootstrapHistogram('histo', 'var', (10, 0., 1.), nreplicas = 50, seed = 7,
+                split_replicas = True)
+        self.assertNotEqual(histo, split)
+        self.assertEqual(len(set([histo, split])), 2)
+        plain = Histogram('histo', 'var', (10, 0., 1.))
+        self.assertNotEqual(plain, histo)
+        self.assertNotEqual(histo, plain)
+        with self.assertRaises(ValueError):
+            BootstrapHistogram('histo', 'var', (10, 0., 1.), nreplicas = 0)
+
+    def test_histogram_storage(self):
+        """
+        The storage of a histogram survives the renaming done by Unit
+        """
+        histo = Histogram('histo', 'var', (10, 0., 1.), storage = 'sparse')
+        unit = Unit(self.ds, [Selection('sel', cuts = [self.ct])], [histo])
+        self.assertEqual(unit.actions[0].storage, 'sparse')
+        self.assertNotEqual(histo, Histogram('histo', 'var', (10, 0., 1.)))
+        with self.assertRaises(ValueError):
+            Histogram('histo', 'var', (10, 0., 1.), storage = 'half')
+
 
 if __name__ == '__main__':
     unittest.main()
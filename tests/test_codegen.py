@@ -0,0 +1,141 @@
+import re
+import unittest
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Count, Cutflow, Unit
+from ntupro.optimization import GraphManager
+from ntupro.run import RunManager
+from ntupro.utils import GraphCodeGenerator, action_column
+from ntupro.utils._codegen import FUNCTION_PLACEHOLDER, source_hash
+
+
+class TestCodeGeneration(unittest.TestCase):
+    """ Test the translation of optimized graphs into C++ code
+    """
+    def setUp(self):
+        dataset = Dataset('ds', [Ntuple('path', 'tree')])
+        selection = Selection('sel',
+                cuts = [('nMuon == 2', 'two_muons')],
+                weights = [('genWeight', 'gen_weight')])
+        histos = [
+            Histogram('pt', 'Muon_pt0', (10, 0., 100.), 'Muon_pt[0]'),
+            Histogram('n', 'nMuon', [0., 1., 2., 5.])]
+        unit = Unit(dataset, [selection], histos + [Cutflow('cutflow')])
+        graph_manager = GraphManager([unit])
+        graph_manager.optimize(2)
+        self.graph = graph_manager.graphs[0]
+        self.column_types = {
+            'nMuon': 'UInt_t',
+            'genWeight': 'Float_t',
+            'Muon_pt': 'ROOT::VecOps::RVec<Float_t>'}
+
+    def test_typed_booking(self):
+        """
+        Filters, Defines and actions are booked with typed lambdas and templates
+        """
+        source = GraphCodeGenerator(self.graph, self.column_types).generate()
+        self.assertIn('TList *{}(TTree *tree)'.format(FUNCTION_PLACEHOLDER), source)
+        self.assertIn('.Filter([](const UInt_t &nMuon) -> bool { return (nMuon == 2); }, {"nMuon"}, "sel")',
+                source)
+        self.assertIn('[](const ROOT::VecOps::RVec<Float_t> &Muon_pt) { return Muon_pt[0]; }', source)
+        self.assertIn('.Histo1D<UInt_t, double>(', source)
+        self.assertIn('"ds#sel#cutflow_raw#Nominal"', source)
+        self.assertNotIn('Histo1D(', source)
+
+    def test_weights_only_step(self):
+        """
+        A selection with only weights shares the frame and the entries of its
+        parent, but its weighted cutflow bin is filled with its own sums
+        """
+        dataset = Dataset('ds', [Ntuple('path', 'tree')])
+        selections = [Selection('sel', cuts = [('nMuon == 2', 'two_muons')]),
+                Selection('w', weights = [('genWeight', 'gen_weight')])]
+        graph_manager = GraphManager([Unit(dataset, selections, [Cutflow('cutflow')])])
+        graph_manager.optimize(2)
+        source = GraphCodeGenerator(graph_manager.graphs[0], self.column_types).generate()
+        self.assertEqual(source.count('n1.Count()'), 1)
+        self.assertIn('.Sum<double>("ntupro_cutflow_weight")', source)
+        weighted = source[:source.index('cutflow_raw')]
+        sumw = re.search(r'auto (c\d+) = n\d+\.Sum<double>\("ntupro_cutflow_weight"\)', source).group(1)
+        self.assertIn('SetBinContent(3, *{});'.format(sumw), weighted)
+
+    def test_weight_column_names(self):
+        """
+        Columns defined for actions are valid identifiers whatever the name
+        """
+        self.assertEqual(action_column('ds#sel#m.vis+1 up#Nominal'), 'ntupro_ds_sel_m_vis_1_up_Nominal')
+        dataset = Dataset('ds', [Ntuple('path', 'tree')])
+        selection = Selection('mt-1.5 + x',
+                cuts = [('nMuon == 2', 'two_muons')],
+                weights = [('genWeight', 'gen_weight')])
+        actions = [Histogram('pt.0', 'nMuon', (10, 0., 10.)),
+                Histogram('pt.f', 'nMuon', (10, 0., 10.), storage = 'float'),
+                Count('n events', 'nMuon')]
+        graph_manager = GraphManager([Unit(dataset, [selection], actions)])
+        graph_manager.optimize(2)
+        source = GraphCodeGenerator(graph_manager.graphs[0], self.column_types).generate()
+        defined = re.findall(r'\.Define\("([^"]*)"', source)
+        self.assertEqual(len(defined), 3)
+        for column in defined:
+            self.assertRegex(column, r'^ntupro_\w+$')
+
+    def test_membership(self):
+        """
+        Merged graphs filter the files of each dataset once per file, packed
+        graphs through the index of the dataset of each file
+        """
+        ntuples = [Ntuple('file{}.root'.format(i), 'tree') for i in range(3)]
+        selection = Selection('sel', cuts = [('nMuon == 2', 'two_muons')])
+        def units(datasets):
+            return [Unit(dataset, [selection], [Histogram('n', 'nMuon', (3, 0., 3.)),
+                Cutflow('cutflow')]) for dataset in datasets]
+        graph_manager = GraphManager(units([Dataset('a', ntuples[:2]), Dataset('b', ntuples[1:])]))
+        graph_manager.optimize(3)
+        source = GraphCodeGenerator(graph_manager.graphs[0], self.column_types).generate()
+        self.assertIn('inline bool sample_in(', source)
+        self.assertIn('.DefinePerSample("ntupro_member_a", [](unsigned int, const ROOT::RDF::RSampleInfo &info) -> bool '
+                '{ return ntupro::sample_in(info, {"file0.root/tree", "file1.root/tree"}); });', source)
+        self.assertIn('.Filter([](const bool &member) -> bool { return member; }, {"ntupro_member_b"}, "b")',
+                source)
+        self.assertIn('"a#sel#cutflow_raw#Nominal"', source)
+        graph_manager = GraphManager(units([Dataset('a', ntuples[:1]), Dataset('b', ntuples[1:])]))
+        graph_manager.optimize(2)
+        graph_manager.pack_small_datasets(10, entries = {'a': 1, 'b': 2})
+        source = GraphCodeGenerator(graph_manager.graphs[0], self.column_types).generate()
+        self.assertEqual(source.count('DefinePerSample('), 1)
+        self.assertIn('ntupro::sample_index(info, {{"file0.root/tree"}, {"file1.root/tree", "file2.root/tree"}})',
+                source)
+        self.assertIn('.Filter([](const int &id) -> bool { return id == 1; }, {"ntupro_dataset_id"}, "b")',
+                source)
+
+    def test_sparse_storage(self):
+        """
+        Sparse histograms are rejected when the run manager is created
+        """
+        dataset = Dataset('ds', [Ntuple('path', 'tree')])
+        unit = Unit(dataset, [Selection('sel', cuts = [('nMuon == 2', 'two_muons')])],
+                [Histogram('n', 'nMuon', (5, 0., 5.), storage = 'sparse')])
+        graph_manager = GraphManager([unit])
+        graph_manager.optimize(2)
+        with self.assertRaises(ValueError):
+            RunManager(graph_manager.graphs, backend = 'compiled')
+        RunManager(graph_manager.graphs, backend = 'rdataframe')
+        RunManager([self.graph], backend = 'compiled')
+
+    def test_deterministic_source(self):
+        """
+        Same graph gives the same source and thus the same cache entry
+        """
+        first = GraphCodeGenerator(self.graph, self.column_types).generate()
+        second = GraphCodeGenerator(self.graph, self.column_types).generate()
+        self.assertEqual(source_hash(first), source_hash(second))
+
+    def test_unknown_column_type(self):
+        """
+        Variables whose type cannot be resolved are reported
+        """
+        with self.assertRaises(NameError):
+            GraphCodeGenerator(self.graph, {'genWeight': 'Float_t'}).generate()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import uproot
+except ImportError:
+    uproot = None
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Count, Cutflow, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import NumpyExpression, ColumnarGraphRunner
+from ntupro.utils import split_graph_by_ntuples, merge_results
+
+
+@unittest.skipIf(numpy is None, 'numpy not available')
+class TestColumnarBackend(unittest.TestCase):
+    """ Test the evaluation of graphs on numpy arrays
+    """
+    def setUp(self):
+        dataset = Dataset('ds', [Ntuple('a.root', 'tree'), Ntuple('b.root', 'tree')])
+        selection = Selection('sel',
+                cuts = [('n >= 2 && !(x > 1.5f)', 'cut')],
+                weights = [('w', 'weight')])
+        actions = [
+            Histogram('x', 'x', (4, -2., 2.)),
+            Histogram('x2', 'x2', [0., 1., 4.], 'x*x'),
+            Count('count', 'n'),
+            Cutflow('cutflow')]
+        graph_manager = GraphManager([Unit(dataset, [selection], actions)])
+        graph_manager.optimize(2)
+        self.graph = graph_manager.graphs[0]
+        self.arrays = {
+            'x': numpy.array([-3., -1.5, 0.5, 1.9, 0.1, 2.5]),
+            'n': numpy.array([2, 3, 1, 4, 2, 2], dtype = numpy.int32),
+            'w': numpy.array([1., 2., 3., 4., 0.5, 1.])}
+
+    def test_expressions(self):
+        """
+        C++ syntax is translated, unsupported expressions are rejected up front
+        """
+        columns = {'a': numpy.array([1, 2, 3]), 'b': numpy.array([0.5, 2., 9.])}
+        result = NumpyExpression('a > 1 && !(std::sqrt(b) == 3.f) || a == 7u').evaluate(columns)
+        self.assertEqual(result.tolist(), [False, True, False])
+        self.assertEqual(NumpyExpression('a / 2').evaluate(columns).tolist(), [0, 1, 1])
+        for expression in ['a[0]', 'a > 1 ? 1 : 0', 'myFunction(a)', 'v.size()']:
+            with self.assertRaises(NotImplementedError):
+                NumpyExpression(expression)
+
+    def test_precedence(self):
+        """
+        Comparisons follow the C++ precedence, bitwise operators compared
+        without parentheses (evaluated differently in Python) are rejected
+        """
+        columns = {'flags': numpy.array([4, 5, 0, 6]), 'a': numpy.array([1, 2, 3, 4]),
+                'b': numpy.array([1, 0, 1, 1])}
+        self.assertEqual(NumpyExpression('(flags & 4) == 4').evaluate(columns).tolist(),
+                [True, True, False, True])
+        # As a == (b < 2) and (a < 2) == b
+        self.assertEqual(NumpyExpression('a == b < 2').evaluate(columns).tolist(),
+                [True, False, False, False])
+        self.assertEqual(NumpyExpression('a < 2 == b').evaluate(columns).tolist(),
+                [True, True, False, False])
+        for expression in ['flags & 4 == 4', '(flags) | (1) != 0', 'a > 1 && flags ^ 2 < 3']:
+            with self.assertRaises(NotImplementedError):
+                NumpyExpression(expression)
+
+    def test_histograms(self):
+        """
+        Histograms, counts and cutflows match the RDataFrame conventions
+        """
+        runner = ColumnarGraphRunner(self.graph)
+        runner.process(self.arrays)
+        results = dict([(result.GetName(), result) for result in runner.results.values()])
+        x = results['ds#sel#x#Nominal']
+        # Selected: x = -3 (underflow, w = 1), -1.5 (w = 2), 0.1 (w = 0.5)
+        self.assertEqual(x.contents.tolist(), [1., 2., 0., 0.5, 0., 0.])
+        self.assertEqual(x.entries, 3)
+        self.assertEqual(results['ds#sel#x2#Nominal'].contents.tolist(), [0., 0.5, 2., 1.])
+        self.assertAlmostEqual(results['ds#sel#count#Nominal'].contents[0], 2. + 6. + 1.)
+        self.assertEqual(results['ds#sel#cutflow_raw#Nominal'].contents.tolist(), [0., 6., 3., 0.])
+        self.assertEqual(results['ds#sel#cutflow#Nominal'].contents.tolist(), [0., 6., 3.5, 0.])
+
+    @unittest.skipIf(uproot is None, 'uproot not available')
+    def test_without_columns(self):
+        """
+        Graphs reading no column process all the entries of the ntuples
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'a.root')
+            with uproot.recreate(path) as f:
+                f['tree'] = {'x': numpy.arange(5, dtype = numpy.float64)}
+            dataset = Dataset('ds', [Ntuple(path, 'tree')])
+            selection = Selection('all', weights = [('0.5', 'half')])
+            graph_manager = GraphManager([Unit(dataset, [selection], [Cutflow('cutflow')])])
+            graph_manager.optimize(2)
+            runner = ColumnarGraphRunner(graph_manager.graphs[0], step_size = 2)
+            results = dict([(result.GetName(), result) for result in runner.run()])
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(runner.events, 5)
+        self.assertEqual(results['ds#all#cutflow_raw#Nominal'].contents.tolist(), [0., 5., 5., 0.])
+        self.assertEqual(results['ds#all#cutflow#Nominal'].contents.tolist(), [0., 5., 2.5, 0.])
+
+    def test_split_and_merge(self):
+        """
+        Graphs are split per ntuple and partial results merged by name
+        """
+        tasks = split_graph_by_ntuples(self.graph)
+        self.assertEqual([len(task.unit_block.ntuples) for task in tasks], [1, 1])
+        partials = list()
+        for task in tasks:
+            runner = ColumnarGraphRunner(task)
+            runner.process(self.arrays)
+            partials.extend(runner.results.values())
+        merged = merge_results(partials)
+        self.assertEqual(len(merged), len(partials) // 2)
+        self.assertEqual(merged[0].contents.tolist(), [2., 4., 0., 1., 0., 0.])
+
+    def test_storage(self):
+        """
+        Float and sparse storage give the same bins as double storage
+        """
+        dataset = Dataset('ds', [Ntuple('a.root', 'tree')])
+        selection = Selection('sel', weights = [('w', 'weight')])
+        actions = [Histogram('x_{}'.format(storage), 'x', (4, -2., 2.), storage = storage) \
+                for storage in Histogram.storages]
+        graph_manager = GraphManager([Unit(dataset, [selection], actions)])
+        graph_manager.optimize(2)
+        partials = list()
+        for i in range(2):
+            runner = ColumnarGraphRunner(graph_manager.graphs[0])
+            runner.process(self.arrays)
+            partials.extend(runner.results.values())
+        results = dict([(result.GetName(), result) for result in merge_results(partials)])
+        double = results['ds#sel#x_double#Nominal']
+        single = results['ds#sel#x_float#Nominal']
+        sparse = results['ds#sel#x_sparse#Nominal']
+        self.assertEqual(single.contents.dtype, numpy.float32)
+        self.assertEqual(single.contents.tolist(), double.contents.tolist())
+        self.assertEqual(single.sumw2.tolist(), double.sumw2.tolist())
+        # The empty bin (from -1 to 0) is not stored
+        self.assertEqual(sorted(sparse.bins), [0, 1, 3, 4, 5])
+        dense = sparse.to_arrays()
+        self.assertEqual(dense.contents.tolist(), double.contents.tolist())
+        self.assertEqual(dense.sumw2.tolist(), double.sumw2.tolist())
+        self.assertEqual(dense.entries, double.entries)
+        self.assertEqual(dense.stats.tolist(), double.stats.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
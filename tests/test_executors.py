@@ -0,0 +1,56 @@
+import unittest
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import LocalExecutor, GraphProfile, RunProfile, task_costs, pack_tasks
+
+
+def square(job):
+    return [value * value for value in job]
+
+
+class TestExecutors(unittest.TestCase):
+    """ Test the packing of the tasks and the local executor
+    """
+    def test_pack_tasks(self):
+        """
+        Tasks are packed first fit by decreasing cost, costly ones stay alone
+        """
+        costs = [50., 10., 300., 40., 30., 60.]
+        self.assertEqual(pack_tasks(costs, 100.), [[0, 1, 4], [2], [3, 5]])
+        self.assertEqual(pack_tasks(costs), [[i] for i in range(6)])
+
+    def test_task_costs(self):
+        """
+        Costs come from the time per ntuple of a previous run, if measured
+        """
+        datasets = [Dataset(name, [Ntuple('{}_{}.root'.format(name, i), 'tree') for i in range(n)]) \
+                for name, n in [('ztt', 4), ('zl', 2)]]
+        graph_manager = GraphManager([Unit(dataset, [Selection('sel')],
+            [Histogram('x', 'x', (4, -2., 2.))]) for dataset in datasets])
+        graph_manager.optimize(2)
+        tasks = graph_manager.graphs
+        self.assertEqual(task_costs(tasks, seconds_per_ntuple = 10.), [40., 20.])
+        profile = RunProfile()
+        measured = GraphProfile(tasks[0], 0)
+        measured.loop = 8.
+        profile.add(measured.to_dict())
+        self.assertEqual(task_costs(tasks, profile, seconds_per_ntuple = 10.), [8., 20.])
+
+    def test_local_executor(self):
+        """
+        Failed jobs are submitted again and the outputs kept in order
+        """
+        executor = LocalExecutor(2, failure_rate = 0.5, max_retries = 20, seed = 2)
+        jobs = [[1, 2], [3], [4, 5, 6]]
+        self.assertEqual(executor.map(square, jobs), [[1, 4], [9], [16, 25, 36]])
+        self.assertGreater(executor.failures(), 0)
+        self.assertEqual(len(executor.records), len(jobs) + executor.failures())
+        with self.assertRaises(RuntimeError):
+            LocalExecutor(1, failure_rate = 0.99, max_retries = 1).map(square, jobs)
+        with self.assertRaises(ValueError):
+            LocalExecutor(1, failure_rate = 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import subprocess
+import logging
+import sys
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class TestImports(unittest.TestCase):
+    """ Test that ntupro can be imported, and units booked and optimized,
+    without loading ROOT, and keep track of the import time
+    """
+    def run_python(self, code):
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.run(
+                [sys.executable, '-c', code],
+                cwd = root_dir, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                universal_newlines = True)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return process.stdout
+
+    def test_booking_and_optimization_without_root(self):
+        """
+        Booking and optimization work when ROOT cannot be imported
+        """
+        code = '\n'.join([
+            'import sys',
+            "sys.modules['ROOT'] = None",
+            'import ntupro',
+            "dataset = ntupro.Dataset('ds', [ntupro.Ntuple('path', 'tree')])",
+            "selection = ntupro.Selection('sel', [('x > 0', 'x_positive')], [('w', 'weight')])",
+            "histo = ntupro.Histogram('x', 'x', (10, 0., 1.))",
+            'um = ntupro.UnitManager()',
+            'um.book([ntupro.Unit(dataset, [selection], [histo])])',
+            'gm = ntupro.GraphManager(um.booked_units)',
+            'gm.optimize(2)',
+            'ntupro.RunManager(gm.graphs)',
+            "print(len(gm.graphs))"])
+        self.assertEqual(self.run_python(code).strip(), '1')
+
+    def test_import_time(self):
+        """
+        Importing ntupro does not load ROOT; the import time is only
+        reported, since it depends on the load of the machine
+        """
+        code = '\n'.join([
+            'import sys',
+            'import time',
+            'start = time.perf_counter()',
+            'import ntupro',
+            'print(time.perf_counter() - start)',
+            "print('ROOT' in sys.modules)"])
+        import_time, root_loaded = self.run_python(code).strip().splitlines()[-2:]
+        self.assertEqual(root_loaded, 'False')
+        logger.info('Import of ntupro took {:.3f} seconds'.format(float(import_time)))
+
+
+if __name__ == '__main__':
+    unittest.main()
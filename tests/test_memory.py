@@ -0,0 +1,61 @@
+import unittest
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Cutflow, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import MemoryBudget, resident_memory
+
+
+def action_names(node):
+    if node.kind == 'action':
+        return [node.unit_block.name]
+    return [name for child in node.children for name in action_names(child)]
+
+
+class TestMemoryBudget(unittest.TestCase):
+    """ Test the estimate of the memory of a graph and its split into passes
+    """
+    def setUp(self):
+        dataset = Dataset('ds', [Ntuple('file.root', 'tree')])
+        units = [Unit(dataset, [Selection(channel, cuts = [('x > 0', 'x_cut')])],
+            [Histogram('h{}'.format(i), 'x', (998, 0., 1.)) for i in range(3)] + \
+            [Cutflow('cutflow')]) for channel in ['mt', 'et']]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(2)
+        self.graph = graph_manager.graphs[0]
+
+    def test_estimate(self):
+        """
+        Bins times 8 bytes, times 2 for sumw2, times the threads
+        """
+        budget = MemoryBudget(10 ** 9)
+        # Six histograms of 1000 cells and two cutflows of two steps
+        self.assertEqual(budget.estimate(self.graph, 1), (6 * 1000 + 2 * 6) * 16)
+        self.assertEqual(budget.estimate(self.graph, 4), 4 * (6 * 1000 + 2 * 6) * 16)
+
+    def test_split(self):
+        """
+        Graphs over budget are split into passes with all the actions
+        """
+        budget = MemoryBudget(4 * 2 * 1000 * 16)
+        self.assertEqual(budget.split(self.graph, 1), [self.graph])
+        passes = budget.split(self.graph, 4)
+        self.assertEqual(len(passes), 4)
+        self.assertEqual(sorted([name for graph in passes for name in action_names(graph)]),
+                sorted(action_names(self.graph)))
+        for graph in passes:
+            self.assertLessEqual(budget.estimate(graph, 4), budget.max_bytes)
+        # The original graph is left untouched
+        self.assertEqual(len(action_names(self.graph)), 8)
+
+    def test_resident_memory(self):
+        """
+        The resident memory of the process is measured where /proc is available
+        """
+        rss = resident_memory()
+        if rss is not None:
+            self.assertGreater(rss, 0)
+            self.assertEqual(rss % 1024, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
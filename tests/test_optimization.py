@@ -0,0 +1,129 @@
+import unittest
+from unittest import mock
+
+from ntupro.booking import Ntuple, ArrowNtuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager, MergedGraph
+from ntupro.utils import membership_expression
+from ntupro.utils import dataset_id_expression, pack_datasets, count_entries
+
+
+class TestOverlappingDatasets(unittest.TestCase):
+    """ Test the merging of datasets sharing ntuples into one event loop
+    """
+    def setUp(self):
+        self.ntuples = [Ntuple('file{}.root'.format(i), 'tree') for i in range(4)]
+        datasets = [
+            Dataset('ztt', self.ntuples[0:2]),
+            Dataset('zl', self.ntuples[1:3]),
+            Dataset('ttbar', [self.ntuples[3]]),
+            Dataset('other_tree', [Ntuple('file0.root', 'other')])]
+        self.units = [Unit(dataset, [Selection('sel', cuts = [('pt > 20', 'pt_cut')])],
+                [Histogram('pt', 'pt', (10, 0., 100.))]) for dataset in datasets]
+
+    def test_merge_overlapping(self):
+        """
+        Datasets sharing files end up in one graph, each behind its membership node
+        """
+        graph_manager = GraphManager(self.units)
+        graph_manager.optimize(3)
+        self.assertEqual(len(graph_manager.graphs), 3)
+        merged = graph_manager.graphs[0]
+        self.assertIsInstance(merged, MergedGraph)
+        self.assertEqual(merged.unit_block.ntuples, self.ntuples[0:3])
+        self.assertEqual([(child.kind, child.name) for child in merged.children],
+                [('membership', 'ztt'), ('membership', 'zl')])
+        self.assertEqual(merged.children[1].children[0].children[0].unit_block.name,
+                'zl#sel#pt#Nominal')
+
+    def test_level_two_untouched(self):
+        """
+        Lower optimization levels keep one graph per dataset
+        """
+        graph_manager = GraphManager(self.units)
+        graph_manager.optimize(2)
+        self.assertEqual(len(graph_manager.graphs), 4)
+
+    def test_membership_expression(self):
+        """
+        Membership is checked on the sample identifiers of RDataFrame
+        """
+        self.assertEqual(membership_expression(Dataset('zl', self.ntuples[1:3])),
+                'ntupro::sample_in(rdfsampleinfo_, {"file1.root/tree", "file2.root/tree"})')
+
+
+class TestPackedDatasets(unittest.TestCase):
+    """ Test the packing of small datasets into one chain
+    """
+    def setUp(self):
+        self.datasets = [Dataset('sample{}'.format(i),
+            [Ntuple('sample{}.root'.format(i), 'tree')]) for i in range(4)]
+        self.datasets.append(Dataset('friends', [Ntuple('friends.root', 'tree',
+            [Ntuple('friend.root', 'tree', tag = 'f')])]))
+        self.entries = [100, 5000, 300, 600, 10]
+        self.units = [Unit(dataset, [Selection('sel', cuts = [('pt > 20', 'pt_cut')])],
+                [Histogram('pt', 'pt', (10, 0., 100.))]) for dataset in self.datasets]
+
+    def test_pack_datasets(self):
+        """
+        Small datasets with the same layout are packed up to max_entries
+        """
+        self.assertEqual(pack_datasets(self.datasets, self.entries, 1000),
+                [[0, 2, 3], [1], [4]])
+        self.assertEqual(pack_datasets(self.datasets, self.entries, 800),
+                [[0, 3], [1], [2], [4]])
+
+    def test_pack_small_datasets(self):
+        """
+        Packed graphs hang the former graphs from membership nodes
+        """
+        graph_manager = GraphManager(self.units)
+        graph_manager.optimize(2)
+        graph_manager.pack_small_datasets(1000, dict(
+            [(dataset.name, n) for dataset, n in zip(self.datasets, self.entries)]))
+        self.assertEqual(len(graph_manager.graphs), 3)
+        packed = graph_manager.graphs[0]
+        self.assertIsInstance(packed, MergedGraph)
+        self.assertTrue(packed.packed)
+        self.assertEqual([child.name for child in packed.children],
+                ['sample0', 'sample2', 'sample3'])
+
+    def test_count_entries(self):
+        """
+        Only datasets which can be packed are counted, each until it exceeds
+        max_entries, and missing trees are reported
+        """
+        arrow = Dataset('arrow', [ArrowNtuple('skim.parquet')])
+        units = self.units + [Unit(arrow, [Selection('sel', cuts = [('pt > 20', 'pt_cut')])],
+                [Histogram('pt', 'pt', (10, 0., 100.))])]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(2)
+        counted = list()
+        def count(dataset, max_entries):
+            counted.append(dataset.name)
+            return dict(zip([d.name for d in self.datasets], self.entries))[dataset.name]
+        with mock.patch('ntupro.optimization.count_entries', side_effect = count):
+            graph_manager.pack_small_datasets(1000)
+        self.assertNotIn('arrow', counted)
+        self.assertEqual(len(graph_manager.graphs), 4)
+        ROOT = mock.MagicMock()
+        ROOT.TFile.Open.return_value.IsZombie.return_value = False
+        ROOT.TFile.Open.return_value.Get.return_value.GetEntries.return_value = 600
+        dataset = Dataset('large', [Ntuple('large{}.root'.format(i), 'tree') for i in range(5)])
+        with mock.patch('ntupro.utils._merging.load_root', return_value = ROOT):
+            self.assertEqual(count_entries(dataset, 1000), 1200)
+            self.assertEqual(ROOT.TFile.Open.call_count, 2)
+            self.assertEqual(count_entries(dataset), 3000)
+            ROOT.TFile.Open.return_value.Get.return_value = None
+            with self.assertRaises(NameError):
+                count_entries(dataset)
+
+    def test_dataset_id_expression(self):
+        """
+        The dataset id is the index of the group of the current sample
+        """
+        self.assertEqual(dataset_id_expression(self.datasets[0:2]),
+                'ntupro::sample_index(rdfsampleinfo_, {{"sample0.root/tree"}, {"sample1.root/tree"}})')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import pickle
+import unittest
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, BootstrapHistogram, Cutflow, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import Plan, PLAN_VERSION
+
+
+def flatten(node):
+    return [(node.name, node.kind)] + [item for child in node.children for item in flatten(child)]
+
+
+class TestPlan(unittest.TestCase):
+    """ Test the serialization of optimized graphs sent to the workers
+    """
+    def setUp(self):
+        ntuples = [Ntuple('file{}.root'.format(i), 'tree',
+            [Ntuple('friend{}.root'.format(i), 'tree', tag = 'f')]) for i in range(3)]
+        datasets = [Dataset('ztt', ntuples[0:2]), Dataset('zl', ntuples[1:3])]
+        selections = [
+            Selection('channel', cuts = [('pt_1 > 20', 'pt_cut')], weights = [('w', 'weight')]),
+            Selection('category', cuts = [('njets == 0', 'jets')])]
+        actions = [Histogram('m_vis', 'm_vis', [0., 50., 100.], prerequisites = {'x': 'pt_1 * 2'}),
+            BootstrapHistogram('pt', 'pt_1', (10, 0., 100.), nreplicas = 5),
+            Cutflow('cutflow')]
+        graph_manager = GraphManager([Unit(dataset, selections, actions) for dataset in datasets])
+        graph_manager.optimize(3)
+        self.graph = graph_manager.graphs[0]
+
+    def test_round_trip(self):
+        """
+        The rebuilt graph has the same nodes and unit blocks
+        """
+        graph = Plan.from_bytes(Plan(self.graph).to_bytes()).graph()
+        self.assertEqual(flatten(graph), flatten(self.graph))
+        self.assertEqual(graph.unit_block, self.graph.unit_block)
+        self.assertEqual(graph.unit_block.ntuples[0].friends[0].tag, 'f')
+        original = self.graph.children[0].children[0]
+        rebuilt = graph.children[0].children[0]
+        self.assertEqual(rebuilt.unit_block.name, original.unit_block.name)
+        self.assertEqual(rebuilt.unit_block.cuts, original.unit_block.cuts)
+        action = rebuilt.children[0].children[1].unit_block
+        self.assertIsInstance(action, BootstrapHistogram)
+        self.assertEqual((action.nbins, action.nreplicas), (10, 5))
+        self.assertFalse(graph.packed)
+
+    def test_interning(self):
+        """
+        Strings and unit blocks shared by several nodes are stored once
+        """
+        plan = Plan(self.graph)
+        self.assertEqual(len(plan.strings), len(set(plan.strings)))
+        # Three ntuples with one friend each, although two datasets share one
+        ntuples = [block for block in plan.block_table if plan.strings[block[0]] == 'Ntuple']
+        self.assertEqual(len(ntuples), 6)
+        self.assertEqual(plan.parents[0], -1)
+
+    def test_version(self):
+        """
+        Plans of another version are rejected
+        """
+        plan = Plan(self.graph)
+        plan.version = PLAN_VERSION + 1
+        with self.assertRaises(ValueError):
+            Plan.from_bytes(pickle.dumps(plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import GraphProfile, RunProfile, ColumnarGraphRunner, format_profile
+
+
+class TestRunProfile(unittest.TestCase):
+    """ Test the profile of a run and its attachment to the graphs
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        dataset = Dataset('ds', [Ntuple('a.root', 'tree'), Ntuple('b.root', 'tree')])
+        units = [Unit(dataset, [Selection('sel', cuts = [('x > 0', 'x_cut')]),
+            Selection(channel, cuts = [('n >= {}'.format(i), 'n_cut')])],
+            [Histogram('x', 'x', (4, -2., 2.))]) for i, channel in enumerate(['mt', 'et'])]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(2)
+        self.graph = graph_manager.graphs[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def task_profile(self, task_id, events, passed):
+        profile = GraphProfile(self.graph, task_id)
+        profile.setup, profile.loop, profile.harvest = 0.5, 2., 0.5
+        profile.events = events
+        profile.add_filter(['ds', 'sel'], events, passed)
+        profile.add_filter(['ds', 'sel', 'mt'], passed, passed // 2)
+        return profile
+
+    def test_annotate(self):
+        """
+        Tasks of the same graph are merged and the efficiencies attached to its nodes
+        """
+        profile = RunProfile('columnar', 2)
+        profile.add(self.task_profile(0, 100, 40))
+        profile.add(self.task_profile(1, 300, 60).to_dict())
+        profile.annotate([self.graph], [0, 0])
+        self.assertEqual(self.graph.profile['events'], 400)
+        self.assertEqual(self.graph.profile['loop'], 4.)
+        self.assertEqual(self.graph.profile['events_per_second'], 100.)
+        selection = self.graph.children[0]
+        self.assertEqual(selection.profile, {'all': 400, 'pass': 100, 'efficiency': 0.25})
+        self.assertEqual(selection.children[0].profile['pass'], 50)
+        self.assertFalse(hasattr(selection.children[1], 'profile'))
+        self.assertEqual(profile.costs(), {'ds': 6.})
+        self.assertIn('sel: 100 of 400 (25.0%)', format_profile(self.graph))
+
+    def test_json(self):
+        """
+        Profiles are written to JSON and read back, only in the same version
+        """
+        profile = RunProfile('rdataframe', 1, 4)
+        profile.add(self.task_profile(0, 10, 5))
+        path = profile.write(os.path.join(self.directory, 'profile.json'))
+        read = RunProfile.read(path)
+        self.assertEqual((read.backend, read.nthreads, read.events()), ('rdataframe', 4, 10))
+        self.assertEqual(read.tasks[0].filters, {'ds/sel': [10, 5], 'ds/sel/mt': [5, 2]})
+        with open(path) as f:
+            content = json.load(f)
+        content['version'] += 1
+        with open(path, 'w') as f:
+            json.dump(content, f)
+        with self.assertRaises(ValueError):
+            RunProfile.read(path)
+
+    @unittest.skipIf(numpy is None, 'numpy not available')
+    def test_columnar_filters(self):
+        """
+        The columnar backend counts the entries reaching and passing each node
+        """
+        runner = ColumnarGraphRunner(self.graph)
+        runner.process({
+            'x': numpy.array([-1., 0.5, 1., 1.5]),
+            'n': numpy.array([0, 0, 1, 2])})
+        self.assertEqual(runner.events, 4)
+        self.assertEqual(runner.filters, {
+            ('ds', 'sel'): [4, 3], ('ds', 'sel', 'mt'): [3, 3], ('ds', 'sel', 'et'): [3, 2]})
+
+
+if __name__ == '__main__':
+    unittest.main()
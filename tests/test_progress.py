@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import ProgressBoard, ProgressReport, Progress, PartialSnapshots
+from ntupro.utils import ColumnarGraphRunner
+
+
+class TestProgress(unittest.TestCase):
+    """ Test the progress board shared with the workers and the reports
+    """
+    def test_report(self):
+        """
+        Entries of the tasks not started yet are estimated from the started ones
+        """
+        board = ProgressBoard(4)
+        board.start(0)
+        board.add_total(0, 1000)
+        board.add(0, 1000)
+        board.finish(0, 1000)
+        board.start(1)
+        board.add_total(1, 3000)
+        board.add(1, 1000)
+        report = ProgressReport(board, 10.)
+        self.assertEqual((report.done, report.running, report.ntasks), (1, 1, 4))
+        self.assertEqual(report.processed, 2000)
+        self.assertEqual(report.total, 8000)
+        self.assertEqual(report.workers, {os.getpid(): 1000})
+        self.assertEqual(report.rate, 200.)
+        self.assertEqual(report.eta, 30.)
+        self.assertIn('1 of 4 tasks done', str(report))
+
+    def test_callback(self):
+        """
+        The run goes on unless the callback returns False
+        """
+        board = ProgressBoard(1)
+        reports = list()
+        self.assertTrue(Progress(callback = reports.append).report(board, 0.))
+        self.assertEqual(len(reports), 1)
+        self.assertFalse(Progress(callback = lambda report: False).report(board, 0.))
+        with self.assertRaises(ValueError):
+            Progress(every = 0)
+
+
+class TestPartialSnapshots(unittest.TestCase):
+    """ Test the selection and the files of the partial results
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files(self):
+        """
+        Results are selected by pattern and written to one file per task
+        """
+        snapshots = PartialSnapshots(self.directory, ['*#m_vis#Nominal'])
+        self.assertTrue(snapshots.selects('ztt#mt-njets0#m_vis#Nominal'))
+        self.assertFalse(snapshots.selects('ztt#mt-njets0#m_vis#jecUp'))
+        name = 'ztt#mt-njets0#m_vis#Nominal'
+        for task_id in [3, 1]:
+            with open(snapshots.path(task_id, name), 'w'):
+                pass
+        self.assertEqual([os.path.basename(os.path.dirname(path)) for path in snapshots.files(name)],
+                ['task_1', 'task_3'])
+
+    @unittest.skipIf(numpy is None, 'numpy not available')
+    def test_columnar_progress(self):
+        """
+        The columnar backend reports the entries of every chunk
+        """
+        dataset = Dataset('ds', [Ntuple('a.root', 'tree')])
+        graph_manager = GraphManager([Unit(dataset, [Selection('sel')],
+            [Histogram('x', 'x', (4, -2., 2.))])])
+        graph_manager.optimize(2)
+        calls = list()
+        runner = ColumnarGraphRunner(graph_manager.graphs[0],
+                progress = lambda processed, total: calls.append((processed, total)))
+        runner.process({'x': numpy.array([-1., 0.5, 1.])})
+        runner.process({'x': numpy.array([1.5])})
+        self.assertEqual(calls, [(3, 0), (1, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+from ntupro.booking import Ntuple, Dataset
+from ntupro.utils import rdf_from_dataset_helper
+from ntupro.utils._run import chain_branches, prune_chain
+
+
+def mock_leaf(name, branch):
+    leaf = mock.MagicMock()
+    leaf.GetName.return_value = name
+    leaf.GetBranch.return_value.GetName.return_value = branch
+    return leaf
+
+
+def mock_branch(name):
+    branch = mock.MagicMock()
+    branch.GetName.return_value = name
+    return branch
+
+
+class TestColumnPruning(unittest.TestCase):
+    """ Test the pruning of the branches and friends of the chains
+    """
+    def test_chain_branches(self):
+        """
+        Leaves are mapped to the branch holding them
+        """
+        chain = mock.MagicMock()
+        chain.LoadTree.return_value = 0
+        tree = chain.GetTree.return_value
+        tree.GetListOfLeaves.return_value = [mock_leaf('pt', 'muon'), mock_leaf('n', 'n')]
+        tree.GetListOfBranches.return_value = [mock_branch('muon'), mock_branch('n')]
+        self.assertEqual(chain_branches(chain), {'pt': 'muon', 'n': 'n', 'muon': 'muon'})
+        chain.LoadTree.return_value = -1
+        self.assertEqual(chain_branches(chain), {})
+
+    def test_prune_chain(self):
+        """
+        Only the branches holding the columns are enabled and cached
+        """
+        chain = mock.MagicMock()
+        branches = {'pt': 'muon', 'eta': 'muon', 'n': 'n', 'met': 'met'}
+        found = prune_chain(chain, branches, set(['pt', 'eta', 'n', 'defined']))
+        self.assertEqual(found, set(['pt', 'eta', 'n']))
+        self.assertEqual(chain.SetBranchStatus.call_args_list,
+                [mock.call('*', 0), mock.call('muon', 1), mock.call('n', 1)])
+        self.assertEqual(chain.AddBranchToCache.call_args_list,
+                [mock.call('muon', True), mock.call('n', True)])
+
+    def test_friends(self):
+        """
+        Friends are attached only if they provide columns not in the main chain
+        """
+        friends = [Ntuple('weights.root', 'tree', tag = 'weights'),
+                Ntuple('shifts.root', 'tree', tag = 'shifts'),
+                Ntuple('extra.root', 'tree', tag = 'extra')]
+        dataset = Dataset('ds', [Ntuple('main.root', 'tree', friends)])
+        branches = {
+            'main.root/tree': {'pt': 'pt', 'n': 'n'},
+            'weights.root/tree': {'w': 'w'},
+            'shifts.root/tree': {'pt': 'pt', 'pt_up': 'pt_up'},
+            'extra.root/tree': {'pt': 'pt'}}
+        ROOT = mock.MagicMock()
+        ROOT.TChain.side_effect = lambda: mock.MagicMock()
+        with mock.patch('ntupro.utils._run.load_root', return_value = ROOT), \
+                mock.patch('ntupro.utils._run.chain_branches',
+                        side_effect = lambda chain: branches[chain.Add.call_args[0][0]]):
+            chain, friend_tchains = rdf_from_dataset_helper(dataset, set(['pt', 'n', 'w', 'x']))
+            self.assertEqual([friend.Add.call_args[0][0] for friend in friend_tchains],
+                    ['weights.root/tree'])
+            chain.AddFriend.assert_called_once_with(friend_tchains[0])
+            # Without columns nothing is pruned
+            chain, friend_tchains = rdf_from_dataset_helper(dataset)
+            self.assertEqual(len(friend_tchains), 3)
+            chain.SetBranchStatus.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ntupro.utils import HistogramArrays, Results, parse_result_name
+
+
+@unittest.skipIf(numpy is None, 'numpy not available')
+class TestResults(unittest.TestCase):
+    """ Test the in-memory results of a run
+    """
+    def setUp(self):
+        names = ['ztt#mt-njets0#m_vis#Nominal', 'ztt#mt-njets0#m_vis#jecUp',
+                'zl#mt-njets0#m_vis#Nominal', 'zl#et#pt_1#Nominal']
+        histograms = [HistogramArrays(name, 'TH1D', numpy.array([0., 1., 2., 3.]),
+            fixed = (3, 0., 3.)) for name in names]
+        for i, histogram in enumerate(histograms):
+            histogram.contents[:] = [0.5, i, 2 * i, 3 * i, 0.5]
+        self.results = Results(histograms)
+
+    def test_parse_result_name(self):
+        """
+        Names built by Unit are split into their four parts
+        """
+        self.assertEqual(parse_result_name('ztt#mt-njets0#m_vis#Nominal'),
+                ('ztt', 'mt-njets0', 'm_vis', 'Nominal'))
+        self.assertEqual(parse_result_name('custom'), (None, None, 'custom', None))
+
+    def test_lookup(self):
+        """
+        Results are found by dataset, selections, action and variation
+        """
+        self.assertEqual(self.results.get('ztt', 'mt-njets0', 'm_vis', 'jecUp').GetName(),
+                'ztt#mt-njets0#m_vis#jecUp')
+        self.assertIsNone(self.results.get('ztt', 'et', 'm_vis'))
+        self.assertEqual(self.results.select(dataset = 'zl'),
+                ['zl#mt-njets0#m_vis#Nominal', 'zl#et#pt_1#Nominal'])
+        self.assertEqual(self.results.select(action = 'm_vis', variation = 'Nominal'),
+                ['ztt#mt-njets0#m_vis#Nominal', 'zl#mt-njets0#m_vis#Nominal'])
+        self.assertEqual(self.results.datasets(), ['zl', 'ztt'])
+        self.assertEqual(self.results.variations(), ['Nominal', 'jecUp'])
+        self.assertEqual(len(self.results), 4)
+
+    def test_views(self):
+        """
+        Bin contents are numpy views, with or without flow bins
+        """
+        name = 'zl#mt-njets0#m_vis#Nominal'
+        values = self.results.values(name)
+        self.assertEqual(values.tolist(), [2., 4., 6.])
+        self.assertEqual(self.results.values(name, flow = True).tolist(), [0.5, 2., 4., 6., 0.5])
+        values[0] = 10.
+        self.assertEqual(self.results[name].contents[1], 10.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import ROOT
+except ImportError:
+    ROOT = None
+
+from ntupro.utils import ShardedOutput, ShardedResults, Results, HistogramArrays
+from ntupro.utils._shards import shard_key
+
+
+class TestShardedOutput(unittest.TestCase):
+    """ Test the layout and the index of the sharded output
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_layout(self):
+        """
+        Results are stored in directories per dataset and variation
+        """
+        self.assertEqual(shard_key('ztt#mt-njets0#m_vis#jecUp'), ('ztt/jecUp', 'mt-njets0#m_vis'))
+        self.assertEqual(shard_key('custom'), ('', 'custom'))
+
+    def test_settings(self):
+        """
+        Compression settings follow the ROOT convention, wrong ones are rejected
+        """
+        self.assertEqual(ShardedOutput(self.directory, 'lzma', 9).compression_settings(), 209)
+        self.assertEqual(ShardedOutput(self.directory).compression_settings(), 505)
+        with self.assertRaises(ValueError):
+            ShardedOutput(self.directory, 'gzip')
+        with self.assertRaises(ValueError):
+            ShardedOutput(self.directory, 'zlib', 10)
+
+    def test_index(self):
+        """
+        The index maps every result to its shard and key
+        """
+        output = ShardedOutput(self.directory)
+        path = output.write_index({
+            'ztt#mt#m_vis#Nominal': ['shard_1.root', 'ztt/Nominal/mt#m_vis', 'TH1D'],
+            'zl#mt#m_vis#Nominal': ['shard_0.root', 'zl/Nominal/mt#m_vis', 'TH1D'],
+            'zl#mt#cutflow#Nominal': ['shard_0.root', 'zl/Nominal/mt#cutflow', 'TH1D'],
+            'zl#mt#bootstrap#Nominal': ['shard_0.root', 'zl/Nominal/mt#bootstrap', 'TH2D'],
+            'zl#mt#weight#Nominal': ['shard_0.root', 'zl/Nominal/mt#weight', 'TParameter<double>']})
+        results = Results.read(self.directory)
+        self.assertIsInstance(results, ShardedResults)
+        self.assertEqual(len(results), 5)
+        self.assertIn('ztt#mt#m_vis#Nominal', results)
+        self.assertEqual(results.keys['ztt#mt#m_vis#Nominal'], (1, 'ztt/Nominal/mt#m_vis'))
+        self.assertEqual(results.classes['zl#mt#bootstrap#Nominal'], 'TH2D')
+        self.assertEqual(sorted(results.select(dataset = 'zl', action = 'm_vis')), ['zl#mt#m_vis#Nominal'])
+        # Only 1D histograms are kept for the Customizer
+        histograms = ShardedResults(self.directory, classes = ['TH1D', 'TH1F'])
+        self.assertEqual(sorted(histograms), ['zl#mt#cutflow#Nominal',
+            'zl#mt#m_vis#Nominal', 'ztt#mt#m_vis#Nominal'])
+        with open(path) as f:
+            index = json.load(f)
+        index['version'] += 1
+        with open(path, 'w') as f:
+            json.dump(index, f)
+        with self.assertRaises(ValueError):
+            ShardedResults(path)
+
+    def test_nested_directories(self):
+        """
+        Results are written in the dataset/variation directory recorded in
+        the index, also the first one of each directory
+        """
+        class FakeDirectory:
+            # mkdir of a nested path returns the top directory, as in ROOT
+            def __init__(self, path = ''):
+                self.path = path
+                self.directories = dict()
+                self.written = list()
+            def GetDirectory(self, path):
+                directory = self
+                for name in path.split('/'):
+                    directory = directory.directories.get(name)
+                    if directory is None:
+                        return None
+                return directory
+            def mkdir(self, path, title = '', return_existing = False):
+                names = path.split('/')
+                if self.GetDirectory(path) is not None and not return_existing:
+                    return None
+                directory = self
+                for name in names:
+                    directory = directory.directories.setdefault(name,
+                        FakeDirectory((directory.path + '/' + name).lstrip('/')))
+                return self.directories[names[0]]
+            def WriteTObject(self, obj, key):
+                written.append((self.path + '/' + key).lstrip('/'))
+            def Close(self):
+                pass
+        written = list()
+        FakeROOT = mock.MagicMock()
+        FakeROOT.TFile.side_effect = lambda *args: FakeDirectory()
+        results = [mock.MagicMock() for _ in range(3)]
+        for result, name in zip(results, ['ztt#mt#m_vis#Nominal', 'ztt#et#m_vis#Nominal', 'custom']):
+            result.GetName.return_value = name
+            result.ClassName.return_value = 'TH1D'
+            del result.to_root
+        output = ShardedOutput(self.directory)
+        with mock.patch('ntupro.utils._shards.load_root', return_value = FakeROOT), \
+                mock.patch('ntupro.utils._shards.os.replace'):
+            entries = output.write_shard(0, results)
+        self.assertEqual(sorted([key for _, key, _ in entries.values()]), sorted(written))
+        self.assertEqual(written, ['ztt/Nominal/mt#m_vis', 'ztt/Nominal/et#m_vis', 'custom'])
+
+    @unittest.skipIf(ROOT is None, 'ROOT not available')
+    def test_round_trip(self):
+        """
+        Results written to shards are read back through the index
+        """
+        histograms = list()
+        for name in ['ztt#mt#m_vis#Nominal', 'ztt#mt#m_vis#jecUp', 'zl#mt#m_vis#Nominal']:
+            histogram = HistogramArrays(name, 'TH1D', [0., 1., 2.])
+            histogram.contents[:] = [0., 1., 2., 0.]
+            histograms.append(histogram)
+        output = ShardedOutput(self.directory)
+        entries = output.write_shard(0, histograms[:2])
+        entries.update(output.write_shard(1, histograms[2:]))
+        output.write_index(entries)
+        results = ShardedResults(self.directory, classes = ['TH1D', 'TH1F'])
+        self.assertEqual(len(results), 3)
+        for histogram in histograms:
+            self.assertEqual(results[histogram.name].GetBinContent(2), 2.)
+        results.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
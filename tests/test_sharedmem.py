@@ -0,0 +1,76 @@
+import os
+import unittest
+from multiprocessing import shared_memory
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ntupro.utils import HistogramArrays, export_results, import_results
+from ntupro.utils import block_name, release_blocks
+
+
+@unittest.skipIf(numpy is None, 'numpy not available')
+class TestSharedResults(unittest.TestCase):
+    """ Test the return of the histograms through shared memory
+    """
+    def setUp(self):
+        self.histogram = HistogramArrays('ds#sel#x#Nominal', 'TH1D',
+                numpy.linspace(0., 1., 30001), fixed = (30000, 0., 1.))
+        self.histogram.contents[:] = numpy.arange(30002)
+        self.histogram.sumw2[:] = 2 * numpy.arange(30002)
+        self.histogram.entries = 12.
+        self.cutflow = HistogramArrays('ds#sel#cutflow#Nominal', 'TH1D',
+                numpy.array([0., 1., 2.]), labels = ['ds', 'sel'])
+        self.cutflow.contents[:] = [0., 10., 5., 0.]
+        self.other = ('not', 'a', 'histogram')
+
+    def test_round_trip(self):
+        """
+        Only descriptors are pickled, contents come back from the block
+        """
+        shared = export_results([self.histogram, self.other, self.cutflow])
+        self.assertEqual(len(shared), 3)
+        self.assertEqual([d['offset'] for d in shared.descriptors], [0, 2 * 30002])
+        self.assertNotIn('contents', shared.descriptors[0])
+        results = import_results(shared)
+        self.assertEqual([result if isinstance(result, tuple) else result.GetName() \
+                for result in results],
+                ['ds#sel#x#Nominal', 'ds#sel#cutflow#Nominal', self.other])
+        self.assertTrue((results[0].contents == self.histogram.contents).all())
+        self.assertTrue((results[0].sumw2 == self.histogram.sumw2).all())
+        self.assertEqual(results[0].fixed, (30000, 0., 1.))
+        self.assertTrue(numpy.allclose(results[0].x_edges, self.histogram.x_edges))
+        self.assertIsNone(shared.descriptors[0]['x_edges'])
+        self.assertEqual(shared.descriptors[1]['x_edges'].tolist(), [0., 1., 2.])
+        self.assertEqual(results[0].entries, 12.)
+        self.assertEqual(results[1].labels, ['ds', 'sel'])
+        self.assertEqual(results[1].contents.tolist(), [0., 10., 5., 0.])
+        # The block is released once imported
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name = shared.block)
+
+    def test_no_histograms(self):
+        """
+        No block is allocated without histograms
+        """
+        shared = export_results([self.other])
+        self.assertIsNone(shared.block)
+        self.assertEqual(import_results(shared), [self.other])
+
+    def test_release_blocks(self):
+        """
+        Blocks of the tasks of a failed run are found by name and released
+        """
+        names = [block_name(os.getpid(), i) for i in range(3)]
+        shared = [export_results([self.cutflow], name) for name in names[:2]]
+        self.assertEqual([s.block for s in shared], names[:2])
+        release_blocks(names)
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name = name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import SkimCache, EntryListCache, graph_identifiers, cacheable
+from ntupro.utils import file_slices, prefix_candidates
+
+
+class TestSkimCache(unittest.TestCase):
+    """ Test the detection of the shared prefix and the bookkeeping of skims
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'file.root')
+        open(path, 'w').close()
+        self.dataset = Dataset('ds', [Ntuple(path, 'tree')])
+        trigger = Selection('trigger', cuts = [('trg == 1', 'trigger')])
+        units = [Unit(self.dataset, [trigger, Selection(name, cuts = [(cut, name)])],
+                [Histogram('pt', 'pt', (10, 0., 100.))])
+                for name, cut in [('low', 'pt < 50'), ('high', 'pt > 50')]]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(2)
+        self.graph = graph_manager.graphs[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_prefix(self):
+        """
+        The prefix stops where the paths branch off
+        """
+        self.assertEqual([node.name for node in self.graph.shared_prefix()], ['trigger'])
+
+    def test_lookup(self):
+        """
+        A skim is reused only for the same cuts and for known identifiers
+        """
+        cache = SkimCache(self.directory)
+        prefix = self.graph.shared_prefix()
+        selections = [node.unit_block for node in prefix]
+        identifiers = graph_identifiers(self.graph)
+        self.assertIsNone(cache.lookup(self.dataset, selections, identifiers))
+        request = cache.request(prefix[-1], self.dataset, selections, identifiers)
+        open(request.target, 'w').close()
+        request.columns = ['pt', 'trg']
+        cache.commit(request)
+        skim = cache.lookup(self.dataset, selections, identifiers)
+        self.assertEqual(skim.ntuples[0].directory, SkimCache.tree_name)
+        self.assertTrue(os.path.exists(skim.ntuples[0].path))
+        self.assertIsNone(cache.lookup(self.dataset, selections, identifiers | set(['eta'])))
+        other = [Selection('trigger', cuts = [('trg == 2', 'trigger')])]
+        self.assertIsNone(cache.lookup(self.dataset, other, identifiers))
+
+    def test_identifiers(self):
+        """
+        Graphs with the same prefix and different columns write different
+        skims, lookups pick the smallest one with all the columns needed
+        """
+        cache = SkimCache(self.directory)
+        prefix = self.graph.shared_prefix()
+        selections = [node.unit_block for node in prefix]
+        paths = list()
+        for identifiers in [set(['pt', 'trg']), set(['pt', 'trg', 'eta']), set(['phi', 'trg'])]:
+            request = cache.request(prefix[-1], self.dataset, selections, identifiers)
+            open(request.target, 'w').close()
+            request.columns = sorted(identifiers)
+            cache.commit(request)
+            paths.append(cache.lookup(self.dataset, selections, identifiers).ntuples[0].path)
+        self.assertEqual(len(set(paths)), 3)
+        self.assertEqual(cache.lookup(self.dataset, selections, set(['pt'])).ntuples[0].path, paths[0])
+        self.assertEqual(cache.lookup(self.dataset, selections, set(['eta'])).ntuples[0].path, paths[1])
+        self.assertIsNone(cache.lookup(self.dataset, selections, set(['pt', 'phi'])))
+
+    def test_remote_files(self):
+        """
+        Nothing is cached for files whose changes cannot be detected
+        """
+        cache = SkimCache(self.directory)
+        remote = Dataset('ds', [Ntuple('root://host//store/file.root', 'tree')])
+        selections = [node.unit_block for node in self.graph.shared_prefix()]
+        self.assertFalse(cacheable(remote))
+        self.assertTrue(cacheable(self.dataset))
+        self.assertIsNone(cache.request(None, remote, selections, set(['pt'])))
+        self.assertIsNone(cache.lookup(remote, selections, set(['pt'])))
+        self.assertFalse(EntryListCache(self.directory).available(remote, selections[0].cuts))
+
+    def test_entry_lists_missing(self):
+        """
+        Without recorded entry lists the chain is left untouched
+        """
+        cache = EntryListCache(self.directory)
+        selections = [node.unit_block for node in self.graph.shared_prefix()]
+        self.assertFalse(cache.available(self.dataset, selections[0].cuts))
+        self.assertIsNone(cache.replay(None, self.graph))
+
+    def test_file_slices(self):
+        """
+        Global entries are split by file and shifted to local entries
+        """
+        offsets = [0, 10, 10, 25]
+        entries = [1, 9, 12, 24]
+        slices = file_slices(entries, offsets)
+        self.assertEqual(slices, [(0, 2, 0), (2, 2, 10), (2, 4, 10)])
+        self.assertEqual([[entries[i] - offset for i in range(begin, end)]
+                for begin, end, offset in slices], [[1, 9], [], [2, 14]])
+        self.assertEqual(file_slices([], offsets), [(0, 0, 0), (0, 0, 10), (0, 0, 10)])
+
+    def test_prefix_candidates(self):
+        """
+        Only the nodes of the shared prefix with cuts are recorded and
+        replayed, with the cumulative cuts up to each of them
+        """
+        weight = Selection('weight', weights = [('w', 'weight')])
+        muons = Selection('muons', cuts = [('nMuon == 2', 'muons')])
+        units = [Unit(self.dataset, [Selection('trigger', cuts = [('trg == 1', 'trigger')]),
+                weight, muons, Selection(name, cuts = [(cut, name)])],
+                [Histogram('pt', 'pt', (10, 0., 100.))])
+                for name, cut in [('low', 'pt < 50'), ('high', 'pt > 50')]]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(2)
+        candidates = prefix_candidates(graph_manager.graphs[0])
+        self.assertEqual([node.name for node, _ in candidates], ['trigger', 'muons'])
+        self.assertEqual([[cut.expression for cut in cuts] for _, cuts in candidates],
+                [['trg == 1'], ['trg == 1', 'nMuon == 2']])
+
+    def test_replay_deepest(self):
+        """
+        The deepest node of the shared prefix recorded for all the files is replayed
+        """
+        cache = EntryListCache(self.directory)
+        trigger = Selection('trigger', cuts = [('trg == 1', 'trigger')])
+        muons = Selection('muons', cuts = [('nMuon == 2', 'muons')])
+        units = [Unit(self.dataset, [trigger, muons, Selection(name, cuts = [(cut, name)])],
+                [Histogram('pt', 'pt', (10, 0., 100.))])
+                for name, cut in [('low', 'pt < 50'), ('high', 'pt > 50')]]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(2)
+        graph = graph_manager.graphs[0]
+        for recorded, replayed in [(1, 'trigger'), (2, 'muons')]:
+            with mock.patch.object(EntryListCache, 'available',
+                    side_effect = lambda dataset, cuts: len(cuts) <= recorded), \
+                    mock.patch.object(EntryListCache, '_EntryListCache__set_entry_list',
+                    side_effect = lambda chain, dataset, node, cuts: node.name):
+                self.assertEqual(cache.replay(None, graph), replayed)
+
+
+if __name__ == '__main__':
+    unittest.main()
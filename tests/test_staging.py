@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import StagingCache, LocalSource, XRootDSource, ColumnarGraphRunner
+from ntupro.utils import replace_dataset, membership_expression
+
+
+class CorruptingSource(LocalSource):
+    """ Local source whose copies do not match the original checksum
+    """
+    def fetch(self, path, destination):
+        with open(path, 'rb') as original, open(destination, 'wb') as copy:
+            data = bytearray(original.read())
+            data[0] ^= 0xff
+            copy.write(data)
+
+
+class TestStagingCache(unittest.TestCase):
+    """ Test the staging of files with a local directory standing
+    in for the remote store
+    """
+    def setUp(self):
+        self.remote = tempfile.mkdtemp()
+        self.scratch = tempfile.mkdtemp()
+        self.files = list()
+        for i in range(3):
+            path = os.path.join(self.remote, 'file{}.root'.format(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1000))
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.remote)
+        shutil.rmtree(self.scratch)
+
+    def test_stage_and_reuse(self):
+        """
+        Staged copies are identical and reused by new caches on the same directory
+        """
+        local = StagingCache(self.scratch).stage(self.files[0])
+        self.assertTrue(local.startswith(self.scratch))
+        with open(local, 'rb') as staged, open(self.files[0], 'rb') as original:
+            self.assertEqual(staged.read(), original.read())
+        os.remove(self.files[0])
+        self.assertEqual(StagingCache(self.scratch).stage(self.files[0]), local)
+
+    def test_checksum(self):
+        """
+        Corrupted copies are rejected and not kept
+        """
+        cache = StagingCache(self.scratch, sources = [CorruptingSource()])
+        with self.assertRaises(IOError):
+            cache.stage(self.files[0])
+        self.assertEqual(cache.usage(), 0)
+
+    def test_lru_eviction(self):
+        """
+        The least recently used file is evicted when the quota is exceeded
+        """
+        cache = StagingCache(self.scratch, quota = 2500)
+        first = cache.stage(self.files[0])
+        second = cache.stage(self.files[1])
+        cache.stage(self.files[0])
+        cache.release(self.files[:2])
+        cache.stage(self.files[2])
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertEqual(cache.usage(), 2000)
+
+    def test_pinned_files(self):
+        """
+        Files in use are never evicted, the quota is never exceeded
+        """
+        cache = StagingCache(self.scratch, quota = 2500)
+        first = cache.stage(self.files[0])
+        second = cache.stage(self.files[1], pin = False)
+        cache.stage(self.files[2], pin = False)
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        with self.assertRaises(IOError):
+            # Both files are pinned now
+            cache.stage(self.files[2])
+            cache.stage(self.files[1])
+        self.assertLessEqual(cache.usage(), 2500)
+        cache.release(self.files)
+        cache.stage(self.files[1])
+        self.assertFalse(os.path.exists(first))
+
+    def test_dead_reservation(self):
+        """
+        Space reserved by a process which died while fetching is reclaimed
+        """
+        cache = StagingCache(self.scratch, quota = 2500)
+        with open(os.path.join(self.scratch, 'index.json'), 'w') as f:
+            json.dump({self.files[0]: {'local': os.path.join(self.scratch, 'lost'),
+                'size': 2000, 'last_used': 0., 'pending': 2 ** 22 + 1}}, f)  # Above the largest pid
+        open(os.path.join(self.scratch, 'lost.part'), 'w').close()
+        self.assertIsNone(cache.lookup(self.files[0]))
+        self.assertFalse(os.path.exists(os.path.join(self.scratch, 'lost.part')))
+        cache.stage(self.files[1])
+        cache.stage(self.files[2])
+        self.assertEqual(cache.usage(), 2000)
+
+    def test_stage_dataset(self):
+        """
+        Datasets staged in background point to the local copies, friends included
+        """
+        dataset = Dataset('ds', [Ntuple(self.files[0], 'tree',
+            [Ntuple(self.files[1], 'tree', tag = 'friend')])])
+        cache = StagingCache(self.scratch)
+        cache.prefetch([dataset])
+        staged = cache.stage_dataset(dataset)
+        self.assertEqual(staged.name, 'ds')
+        self.assertTrue(staged.ntuples[0].path.startswith(self.scratch))
+        self.assertTrue(staged.ntuples[0].friends[0].path.startswith(self.scratch))
+        self.assertEqual(dataset.ntuples[0].path, self.files[0])
+        cache.prefetcher.join()
+        cache.stop_prefetch()
+        self.assertEqual(cache.usage(), 2000)
+
+    def test_stop_prefetch(self):
+        """
+        Stopping the background staging interrupts the running copies and
+        removes their partial files and reservations
+        """
+        xrdcp = os.path.join(self.remote, 'xrdcp')
+        xrdfs = os.path.join(self.remote, 'xrdfs')
+        for path, body in [(xrdcp, 'touch "$4"\nexec sleep 60'), (xrdfs, 'echo "Size: 1000"')]:
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\n' + body + '\n')
+            os.chmod(path, 0o755)
+        cache = StagingCache(self.scratch, sources = [XRootDSource(xrdcp, xrdfs)])
+        dataset = Dataset('ds', [Ntuple('root://host//store/file{}.root'.format(i), 'tree') \
+                for i in range(3)])
+        cache.prefetch([dataset], nworkers = 1)
+        start = time.time()
+        while not any([name.endswith('.part') for name in os.listdir(self.scratch)]):
+            self.assertLess(time.time() - start, 10.)
+            time.sleep(0.05)
+        cache.stop_prefetch(timeout = 10.)
+        self.assertLess(time.time() - start, 10.)
+        self.assertEqual([name for name in os.listdir(self.scratch) if name.endswith('.part')], [])
+        self.assertEqual(cache.usage(), 0)
+
+    @unittest.skipIf(numpy is None, 'numpy not available')
+    def test_stage_merged_graph(self):
+        """
+        Memberships of merged graphs match the staged files
+        """
+        datasets = [Dataset('a', [Ntuple(self.files[0], 'tree'), Ntuple(self.files[1], 'tree')]),
+                Dataset('b', [Ntuple(self.files[1], 'tree'), Ntuple(self.files[2], 'tree')])]
+        units = [Unit(dataset, [Selection('sel', cuts = [('x > 0', 'positive')])],
+                [Histogram('x', 'x', (2, 0., 2.))]) for dataset in datasets]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(3)
+        graph = graph_manager.graphs[0]
+        self.assertEqual([child.kind for child in graph.children], ['membership', 'membership'])
+        cache = StagingCache(self.scratch)
+        staged = replace_dataset(graph, cache.stage_dataset(graph.unit_block))
+        self.assertEqual(graph.children[0].unit_block, datasets[0])
+        members = [child.unit_block for child in staged.children]
+        self.assertEqual([[ntuple.path for ntuple in member.ntuples] for member in members],
+                [[cache.lookup(path) for path in self.files[:2]],
+                 [cache.lookup(path) for path in self.files[1:]]])
+        self.assertIn(cache.lookup(self.files[0]), membership_expression(members[0]))
+        self.assertNotIn(self.files[0], membership_expression(members[0]))
+        runner = ColumnarGraphRunner(staged)
+        for ntuple in staged.unit_block.ntuples:
+            runner.process({'x': numpy.array([0.5, 1.5, -1.])}, ntuple)
+        self.assertEqual(sorted([result.contents.tolist() for result in runner.results.values()]),
+                [[0., 2., 2., 0.], [0., 2., 2., 0.]])
+
+
+if __name__ == '__main__':
+    unittest.main()
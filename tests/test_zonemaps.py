@@ -0,0 +1,95 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from ntupro.booking import Ntuple, Dataset, Selection, Histogram, Unit
+from ntupro.optimization import GraphManager
+from ntupro.utils import cut_constraints, SkimCache, ZoneMapCache, graph_identifiers
+from ntupro.utils._zonemaps import path_constraints, zone_may_pass, satisfiable
+
+
+class TestZoneMaps(unittest.TestCase):
+    """ Test the conservative analysis of the cuts against zone maps
+    """
+    def test_cut_constraints(self):
+        """
+        Only comparisons with constants combined with && give constraints
+        """
+        self.assertEqual(cut_constraints('(run >= 200000) && nMuon == 2'),
+                [('run', '>=', 200000.), ('nMuon', '==', 2.)])
+        self.assertEqual(cut_constraints('2.5f > abs(eta) && 10 < pt'), [('pt', '>', 10.)])
+        self.assertEqual(cut_constraints('run >= 200000 || nMuon == 2'), [])
+        self.assertEqual(cut_constraints('!(run >= 200000)'), [])
+        self.assertEqual(cut_constraints('run >= 2 ? x > 1 : x < 1'), [])
+
+    def test_literal_suffixes(self):
+        """
+        Single-precision literals are compared as floats, comparisons with
+        unsigned literals give no constraint
+        """
+        rounded = struct.unpack('f', struct.pack('f', 20.1))[0]
+        self.assertEqual(cut_constraints('pt <= 20.1f'), [('pt', '<=', rounded)])
+        self.assertEqual(cut_constraints('20.1F == pt'), [('pt', '==', rounded)])
+        self.assertTrue(satisfiable(cut_constraints('pt <= 20.1f')[0], rounded, rounded))
+        self.assertTrue(satisfiable(cut_constraints('pt == 20.1f')[0], rounded, rounded))
+        self.assertEqual(cut_constraints('pt <= 20.1'), [('pt', '<=', 20.1)])
+        self.assertEqual(cut_constraints('charge > 0u && run >= 2'), [('run', '>=', 2.)])
+        self.assertEqual(cut_constraints('1U < charge'), [])
+        self.assertEqual(cut_constraints('run >= 200000L'), [('run', '>=', 200000.)])
+
+    def test_skip_zones(self):
+        """
+        A zone is skipped only if no path can have passing entries
+        """
+        dataset = Dataset('ds', [Ntuple('file.root', 'tree')])
+        units = [Unit(dataset, [Selection(name, cuts = [(cut, name)])],
+                [Histogram('pt', 'pt', (10, 0., 100.))])
+                for name, cut in [('early', 'run < 100'), ('late', 'run > 300 && pt > 20')]]
+        graph_manager = GraphManager(units)
+        graph_manager.optimize(2)
+        paths = path_constraints(graph_manager.graphs[0])
+        self.assertEqual(len(paths), 2)
+        self.assertFalse(zone_may_pass(paths, {'run': (150, 250), 'pt': (0., 50.)}))
+        self.assertTrue(zone_may_pass(paths, {'run': (50, 250), 'pt': (0., 50.)}))
+        self.assertFalse(zone_may_pass(paths, {'run': (350, 400), 'pt': (0., 10.)}))
+        self.assertTrue(zone_may_pass(paths, {'run': (350, 400), 'pt': (float('nan'), float('nan'))}))
+
+    def test_zones_of_skims(self):
+        """
+        Loops writing a skim only skip the zones failing the shared prefix,
+        so that the skim is complete for graphs with other downstream cuts
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'file.root')
+            open(path, 'w').close()
+            dataset = Dataset('ds', [Ntuple(path, 'tree')])
+            trigger = Selection('trigger', cuts = [('run > 300', 'trigger')])
+            units = [Unit(dataset, [trigger, Selection(name, cuts = [(cut, name)])],
+                    [Histogram('pt', 'pt', (10, 0., 100.))])
+                    for name, cut in [('low', 'pt < 20'), ('high', 'pt > 80')]]
+            graph_manager = GraphManager(units)
+            graph_manager.optimize(2)
+            graph = graph_manager.graphs[0]
+            prefix = graph.shared_prefix()
+            skims = SkimCache(os.path.join(directory, 'skims'))
+            request = skims.request(prefix[-1], dataset, [node.unit_block for node in prefix],
+                    graph_identifiers(graph))
+            self.assertIsNotNone(request)
+            zones = {'starts': [0, 10, 20, 30], 'columns': {
+                'run': [[400, 500], [100, 200], [400, 500]],
+                'pt': [[30, 60], [0, 100], [0, 10]]}}
+            zone_maps = ZoneMapCache(os.path.join(directory, 'zones'))
+            with mock.patch.object(ZoneMapCache, 'zone_map', return_value = zones):
+                self.assertEqual(zone_maps.kept_ranges(dataset, graph), [[(20, 30)]])
+                self.assertEqual(zone_maps.kept_ranges(dataset, graph, prefix_only = True),
+                        [[(0, 10), (20, 30)]])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()